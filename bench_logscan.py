@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""Benchmark of the ways reports.py can read transfer.log: the old tail-based path (reports.tail,
+then filtering strings), the streaming path (reports.iter_logsince), and the memory-mapped
+bytes-regex path (reports.iter_logsince with fast=True).  A synthetic transfer.log is written
+first, by default 15 million lines of which about 5% are counted by reports.py.
+Each path's lines are passed to the same accumulators, and their results are compared.
+Usage:
+  bench_logscan.py [--lines 15000000] [--log /tmp/bench_transfer.log]
+"""
+
+import sys, os, time, random, argparse
+from datetime import datetime, timedelta
+import reports
+
+def write_synthetic_log( path, nlines ):
+    """Writes a synthetic transfer.log of nlines lines, beginning 2024-01-01 00:00:00."""
+    random.seed( 12345 )
+    nodes = [ 'http://esgf.ceda.ac.uk', 'gsiftp://gridftp.ipsl.upmc.fr:2811',
+              'http://vesg.ipsl.upmc.fr', 'http://esgf3.dkrz.de', 'gsiftp://esgf3.dkrz.de:2811',
+              'http://esg1.umr-cnrm.fr', 'http://crd-esgf-drc.ec.gc.ca' ]
+    errs = [ "Connection timed out", "ERROR 404: Not Found", "Connection refused",
+             "File corruption detected", "sdget_status=7", "an error nobody has seen before" ]
+    t = datetime( 2024, 1, 1 )
+    with open( path, 'w' ) as f:
+        for i in range(nlines):
+            t += timedelta( milliseconds=random.randint(0,40) )
+            ts = t.strftime('%Y-%m-%d %H:%M:%S') + ',%03d' % (t.microsecond//1000)
+            url = random.choice(nodes) + '/thredds/fileServer/CMIP6/x/%d.nc' % i
+            r = random.random()
+            if r<0.03:
+                f.write( "%s INFO  SDDMDEFA-101 Transfer done (file_id=%d,url=%s)\n" % (ts,i,url) )
+            elif r<0.045:
+                f.write( "%s ERROR SDDMDEFA-102 Transfer failed (file_id=%d,url=%s) %s\n" %
+                         (ts,i,url,random.choice(errs)) )
+            elif r<0.05:
+                f.write( "%s INFO  SDDMDEFA-108 Url successfully switched (old_url=%s,new_url=%s)\n"
+                         % (ts,url,random.choice(nodes)+'/x/%d.nc'%i) )
+            else:
+                f.write( "%s DEBUG SDDMDEFA-001 item processed (file_id=%d)\n" % (ts,i) )
+
+def accumulators():
+    return [ reports.LineCounter(), reports.DoneCounter(), reports.ErrorCounter(max_unknown=4),
+             reports.FallbackCounter(), reports.TransferErrorLines() ]
+
+def results( accs ):
+    """The accumulators' results, except for the line count, in a comparable form."""
+    linec, donec, errc, fbc, terrs = accs
+    return ( donec.dn_done, errc.errdict, errc.dn_errs, errc.nunknown, fbc.fb_dict, terrs.lines )
+
+def tail_path( log, starttime, nlines ):
+    """The way reports.logsince worked before checkpoints and bisection."""
+    lastlines = reports.tail( log, nlines )
+    datedlines = [ l for l in lastlines if l[0:4]==starttime[0:4] or
+                   l[0:4]==str(int(starttime[0:4])+1) ]
+    sincelines = [ l for l in datedlines if l[:19]>=starttime[:19] ]
+    return reports.scan( sincelines, accumulators() )
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser( description="Benchmark transfer.log scanning in reports.py" )
+    p.add_argument( "--lines", type=int, default=15000000 )
+    p.add_argument( "--log", default="/tmp/bench_transfer.log" )
+    args = p.parse_args( sys.argv[1:] )
+
+    if not os.path.isfile(args.log):
+        print("writing", args.lines, "lines to", args.log)
+        write_synthetic_log( args.log, args.lines )
+    starttime = '2024-01-01 00:00:00'
+
+    timings = []
+    t0 = time.time()
+    tail_accs = tail_path( args.log, starttime, args.lines )
+    timings.append( ('tail', time.time()-t0, tail_accs) )
+    t0 = time.time()
+    stream_accs = reports.scan( reports.iter_logsince( args.log, starttime ), accumulators() )
+    timings.append( ('streaming', time.time()-t0, stream_accs) )
+    t0 = time.time()
+    mmap_accs = reports.scan( reports.iter_logsince( args.log, starttime, fast=True ),
+                              accumulators() )
+    timings.append( ('mmap', time.time()-t0, mmap_accs) )
+
+    for name, seconds, accs in timings:
+        same = results(accs)==results(tail_accs)
+        print("{:10} {:8.2f} s  {:10d} lines passed on  {}".format(
+            name, seconds, accs[0].count, "same results" if same else "DIFFERENT RESULTS" ))
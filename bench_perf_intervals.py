@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""Benchmark of synda-perf.py's computation of downloading time, i.e. the union of the time
+intervals in which files were being downloaded: the original downloading_intervals, and the NumPy
+version downloading_intervals_np.  The intervals are synthetic, by default 1 million files
+downloaded over a week, with start_date and end_date strings like those in the Synda database.
+The two results must be identical.
+Usage:
+  bench_perf_intervals.py [--files 1000000]
+"""
+
+import sys, time, random, argparse, importlib
+from datetime import datetime, timedelta
+perf = importlib.import_module( 'synda-perf' )
+
+def synthetic_intervals( nfiles, start, stop ):
+    """Returns a list of nfiles tuples (start_date, end_date, size) within [start,stop), like
+    those read from the Synda database by perf_data().  Most files take seconds to minutes;
+    a few take hours.  The downloads come in bursts, so there are idle periods too."""
+    random.seed( 12345 )
+    span = (stop-start).total_seconds()
+    nbursts = 200
+    bursts = sorted([ random.uniform(0,span) for i in range(nbursts) ])
+    file_intervals = []
+    for i in range(nfiles):
+        t0 = start + timedelta( seconds=random.choice(bursts)+random.expovariate(1/1800.) )
+        if random.random()<0.001:
+            duration = random.uniform( 3600, 4*3600 )
+        else:
+            duration = random.expovariate( 1/60. )
+        t1 = t0 + timedelta( seconds=duration )
+        if t1>=stop:
+            continue
+        # Synda writes fractional seconds unless they are zero.
+        fmt = '%Y-%m-%d %H:%M:%S.%f' if random.random()<0.99 else '%Y-%m-%d %H:%M:%S'
+        file_intervals.append( ( t0.strftime(fmt), t1.strftime(fmt), random.randint(1,2**31) ) )
+    return file_intervals
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser( description="Benchmark synda-perf downloading_intervals" )
+    p.add_argument( "--files", type=int, default=1000000 )
+    args = p.parse_args( sys.argv[1:] )
+
+    start, stop = '2019-01-21 00:00', '2019-01-28 00:00'
+    print("making", args.files, "synthetic intervals")
+    file_intervals = synthetic_intervals( args.files, perf.str2time(start), perf.str2time(stop) )
+
+    t0 = time.time()
+    active_time = perf.downloading_intervals( start, stop, file_intervals )
+    t1 = time.time()
+    active_time_np = perf.downloading_intervals_np( start, stop, file_intervals )
+    t2 = time.time()
+    print("{:25} {:8.2f} s  active time {!r} s".format(
+        'downloading_intervals', t1-t0, active_time ))
+    print("{:25} {:8.2f} s  active time {!r} s".format(
+        'downloading_intervals_np', t2-t1, active_time_np ))
+    print("identical" if active_time_np==active_time else "DIFFERENT RESULTS")
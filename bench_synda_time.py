@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""Microbenchmark of the time parsers in synda_time.py, on synthetic Synda times such as
+'2019-01-25 13:04:13.922788', by default a million of them: strptime_time (the old
+synda-perf.str2time, trying up to three formats), str2time, cached_str2time on times which
+recur, and str2datetime64.  The results of each are checked against strptime_time.
+Usage:
+  bench_synda_time.py [--times 1000000] [--distinct 100000]
+"""
+
+import sys, time, random, argparse
+from datetime import datetime, timedelta
+import numpy as np
+import synda_time
+
+def synthetic_times( ntimes ):
+    """Returns a list of ntimes time strings, mostly with microseconds as Synda writes them,
+    but some with only seconds or minutes."""
+    random.seed( 12345 )
+    t0 = datetime( 2019, 1, 1 )
+    times = []
+    for i in range(ntimes):
+        t = t0 + timedelta( seconds=random.uniform(0,365*86400) )
+        r = random.random()
+        if r<0.9:
+            times.append( t.strftime('%Y-%m-%d %H:%M:%S.%f') )
+        elif r<0.97:
+            times.append( t.strftime('%Y-%m-%d %H:%M:%S') )
+        else:
+            times.append( t.strftime('%Y-%m-%d %H:%M') )
+    return times
+
+def timed( name, parse, times, expected ):
+    t0 = time.time()
+    parsed = parse( times )
+    seconds = time.time()-t0
+    same = parsed==expected
+    print("{:16} {:8.3f} s  {}".format( name, seconds, "same" if same else "DIFFERENT RESULTS" ))
+    return seconds
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser( description="Benchmark the time parsers of synda_time.py" )
+    p.add_argument( "--times", type=int, default=1000000 )
+    p.add_argument( "--distinct", type=int, default=100000,
+                    help="number of distinct times, for cached_str2time" )
+    args = p.parse_args( sys.argv[1:] )
+
+    times = synthetic_times( args.times )
+    random.seed( 54321 )
+    distinct = times[:args.distinct]
+    repeated = [ random.choice(distinct) for i in range(args.times) ]
+
+    t0 = time.time()
+    expected = [ synda_time.strptime_time(t) for t in times ]
+    base = time.time()-t0
+    print("{:16} {:8.3f} s".format( 'strptime_time', base ))
+    fast = timed( 'str2time', (lambda ts: [ synda_time.str2time(t) for t in ts ]),
+                  times, expected )
+    expected_repeated = [ synda_time.strptime_time(t) for t in repeated ]
+    cached = timed( 'cached_str2time', (lambda ts: [ synda_time.cached_str2time(t) for t in ts ]),
+                    repeated, expected_repeated )
+    bulk = timed( 'str2datetime64',
+                  (lambda ts: synda_time.str2datetime64(ts).astype(datetime).tolist()),
+                  times, expected )
+    print("speedups over strptime_time: str2time {:.1f}x, cached_str2time {:.1f}x "
+          "(with {} distinct times), str2datetime64 {:.1f}x".format(
+              base/fast, base/cached, args.distinct, base/bulk ))
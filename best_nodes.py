@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""Ranks data nodes by their recent performance, and writes the "best nodes" selection files
+used by standard_installs.sh for high-frequency data, e.g. CMIP6-day-bestnodes-gridftp-*.txt
+and CMIP6-day-bestnodes-http-*.txt.
+Each data node (as in the data_node column of the database) and protocol is measured over a
+trailing window, by default the last week: its aggregate download rate as computed by
+synda-perf.py, and its error rate, i.e. the fraction of its transfers which failed, from the
+transfer.log counts of reports.py.  Nodes with too few files or too many errors are dropped,
+and the rest are ranked by rate*(1-error rate), i.e. the rate of useful downloads.
+Each selection file is made from the hand-maintained one for the same frequency and protocol
+(--base-date), with its data_node line replaced by the best nodes; or from a string.Template
+given by --template.  If no nodes qualify for a protocol, its files are copies of the
+hand-maintained ones, so standard_installs.sh falls back protocol by protocol.  The exit status
+is 1 if a selection file couldn't be made.  For example:
+  best_nodes.py --frequencies day 6hr --top 8 --date 2023.08.02
+"""
+
+import os, sys, argparse, importlib, string
+import datetime
+import reports
+perf = importlib.import_module( 'synda-perf' )
+
+SelectionDir = os.path.expanduser( '~/selection_files' )
+# File name of a selection file; {date} is --date, normally like 2023.08.02.
+selection_name = 'CMIP6-{frequency}-bestnodes-{protocol}-{date}.txt'
+# The date in the names of the hand-maintained selection files:
+BaseDate = '2023.08.02'
+# The protocol of each url scheme, as Synda names it:
+protocols = { 'gsiftp': 'gridftp', 'http': 'http', 'https': 'http' }
+
+def node_key( url_hdr ):
+    """The url header of a data node, as in reports.py, i.e. without the GridFTP port."""
+    return url_hdr.replace( ':2811', '' )
+
+def url_protocol( url ):
+    """The protocol of a url or url header, as Synda names it, e.g. 'gridftp' for gsiftp://..."""
+    scheme = url[:url.find('://')]
+    return protocols.get( scheme, scheme )
+
+def node_files( start, stop ):
+    """Returns a list of (url, data_node, start_date, end_date, size) for the files downloaded
+    between 'start' and 'stop', chosen as by synda-perf.perf_files.  This is one query."""
+    cmd = ("SELECT url, data_node, start_date, end_date, size FROM file WHERE start_date>='{0}' "+
+           "AND end_date<='{1}' AND (status='done' OR status='published') AND size IS NOT NULL"
+           ).format( start, stop )
+    perf.curs.execute( cmd )
+    return perf.curs.fetchall()
+
+def node_rates( start, stop, files=None ):
+    """Returns a dict whose keys are (protocol, data_node) and values (aggregate rate in MiB/s,
+    number of files) for the files downloaded between 'start' and 'stop'; see
+    synda-perf.perf_data.  The data_node is from the data_node column, which for GridFTP often
+    isn't the host in the url.  Also returns a dict whose keys are the url headers seen (see
+    node_key) and values their (protocol, data_node), for matching the counts of node_errors.
+    The files are those of node_files, unless a list like it is supplied."""
+    if files is None:
+        files = node_files( start, stop )
+    bynode = {}
+    hdrs = {}
+    for (url, data_node, start_date, end_date, size) in files:
+        if data_node is None:
+            continue
+        key = ( url_protocol(url), data_node )
+        bynode.setdefault( key, [] ).append( (start_date,end_date,size) )
+        hdrs[ node_key( perf.url_hdr(url) ) ] = key
+    rates = {}
+    for key, results in bynode.items():
+        rate, spf, size, avgsize, nfiles = perf.perf_compute( start, stop, key[1], results )
+        if rate is not None:
+            rates[key] = ( rate, nfiles )
+    return rates, hdrs
+
+def node_errors( start, stop, rollupdb=reports.RollupDB ):
+    """Returns a dict whose keys are url headers and values (done files, failed files), counted
+    from transfer.log between 'start' and 'stop'.  The counts are mostly from hourly rollups, as
+    with reports.py, unless rollupdb is None; then they're all read from transfer.log.
+    A transfer which failed with more than one known error counts once for each error."""
+    start = start.replace('T',' ')
+    stop = stop.replace('T',' ')
+    if rollupdb is None:
+        accs = reports.scan( reports.iter_logsince( reports.TransferLOG, start, None, stop ),
+                             reports.report_accumulators() )
+    else:
+        accs, nhours = reports.rollup_report( reports.TransferLOG, start, rollupdb,
+                                              stoptime=stop )
+    linec, donec, errc, fbc, terrs, tmplc = reports.report_results( accs )
+    counts = {}
+    for dn in set(donec.dn_done) | set(errc.dn_errs):
+        counts[dn] = ( donec.dn_done.get(dn,0), sum( errc.dn_errs.get(dn,{}).values() ) )
+    return counts
+
+def data_node_errors( errors, hdrs ):
+    """Given the counts of node_errors, keyed by url header, returns them keyed by
+    (protocol, data_node) instead, using hdrs from node_rates.  Url headers not in hdrs, i.e.
+    with no recent downloads, are dropped."""
+    counts = {}
+    for hdr, (done, failed) in errors.items():
+        key = hdrs.get( node_key(hdr) )
+        if key is not None:
+            d, f = counts.get( key, (0,0) )
+            counts[key] = ( d+done, f+failed )
+    return counts
+
+def rank_nodes( rates, errors, min_files=100, max_error_rate=0.2 ):
+    """Returns a list of (protocol, data_node, rate in MiB/s, number of files, error rate, rate of
+    useful downloads in MiB/s), best first, from the results of node_rates and
+    data_node_errors.  Nodes with fewer than min_files downloaded, or an error rate above
+    max_error_rate, are omitted."""
+    ranked = []
+    for (protocol, data_node), (rate, nfiles) in rates.items():
+        done, failed = errors.get( (protocol,data_node), (0,0) )
+        error_rate = failed/float(done+failed) if done+failed>0 else 0.
+        if nfiles<min_files or error_rate>max_error_rate:
+            continue
+        ranked.append( ( protocol, data_node, rate, nfiles, error_rate, rate*(1-error_rate) ) )
+    ranked.sort( key=(lambda r: ( -r[5], r[1], r[0] )) )
+    return ranked
+
+def best_nodes( ranked, protocol, top ):
+    """Returns the best top entries of ranked (from rank_nodes) which use the protocol."""
+    return [ r for r in ranked if r[0]==protocol ][:top]
+
+def ranking_comment( nodes ):
+    """Comment lines describing nodes, a list from best_nodes."""
+    return '\n'.join([ "#   {:40} {:8.2f} MiB/s {:6d} files {:6.1%} errors".format(
+        data_node, rate, nfiles, error_rate )
+        for (protocol,data_node,rate,nfiles,error_rate,goodput) in nodes ])
+
+def selection_text( base, nodes, start, stop ):
+    """Returns the text of a selection file made from base, the text of a hand-maintained one,
+    by replacing its data_node lines with one listing the data nodes of nodes (a list from
+    best_nodes), separated by spaces.  Everything else in base is kept, after a comment saying
+    where the nodes came from.  A data_node line may be continued on following indented lines
+    without '='; they're replaced too.  If base has no data_node line, one is added at the end."""
+    header = "# Best data nodes, written by best_nodes.py on {} from the rates between {} and {}.\n"\
+             "# Best first:\n{}\n".format( datetime.date.today().isoformat(), start, stop,
+                                           ranking_comment(nodes) )
+    data_node_line = 'data_node=' + ' '.join([ r[1] for r in nodes ]) + '\n'
+    lines = []
+    in_data_node = False
+    for line in base.splitlines( True ):
+        if line.replace(' ','').startswith('data_node='):
+            in_data_node = True
+            if data_node_line is not None:
+                lines.append( data_node_line )
+                data_node_line = None
+        elif in_data_node and line[:1].isspace() and line.strip()!='' and line.find('=')<0:
+            pass    # continuation of the data_node line
+        else:
+            in_data_node = False
+            lines.append( line )
+    if data_node_line is not None:
+        if len(lines)>0 and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        lines.append( data_node_line )
+    return header + ''.join( lines )
+
+def template_text( template, frequency, protocol, nodes, start, stop ):
+    """Returns the text of a selection file, by substituting into template (a string.Template):
+    $frequency, $protocol, $data_nodes (the data nodes of nodes, a list from best_nodes,
+    separated by spaces), $ranking (a comment line for each node), $start, $stop, and $today."""
+    return template.substitute(
+        frequency=frequency, protocol=protocol, ranking=ranking_comment(nodes),
+        data_nodes=' '.join([ r[1] for r in nodes ]),
+        start=start, stop=stop, today=datetime.date.today().isoformat() )
+
+def write_selection_files( texts ):
+    """texts is a dict whose keys are paths and values the texts of selection files.  Each file
+    is written to a temporary file first, and renamed only when all have been written."""
+    for path, text in texts.items():
+        with open( path+'.tmp', 'w' ) as f:
+            f.write( text )
+    for path in texts:
+        os.replace( path+'.tmp', path )
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description="Writes best-nodes selection files from recent data node performance" )
+    p.add_argument( "start", nargs='?', default=None,
+                    help="start of the trailing window, e.g. '2019-01-25 13:04'.  You can use a "+
+                    "T instead of a space.  Default is a week before stop." )
+    p.add_argument( "stop", nargs='?', default=None, help="end of the window, default now" )
+    p.add_argument( "--frequencies", nargs='+', default=['day','6hr'],
+                    help="frequencies to write selection files for, default day 6hr" )
+    p.add_argument( "--protocols", nargs='+', default=['gridftp','http'],
+                    help="protocols to write selection files for, default gridftp http" )
+    p.add_argument( "--top", type=int, default=10,
+                    help="number of data nodes in each selection file, default 10" )
+    p.add_argument( "--min-files", dest="min_files", type=int, default=100,
+                    help="ignore data nodes with fewer files downloaded, default 100" )
+    p.add_argument( "--max-error-rate", dest="max_error_rate", type=float, default=0.2,
+                    help="ignore data nodes with a larger fraction of failed transfers, "+
+                    "default 0.2" )
+    p.add_argument( "--base-date", dest="base_date", default=BaseDate,
+                    help="date in the names of the hand-maintained selection files which the "+
+                    "new ones are made from, and copied if no nodes qualify; default %s" %
+                    BaseDate )
+    p.add_argument( "--template", default=None,
+                    help="file containing a string.Template for the selection files (see "+
+                    "best_nodes.template_text), to use instead of the hand-maintained files" )
+    p.add_argument( "--dir", default=SelectionDir,
+                    help="directory for the selection files, default %s" % SelectionDir )
+    p.add_argument( "--date", default=datetime.date.today().strftime('%Y.%m.%d'),
+                    help="date (or other tag) in the selection file names, default today, "+
+                    "e.g. "+selection_name.format( frequency='day', protocol='http',
+                                                   date='2023.08.02' ) )
+    p.add_argument( "--no-rollup", dest="rollup", action="store_const", const=None,
+                    default=reports.RollupDB,
+                    help="count errors by reading transfer.log; don't use rollups" )
+    p.add_argument( "--dry-run", dest="dry_run", action="store_true",
+                    help="print the ranking, but don't write selection files" )
+    args = p.parse_args( sys.argv[1:] )
+    if args.stop is None:
+        stop = datetime.datetime.now().strftime( '%Y-%m-%d %H:%M' )
+    else:
+        stop = args.stop.replace('T',' ')
+    if args.start is None:
+        start = ( perf.str2time(stop) - datetime.timedelta(days=7) ).strftime( '%Y-%m-%d %H:%M' )
+    else:
+        start = args.start.replace('T',' ')
+    if args.date==args.base_date:
+        p.error( "--date must differ from --base-date, so the hand-maintained files are kept" )
+    if args.template is None:
+        template = None
+    else:
+        with open( args.template ) as f:
+            template = string.Template( f.read() )
+
+    perf.setup()
+    rates, hdrs = node_rates( start, stop )
+    perf.finish()
+    errors = data_node_errors( node_errors( start, stop, args.rollup ), hdrs )
+    ranked = rank_nodes( rates, errors, args.min_files, args.max_error_rate )
+    print("data nodes ranked by the rate of useful downloads between", start, "and", stop)
+    for (protocol, data_node, rate, nfiles, error_rate, goodput) in ranked:
+        print("{:8} {:40} {:8.2f} MiB/s {:6d} files {:6.1%} errors {:8.2f} MiB/s useful".format(
+            protocol, data_node, rate, nfiles, error_rate, goodput ))
+
+    texts = {}
+    failed = False
+    for protocol in args.protocols:
+        nodes = best_nodes( ranked, protocol, args.top )
+        if len(nodes)==0:
+            print("No data nodes qualify for", protocol, "- using the hand-maintained files")
+        for frequency in args.frequencies:
+            path = os.path.join( args.dir, selection_name.format(
+                frequency=frequency, protocol=protocol, date=args.date ) )
+            base_path = os.path.join( args.dir, selection_name.format(
+                frequency=frequency, protocol=protocol, date=args.base_date ) )
+            if template is not None and len(nodes)>0:
+                texts[path] = template_text( template, frequency, protocol, nodes, start, stop )
+            elif os.path.isfile( base_path ):
+                with open( base_path ) as f:
+                    base = f.read()
+                texts[path] = selection_text( base, nodes, start, stop ) if len(nodes)>0 else base
+            else:
+                print("No", base_path, "- can't make", path)
+                failed = True
+    if args.dry_run:
+        for path in sorted(texts):
+            print("\n"+path+":")
+            sys.stdout.write( texts[path] )
+    else:
+        write_selection_files( texts )
+        for path in sorted(texts):
+            print("wrote", path)
+    if failed:
+        sys.exit(1)
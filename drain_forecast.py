@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""Forecasts how long it will take to download the files now waiting in the Synda queue.
+For each data_node, the total size of its waiting files is divided by its aggregate download
+rate over a recent period, computed as by synda-perf.py (see downloading_intervals there).
+The overall time is the total size of all waiting files divided by the overall aggregate rate.
+These are rough estimates; they assume that each data node will keep up its recent rate, and
+a data node with no recent downloads has no estimate.
+The recent period is given by a start time and stop time, as for synda-perf.py; by default it
+is the week ending now.  For example:
+  drain_forecast.py 2019-01-21T00:00 2019-01-28T00:00
+"""
+
+import sys, argparse, importlib
+import datetime
+perf = importlib.import_module( 'synda-perf' )
+
+def waiting_sizes():
+    """Returns a dict whose keys are data nodes, and values (number of waiting files, total size
+    of those files in bytes), from one query.  A file whose size is unknown counts as 0 bytes.
+    Files with no data_node are counted under '(none)'."""
+    cmd = "SELECT data_node, COUNT(*), SUM(size) FROM file WHERE status='waiting' "+\
+          "GROUP BY data_node"
+    perf.curs.execute( cmd )
+    return { data_node or '(none)': (nfiles, size or 0)
+             for (data_node,nfiles,size) in perf.curs.fetchall() }
+
+def recent_files( start, stop ):
+    """Returns a list of (data_node, start_date, end_date, size) for the files downloaded between
+    'start' and 'stop', chosen as by synda-perf.perf_files but by data_node rather than url; the
+    url's host can differ from the data_node, e.g. for GridFTP.  This is one query."""
+    cmd = ("SELECT data_node, start_date, end_date, size FROM file WHERE start_date>='{0}' AND "+\
+           "end_date<='{1}' AND (status='done' OR status='published') AND size IS NOT NULL"
+           ).format( start, stop )
+    perf.curs.execute( cmd )
+    return perf.curs.fetchall()
+
+def recent_rates( start, stop ):
+    """Returns the overall aggregate download rate between 'start' and 'stop' in MiB/s, and a dict
+    whose keys are data nodes (as in the data_node column, like waiting_sizes) and values their
+    aggregate download rates in MiB/s.  All protocols used for a data node are counted together.
+    The files come from one query; see recent_files."""
+    files = recent_files( start, stop )
+    bynode = {}
+    for (dn,start_date,end_date,size) in files:
+        dn = dn or '(none)'     # as in waiting_sizes
+        if dn not in bynode:
+            bynode[dn] = []
+        bynode[dn].append( (start_date,end_date,size) )
+    rate = perf.perf_compute( start, stop, '%',
+        [ (start_date,end_date,size) for (dn,start_date,end_date,size) in files ] )[0]
+    rates = { dn: perf.perf_compute( start, stop, dn, results )[0]
+              for dn, results in bynode.items() }
+    return rate, rates
+
+def drain_seconds( size, rate ):
+    """Returns the time, in seconds, to download size bytes at rate MiB/s; or None if the rate
+    is unknown or zero."""
+    if not rate:
+        return None
+    return size/1024./1024/rate
+
+def duration_for_people( seconds ):
+    """Formats a number of seconds as days and hours, e.g. '3d 04h', or hours and minutes if it's
+    less than a day."""
+    if seconds is None:
+        return 'unknown'
+    minutes = int( round( seconds/60. ) )
+    hours, minutes = divmod( minutes, 60 )
+    days, hours = divmod( hours, 24 )
+    if days>0:
+        return "{}d {:02d}h".format( days, hours )
+    return "{}h {:02d}m".format( hours, minutes )
+
+def forecast( start, stop ):
+    """Returns a list of (data_node, number of waiting files, waiting GiB, recent rate in MiB/s,
+    time to drain in seconds), longest time first and data nodes with no estimate last; and the
+    same tuple for all data nodes together, with data_node 'all'."""
+    rate, rates = recent_rates( start, stop )
+    return forecast_rows( waiting_sizes(), rate, rates )
+
+def forecast_rows( waiting, rate, rates ):
+    """Returns the results of forecast, from the results of waiting_sizes and recent_rates."""
+    rows = [ ( dn, nfiles, size/1024./1024/1024, rates.get(dn),
+               drain_seconds( size, rates.get(dn) ) )
+             for dn, (nfiles,size) in waiting.items() ]
+    rows.sort( key=(lambda row: ( row[4] is None, -(row[4] or 0), row[0] or '' )) )
+    nfiles = sum([ nf for (nf,size) in waiting.values() ])
+    size = sum([ size for (nf,size) in waiting.values() ])
+    total = ( 'all', nfiles, size/1024./1024/1024, rate, drain_seconds( size, rate ) )
+    return rows, total
+
+def print_forecast( rows, total ):
+    print("{:30} {:>8} {:>10} {:>10} {:>10}".format(
+        'data_node', 'files', 'GiB', 'MiB/s', 'drain' ))
+    for (dn, nfiles, size, rate, seconds) in rows + [total]:
+        print("{:30} {:8d} {:10.2f} {:>10} {:>10}".format(
+            dn or '', nfiles, size, 'none' if rate is None else "{:.2f}".format(rate),
+            duration_for_people(seconds) ))
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description="Forecasts the time to download the waiting files of each data node" )
+    p.add_argument( "start", nargs='?', default=None,
+                    help="start of the period for recent rates, e.g. '2019-01-25 13:04'.  You "+
+                    "can use a T instead of a space.  Default is a week before stop." )
+    p.add_argument( "stop", nargs='?', default=None,
+                    help="end of the period for recent rates, default now" )
+    args = p.parse_args( sys.argv[1:] )
+    if args.stop is None:
+        stop = datetime.datetime.now().strftime( '%Y-%m-%d %H:%M' )
+    else:
+        stop = args.stop.replace('T',' ')
+    if args.start is None:
+        start = ( perf.str2time(stop) - datetime.timedelta(days=7) ).strftime( '%Y-%m-%d %H:%M' )
+    else:
+        start = args.start.replace('T',' ')
+    perf.setup()
+    print("forecast from the rates between", start, "and", stop)
+    print_forecast( *forecast( start, stop ) )
+    perf.finish()
@@ -15,11 +15,15 @@ import logging
 global conn, dryrun
 from retrying import retry
 import pdb
+from version_index import VersionIndex
 
 dryrun = False  # Don't set it to True here.  Instead use the --dryrun argument.
 datasets_already_published = 0
 datasets_not_published_not_marked = 0
 datasets_marked_published = 0
+# Versions of all the datasets, for finding whether a dataset is the latest version; see
+# version_index.py.  It's refreshed by setup().
+versions = VersionIndex()
 
 def setup(db):
     """Initializes the connection to the database, etc."""
@@ -31,6 +35,7 @@ def setup(db):
     #     or test db: '/home/painter/db/sdt.db'
     #curs = conn.cursor()
     # safer to get the cursor when needed, and close it quickly: doesn't lock out other processes
+    versions.refresh( conn )
 
 def finish():
     """Closes connections to databases, etc."""
@@ -186,37 +191,10 @@ def dataset_published( dataset_functional_id, filenotfound ):
                 curs.close()
 
     # For files_published(), we'll need to know whether this is the latest version.
-    try:
-        cmd = "SELECT path_without_version,version FROM dataset WHERE dataset_functional_id='%s'" %\
-              dataset_functional_id
-        curs = conn.cursor()
-        curs.execute( cmd )
-        results = curs.fetchall()
-    except Exception as e:
-        logging.debug( "Exception in dataset_published 3: %s" %e )
-        raise e
-    finally:
-        curs.close()
-
-    path_without_version = results[0][0]
-    version = results[0][1]
-    try:
-        cmd = "SELECT version FROM dataset WHERE path_without_version='%s'" %\
-              path_without_version
-        curs = conn.cursor()
-        curs.execute( cmd )
-        results = curs.fetchall()
-    except Exception as e:
-        logging.debug( "Exception in dataset_published 4: %s" %e )
-        raise e
-    finally:
-        curs.close()
-
-    versions = [r[0] for r in results]
-    if version==max(versions):
-        latest_version = True
-    else:
-        latest_version = False
+    # The version index knows without a query, unless the dataset is new since it was refreshed.
+    if dataset_functional_id not in versions:
+        versions.refresh( conn )
+    latest_version = versions.is_latest( dataset_functional_id )
 
     return len(results), latest_version
 
@@ -8,10 +8,20 @@ import sys, pdb
 import argparse, logging
 import sqlite3
 import debug
-from dateutil.parser import parse
 import datetime
+from synda_time import str2time
 global conn, curs
 
+def error_date( date ):
+    """Parses a date from an error history with synda_time.str2time.  A form which that doesn't
+    know falls back on dateutil's more lenient parser, which this script used to use for all
+    dates."""
+    try:
+        return str2time( date )
+    except ValueError:
+        from dateutil.parser import parse
+        return parse( date )
+
 def setup( db='/var/lib/synda/sdt/sdt.db' ):
     """Initializes the connection to the database, etc."""
     # To test on a temporary copy of the database:
@@ -59,17 +69,18 @@ def tobe_permanent( error_history, error_in='ERROR 404', min_interval=5, min_err
     dates = [ e[0] for e in error_history if e[1]==error_in ]
     if len(dates)<min_errors:
         return None
-    date_last_error = parse(dates[0])
+    date_last_error = error_date(dates[0])
     nerrors = 1
     dates.sort()
     for i in range(1,len(dates)):
         # Get the time since the last error.
         # Converting to totalseconds lets us support fractional days.
-        interval = (parse(dates[i])- date_last_error).total_seconds()/3600./24
+        date = error_date(dates[i])
+        interval = (date - date_last_error).total_seconds()/3600./24
         if interval>=min_interval:
             # dates[i] is at least min_interval days after the previous error date.
             nerrors += 1
-            date_last_error = parse(dates[i])
+            date_last_error = date
     if nerrors>=min_errors:
         return return_error[error_in]
     else:
@@ -23,6 +23,7 @@ import logging
 import sqlite3
 import datetime
 import debug
+import synda_db
 global db, conn, curs
 
 db = os.path.expanduser('~/db/sdt-tmp.db')
@@ -43,7 +44,8 @@ def setup():
     # normal:
     if conn is None:
         timeout = 12000  # in seconds; i.e. 200 minutes
-        conn = sqlite3.connect( db, timeout )
+        # Only read, so open it read-only:
+        conn = synda_db.connect_ro( db, timeout )
     curs = conn.cursor()
 
 def finish():
@@ -4,7 +4,9 @@
 
 from datetime import datetime, timedelta
 from pprint import pprint
-import sys, os, pdb, subprocess
+import sys, os, re, pdb, subprocess, itertools, argparse, glob, time, json
+import sqlite3, gzip, multiprocessing, mmap
+import logging
 import debug
 
 global inst, scheme, TransferLOG, start_timeN
@@ -15,6 +17,21 @@ TransferLOG  = '/var/log/synda/sdt/transfer.log'  # LLNL standard
 DiscoveryLOG = '/var/log/synda/sdt/discovery.log' # LLNL standard
 #TransferLOG  = '/etc/synda/sdt/log/transfer.log'  # master branch default
 #DiscoveryLOG = '/etc/synda/sdt/log/discovery.log' # master branch default
+# Checkpoint files remember how far the last run read each log; see logsince().
+TransferCKPT  = '/var/log/synda/transfer.log.ckpt'
+DiscoveryCKPT = '/var/log/synda/discovery.log.ckpt'
+checkpoint_marks = 240  # about 10 days of hourly marks
+# Hourly rollups of transfer.log counts; see rollup_report().
+RollupDB = '/var/log/synda/transfer_rollup.db'
+shard_size = 64*1024*1024  # bytes of log per shard, for parallel_scan()
+# Status file written by --follow; a name ending in .prom gets the Prometheus textfile format.
+StatusFile = '/var/log/synda/transfer_status.json'
+dated_line = re.compile( rb'\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d' )
+# Every line of transfer.log which we count or report contains one of these.  They are separate
+# regular expressions because a search for a literal is much faster than for an alternation.
+counted_lines = [ re.compile(pattern) for pattern in
+                  [ rb'Transfer done', rb'Transfer failed', rb'Url successfully switched',
+                    rb' ERROR ' ] ]
 
 def tail(f, n):
     """runs the operating system's 'tail', probably faster than
@@ -29,26 +46,219 @@ def tail(f, n):
         lines.append(line.decode("utf-8"))
     return lines
 
-def logsince( logfile, starttime, taillen=15123456 ):
+def read_checkpoint( ckptfile ):
+    """Reads a checkpoint file written by save_checkpoint.  Returns a list of marks, each a
+    3-tuple (inode, offset, time).  offset is the byte offset, in the log file with that inode,
+    of the beginning of a line whose time (e.g. "2020-10-22 11:32:12") is the mark's time.
+    Returns an empty list if there is no usable checkpoint file."""
+    marks = []
+    if ckptfile is None or not os.path.isfile(ckptfile):
+        return marks
+    with open( ckptfile, 'r' ) as f:
+        for line in f:
+            fields = line.split(None,2)
+            if len(fields)<3:
+                continue
+            try:
+                marks.append( ( int(fields[0]), int(fields[1]), fields[2].strip() ) )
+            except ValueError:
+                continue
+    return marks
+
+def save_checkpoint( ckptfile, marks ):
+    """Writes the marks (see read_checkpoint) to a checkpoint file.  The file is written under
+    a temporary name and then renamed, so that an interrupted run can't leave a partial file."""
+    tmpfile = ckptfile+'.tmp'
+    with open( tmpfile, 'w' ) as f:
+        for inode, offset, time in marks[-checkpoint_marks:]:
+            f.write( "%s %s %s\n" % (inode,offset,time) )
+    os.replace( tmpfile, ckptfile )
+
+def log_with_inode( logfile, inode ):
+    """Returns the path of the log file with the specified inode; this is either logfile itself
+    or, if it has been rotated since the inode was recorded, logfile.1.  Returns None if neither
+    has this inode."""
+    for path in [ logfile, logfile+'.1' ]:
+        try:
+            if os.stat(path).st_ino==inode:
+                return path
+        except OSError:
+            pass
+    return None
+
+def readlines_from( path, offset, marks ):
+    """Generator, yields the complete lines of a log file which begin at or after the byte offset.
+    An incomplete last line, i.e. one which is still being written, is not read.
+    While reading, a mark (inode, offset, time) is appended to the list marks whenever the hour
+    changes, and at the last line.  Those are the checkpoints for the next run."""
+    with open( path, 'rb' ) as f:
+        inode = os.fstat(f.fileno()).st_ino
+        f.seek( offset )
+        lasthour = None
+        lastmark = None
+        for bline in f:
+            if bline[-1:]!=b'\n':
+                break
+            line = bline.decode("utf-8")
+            if line[0:2]=='20':
+                lastmark = ( inode, offset, line[:19] )
+                if line[:13]!=lasthour:
+                    marks.append( lastmark )
+                    lasthour = line[:13]
+            offset += len(bline)
+            yield line
+        if lastmark is not None and marks[-1]!=lastmark:
+            marks.append( lastmark )
+
+def mmap_readlines_from( path, offset, marks ):
+    """Like readlines_from, but yields only the lines which match one of counted_lines.  The file
+    is memory-mapped and searched with bytes regular expressions, so the great majority of lines,
+    which don't match, are never split out or decoded.  Marks are made as in readlines_from,
+    but only at the lines yielded."""
+    with open( path, 'rb' ) as f:
+        st = os.fstat( f.fileno() )
+        if st.st_size<=offset:
+            return
+        mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+        try:
+            end = mm.rfind( b'\n', offset ) + 1   # complete lines only
+            lasthour = None
+            lastmark = None
+            # the next match of each pattern:
+            matches = [ pattern.search( mm, offset, end ) for pattern in counted_lines ]
+            while True:
+                starts = [ match.start() for match in matches if match is not None ]
+                if len(starts)==0:
+                    break
+                first = min(starts)
+                begin = max( offset, mm.rfind( b'\n', offset, first ) + 1 )
+                pos = mm.find( b'\n', first, end ) + 1
+                for i, match in enumerate(matches):
+                    if match is not None and match.start()<pos:
+                        matches[i] = counted_lines[i].search( mm, pos, end )
+                line = mm[begin:pos].decode("utf-8")
+                if line[0:2]=='20':
+                    lastmark = ( st.st_ino, begin, line[:19] )
+                    if line[:13]!=lasthour:
+                        marks.append( lastmark )
+                        lasthour = line[:13]
+                yield line
+            if lastmark is not None and marks[-1]!=lastmark:
+                marks.append( lastmark )
+        finally:
+            mm.close()
+
+def next_dated_line( f, offset, stop=None ):
+    """Returns the byte offset and time (e.g. b"2020-10-22 11:32:12") of the first line of the
+    open binary file f which begins at or after offset and begins with a time.  If offset is
+    in the middle of a line, that line is skipped.  The search gives up at stop, if supplied.
+    Returns None,None if there is no such line."""
+    if offset>0:
+        f.seek( offset-1 )
+        offset += len( f.readline() ) - 1   # now at the beginning of a line
+    else:
+        f.seek( 0 )
+    while stop is None or offset<stop:
+        bline = f.readline()
+        if bline[-1:]!=b'\n':
+            break   # end of file, or an incomplete last line
+        if dated_line.match( bline ):
+            return offset, bline[:19]
+        offset += len(bline)
+    return None, None
+
+def bisect_log( path, starttime ):
+    """Returns the byte offset of the first line of a log file whose time is at or after
+    starttime (e.g. "2020-10-22 11:32:12"), or the file size if there is no such line.
+    This is a binary search over byte offsets, so it takes O(log N) seeks.  It relies on the
+    times at the beginnings of lines being sorted; lines without a time, e.g. from a traceback,
+    are skipped over."""
+    bstart = starttime[:19].encode()
+    with open( path, 'rb' ) as f:
+        lo = 0                             # always the beginning of a line
+        hi = os.fstat(f.fileno()).st_size
+        while hi-lo > 65536:
+            mid = (lo+hi)//2
+            offset, time = next_dated_line( f, mid, hi )
+            if offset is None or time>=bstart:
+                hi = mid
+            else:
+                f.seek( offset )
+                lo = offset + len( f.readline() )
+        # The first line we want begins at or after lo, and probably not much after.
+        f.seek( lo )
+        while True:
+            offset, time = next_dated_line( f, lo )
+            if offset is None:
+                return os.fstat(f.fileno()).st_size
+            if time>=bstart:
+                return offset
+            f.seek( offset )
+            lo = offset + len( f.readline() )
+
+def iter_logsince( logfile, starttime, checkpoint=None, stoptime=None, fast=False ):
+    """Generator, yields lines of a log file since a start time.  See logsince().
+    If stoptime is supplied, lines from that time onwards are not read.
+    If fast is True, only the lines matching counted_lines are yielded (see mmap_readlines_from);
+    that's all that's needed to count or report transfers."""
+    starttime = starttime.replace('T',' ')
+    readfrom = mmap_readlines_from if fast else readlines_from
+    oldmarks = read_checkpoint( checkpoint )
+    # Use the latest checkpoint mark which isn't after starttime, if its file still exists.
+    mark = None
+    for mk in oldmarks:
+        if mk[2]<=starttime[:19] and log_with_inode( logfile, mk[0] ) is not None:
+            mark = mk
+    if mark is not None and os.path.getsize(log_with_inode( logfile, mark[0] ))<mark[1]:
+        # truncated in place; we can't trust any offset into it
+        mark = None
+    marks = []
+    if mark is None:
+        # Find the first line we need by binary search.  If the log file begins after
+        # starttime, the rotated log file may have some of what we need.
+        offset = bisect_log( logfile, starttime )
+        rotated = logfile+'.1'
+        if offset==0 and os.path.isfile(rotated):
+            lines = itertools.chain(
+                readfrom( rotated, bisect_log( rotated, starttime ), marks ),
+                readfrom( logfile, 0, marks ) )
+        else:
+            lines = readfrom( logfile, offset, marks )
+    else:
+        markpath = log_with_inode( logfile, mark[0] )
+        # Keep the old marks up to this one, then add new marks as we read.
+        marks = [ mk for mk in oldmarks if mk[2]<mark[2] ]
+        lines = readfrom( markpath, mark[1], marks )
+        if markpath!=logfile:
+            # The log was rotated since the mark; continue into the new log file.
+            lines = itertools.chain( lines, readfrom( logfile, 0, marks ) )
+    for l in lines:
+        if ( l[0:4]==starttime[0:4] or l[0:4]==str(int(starttime[0:4])+1) ) and\
+           l[:19]>=starttime[:19]:
+            if stoptime is not None and l[:19]>=stoptime[:19]:
+                break
+            yield l
+    if checkpoint is not None and len(marks)>0:
+        save_checkpoint( checkpoint, marks )
+
+def logsince( logfile, starttime, checkpoint=None ):
     """returns lines of a log file since a start time.
 
-    The option taillen is the how many lines of the end of the file are sufficient to ensure
-    coverage of all logging since starttime.
-    The last 15 million lines of the log file will reliably cover transfer.log and other log files
-    for several days, in all Synda use that I have seen.  It will sometimes, maybe usually, work for
-    a week of transfer.log, the biggest one.  A tenth of that is not sufficient to guarantee a even
-    one-day coverage of transfer.log.  A third of that often covers a full day.  These are enough
-    lines so that getting them may take a significant amount of time.
+    If a checkpoint file is supplied, the byte offsets (and inodes) recorded there by the
+    previous run are used to seek straight to the first line needed, provided that the
+    checkpoint's time is no later than starttime.  This normally means that only the log
+    written since the last run has to be read.  If the log file has been rotated since then,
+    the rotated file (logfile.1) is read from the checkpoint, followed by the new log file.
+    Afterwards the checkpoint file is updated.
+
+    Without a usable checkpoint, the first line since starttime is found by a binary search
+    on the times at the beginning of each line (see bisect_log), and we read forward from there.
+    So an arbitrary starttime costs a few dozen seeks rather than reading the end of the file.
 
     It is expected that each line will begin with a time.  The format of this time and of
     starttime format is Synda's, i.e.  "2020-10-22 11:32:12".
     """
-    starttime = starttime.replace('T',' ')
-    lastlines = tail( logfile, taillen )
-    datedlines = [ l for l in lastlines if l[0:4]==starttime[0:4] or
-                   l[0:4]==str(int(starttime[0:4])+1) ]
-    sincelines = [ l for l in datedlines if l[:19]>=starttime[:19] ]
-    return sincelines
+    return list( iter_logsince( logfile, starttime, checkpoint ) )
 
 def logline_datanode( ll ):
     """Finds the first url (if any) in a line of transfer.log and returns the part before the
@@ -65,7 +275,13 @@ def logline_datanode( ll ):
     if ll[i:i+j].find(':2811')>0:
         j -= 5  # e.g. gsiftp://gridftp.ipsl.upmc.fr, not gsiftp://gridftp.ipsl.upmc.fr:2811
     datanode = ll[i:i+j]
+    register_datanode( datanode )
+    return datanode
 
+def register_datanode( datanode ):
+    """Records the scheme and institute of a data_node such as http://vesg.ipsl.upmc.fr,
+    as found by logline_datanode, in the dicts scheme and inst."""
+    global inst, scheme
     # Extract the scheme, i.e. http or gsiftp
     if datanode not in scheme:
         scheme[datanode] = datanode[:datanode.find('://')]
@@ -83,95 +299,45 @@ def logline_datanode( ll ):
         else:
             inst[datanode] = doms[-2:][0].upper()
 
-    return datanode
-
-def transfer_error_counts( sincelines ):
-    """returns file transfer error counts in sincelines, a subset of transfer.log
-    """
-    known_errors = [
-        "ERROR 503: Service Unavailable", "503 Service Temporarily Unavailable",
-        "Server side credential failure", "Cannot find trusted CA certificate",
-        "Valid credentials could not be found",
-        "/var/tmp/synda/sdt/1682/.esg/credentials.pem is not a valid file",
-        "Temporary failure in name resolution", "unable to resolve host address",
-        "Connection timed out", "Connection refused", "Connection reset by peer",
-        "Bad Gateway" , "504 Gateway Time-out", "authorization failed",
-        "Unable to establish SSL connection", "Connection closed at byte",
-        "The GSI XIO driver failed to establish a secure connection.",
-        "File corruption detected", "ERROR 404", "No such file or directory",
-        "System error in open",
-        "sdget_status=7", # i.e. sdget.sh was killed by SIGINT or SIGTERM.
-        #                  This normally means that the daemon died.
-        "No data received", "Operation not permitted",
-        "Name or service not known", "ERROR 400: Bad Request",
-        "globus_ftp_client: the operation was aborted",
-        "Local file creation error"
-    ]
-    dn_errs = {}
-    errdict = { e:0 for e in known_errors }
-    known_errlines = []
-    errlines = [ l for l in sincelines if l.find('SDDMDEFA-102 Transfer failed')>0 ]
-    
-    for err in known_errors:
-        elines = [ l for l in errlines if l.find(err)>0 ]
-        for ll in elines:
-            datanode = logline_datanode(ll)
-            if datanode not in dn_errs:
-                dn_errs[datanode] = {}
-            if err in dn_errs[datanode]:
-                dn_errs[datanode][err] +=1
-            else:
-                dn_errs[datanode][err] = 1
-        errdict[err] = len(elines)
-        known_errlines += elines
-    unknown_errlines = [ l for l in errlines if l not in known_errlines ]
+# Known causes of a file transfer error, as they appear in SDDMDEFA-102 lines of transfer.log:
+known_errors = [
+    "ERROR 503: Service Unavailable", "503 Service Temporarily Unavailable",
+    "Server side credential failure", "Cannot find trusted CA certificate",
+    "Valid credentials could not be found",
+    "/var/tmp/synda/sdt/1682/.esg/credentials.pem is not a valid file",
+    "Temporary failure in name resolution", "unable to resolve host address",
+    "Connection timed out", "Connection refused", "Connection reset by peer",
+    "Bad Gateway" , "504 Gateway Time-out", "authorization failed",
+    "Unable to establish SSL connection", "Connection closed at byte",
+    "The GSI XIO driver failed to establish a secure connection.",
+    "File corruption detected", "ERROR 404", "No such file or directory",
+    "System error in open",
+    "sdget_status=7", # i.e. sdget.sh was killed by SIGINT or SIGTERM.
+    #                  This normally means that the daemon died.
+    "No data received", "Operation not permitted",
+    "Name or service not known", "ERROR 400: Bad Request",
+    "globus_ftp_client: the operation was aborted",
+    "Local file creation error"
+]
+# All the known errors in one regular expression, so that a line is scanned only once:
+known_errors_re = re.compile( '|'.join([ re.escape(err) for err in known_errors ]) )
 
-    return len(known_errlines), len(unknown_errlines), errdict, dn_errs, unknown_errlines
+def classify_transfer_error( line ):
+    """Returns a list of the known errors (see known_errors) which appear in a line of
+    transfer.log, in order of appearance and without repeats.  Usually there is just one;
+    the list is empty for an unknown error."""
+    errs = []
+    for match in known_errors_re.finditer( line ):
+        err = match.group()
+        if err not in errs:
+            errs.append( err )
+    return errs
 
-def transfer_done_counts( sincelines ):
-    """returns file transfer success ('done') counts in sincelines, a subset of transfer.log"
-    """
-    dn_done = {}
-    # this duplicates the sincelines computation in transfer_error_counts, but performance isn't
-    # critical and it simplifies coding...
-    donelines = [ l for l in sincelines if l.find('Transfer done')>0 ]
-    for ll in donelines:
-        datanode = logline_datanode(ll)
-        if datanode not in dn_done:
-            dn_done[datanode] = 0
-        dn_done[datanode] +=1
-    return len(donelines), dn_done
-    
-def transfer_fallback_counts( sincelines ):
-    """returns file transfer fallback (i.e. try another url) counts in sincelines, a subset of
-    transfer.log
-    """
-    global inst, scheme
-    dn_fallback = {}
-    fb_dict = {}
-    fallbacklines = [ l for l in sincelines if l.find('Url successfully switched')>0 ]
-    for ll in fallbacklines:
-        datanode1 = logline_datanode(ll[ll.find("old_url"):])
-        datanode2 = logline_datanode(ll[ll.find("new_url"):])
-        if datanode1 not in dn_fallback:
-            dn_fallback[datanode1] = 0
-        dn_fallback[datanode1] +=1
-        if datanode1 not in fb_dict:
-            fb_dict[datanode1] = {}
-        fb_to = scheme[datanode2] if inst[datanode1]==inst[datanode2] else datanode2 
-        if fb_to not in fb_dict[datanode1]:
-            fb_dict[datanode1][fb_to] = 0
-        fb_dict[datanode1][fb_to] +=1
-        
-    return len(fallbacklines), dn_fallback, fb_dict
-    
 def retraction_counts( starttime ):
     """Returns the retracted.py run summaries with numFound and Nchanges.
     Also returns those exceptions which retracted.one_query() catches from status_retracted.py.
     Usually these are "database is locked" exceptions which occurred despite multiple retries."""
-    # for one day: sincelines = logsince( '/p/css03/scratch/logs/retracted.log', starttime, taillen=12000 )
-    # good enough for at least a week, maybe as much as four weeks:
-    sincelines = logsince( '/p/css03/scratch/logs/retracted.log', starttime, taillen=123000 )
+    sincelines = logsince( '/p/css03/scratch/logs/retracted.log', starttime )
     # Normally we just want the last line.  But that won't work if there are two runs in a
     # single day, or a run hasn't finished yet.
     summaries = [l[l.find("End of retracted.py")+21:] for l in sincelines if
@@ -209,41 +375,839 @@ def interesting_transfer_error( line ):
         return False # This occurs iff an SDMYPROX error has been logged.
     return True
 
+# Accumulators.  The report is built by reading the log once, and passing each line to every
+# accumulator of interest (see scan).  An accumulator is an object with a method add(line), and
+# attributes which hold its results.  To report something new, write another accumulator and
+# include it in the list given to scan; don't read the log again.
+
+class LineCounter:
+    """Counts lines."""
+    def __init__( self ):
+        self.count = 0
+    def add( self, line ):
+        self.count += 1
+    def merge( self, other ):
+        self.count += other.count
+
+class DoneCounter:
+    """Counts file transfer successes ('done'), in total and by data_node."""
+    def __init__( self ):
+        self.count = 0
+        self.dn_done = {}
+    def add( self, line ):
+        if line.find('Transfer done')<=0:
+            return
+        datanode = logline_datanode(line)
+        self.dn_done[datanode] = self.dn_done.get(datanode,0) + 1
+        self.count += 1
+    def rows( self ):
+        """Returns the counts as rollup rows (kind, data_node, detail, count)."""
+        return [ ('done', dn, '', n) for dn, n in self.dn_done.items() ]
+    def add_row( self, kind, datanode, detail, count ):
+        """Adds the counts in a rollup row, as from rows()."""
+        if kind=='done':
+            self.dn_done[datanode] = self.dn_done.get(datanode,0) + count
+            self.count += count
+    def merge( self, other ):
+        """Adds in the counts of another DoneCounter."""
+        for row in other.rows():
+            self.add_row( *row )
+
+class ErrorCounter:
+    """Counts file transfer errors (SDDMDEFA-102), by known error and data_node; see
+    classify_transfer_error.  Lines with unknown errors are counted, in total and by data_node
+    (in dn_unknown, not dn_errs), and also kept, up to max_unknown of them if that is supplied."""
+    def __init__( self, max_unknown=None ):
+        self.nknown = 0
+        self.nunknown = 0
+        self.errdict = { e:0 for e in known_errors }
+        self.dn_errs = {}
+        self.dn_unknown = {}    # data_node -> number of unknown errors
+        self.unknown_errlines = []
+        self.max_unknown = max_unknown
+    def add( self, line ):
+        if line.find('SDDMDEFA-102 Transfer failed')<=0:
+            return
+        errs = classify_transfer_error( line )
+        if len(errs)==0:
+            self.nunknown += 1
+            if line.find('://')>0:
+                datanode = logline_datanode(line)
+                self.dn_unknown[datanode] = self.dn_unknown.get(datanode,0) + 1
+            if self.max_unknown is None or len(self.unknown_errlines)<self.max_unknown:
+                self.unknown_errlines.append( line )
+            return
+        datanode = logline_datanode(line)
+        if datanode not in self.dn_errs:
+            self.dn_errs[datanode] = {}
+        for err in errs:
+            self.dn_errs[datanode][err] = self.dn_errs[datanode].get(err,0) + 1
+            self.errdict[err] += 1
+            self.nknown += 1
+    def rows( self ):
+        """Returns the counts as rollup rows (kind, data_node, detail, count).  Unknown errors
+        have the detail 'unknown'; those without a data_node have the data_node ''."""
+        rows = [ ('error', dn, err, n) for dn in self.dn_errs
+                 for err, n in self.dn_errs[dn].items() ]
+        rows += [ ('error', dn, 'unknown', n) for dn, n in self.dn_unknown.items() ]
+        nodeless = self.nunknown - sum( self.dn_unknown.values() )
+        if nodeless>0:
+            rows.append( ('error', '', 'unknown', nodeless) )
+        return rows
+    def add_row( self, kind, datanode, detail, count ):
+        """Adds the counts in a rollup row, as from rows()."""
+        if kind!='error':
+            return
+        if detail=='unknown':
+            self.nunknown += count
+            if datanode!='':
+                self.dn_unknown[datanode] = self.dn_unknown.get(datanode,0) + count
+            return
+        if datanode not in self.dn_errs:
+            self.dn_errs[datanode] = {}
+        self.dn_errs[datanode][detail] = self.dn_errs[datanode].get(detail,0) + count
+        self.errdict[detail] = self.errdict.get(detail,0) + count
+        self.nknown += count
+    def add_unknown_line( self, line ):
+        """Keeps a line with an unknown error (which has already been counted)."""
+        if self.max_unknown is None or len(self.unknown_errlines)<self.max_unknown:
+            self.unknown_errlines.append( line )
+    def merge( self, other ):
+        """Adds in the counts and unknown-error lines of another ErrorCounter."""
+        for row in other.rows():
+            self.add_row( *row )
+        for line in other.unknown_errlines:
+            self.add_unknown_line( line )
+
+class FallbackCounter:
+    """Counts file transfer fallbacks (i.e. try another url), by original data_node, and by
+    original data_node and destination.  The destination is just the scheme if it's the same
+    institute, otherwise the new data_node."""
+    def __init__( self ):
+        self.count = 0
+        self.dn_fallback = {}
+        self.fb_dict = {}
+    def add( self, line ):
+        if line.find('Url successfully switched')<=0:
+            return
+        datanode1 = logline_datanode(line[line.find("old_url"):])
+        datanode2 = logline_datanode(line[line.find("new_url"):])
+        self.dn_fallback[datanode1] = self.dn_fallback.get(datanode1,0) + 1
+        if datanode1 not in self.fb_dict:
+            self.fb_dict[datanode1] = {}
+        fb_to = scheme[datanode2] if inst[datanode1]==inst[datanode2] else datanode2
+        self.fb_dict[datanode1][fb_to] = self.fb_dict[datanode1].get(fb_to,0) + 1
+        self.count += 1
+    def rows( self ):
+        """Returns the counts as rollup rows (kind, data_node, detail, count).  The detail is
+        the fallback destination."""
+        return [ ('fallback', dn, fb_to, n) for dn in self.fb_dict
+                 for fb_to, n in self.fb_dict[dn].items() ]
+    def add_row( self, kind, datanode, detail, count ):
+        """Adds the counts in a rollup row, as from rows()."""
+        if kind!='fallback':
+            return
+        if datanode not in self.fb_dict:
+            self.fb_dict[datanode] = {}
+        self.fb_dict[datanode][detail] = self.fb_dict[datanode].get(detail,0) + count
+        self.dn_fallback[datanode] = self.dn_fallback.get(datanode,0) + count
+        self.count += count
+    def merge( self, other ):
+        """Adds in the counts of another FallbackCounter."""
+        for row in other.rows():
+            self.add_row( *row )
+
+class TransferErrorLines:
+    """Keeps the lines of transfer.log which call for human attention; see
+    interesting_transfer_error."""
+    def __init__( self ):
+        self.lines = []
+    def add( self, line ):
+        if interesting_transfer_error( line ):
+            self.lines.append( line )
+    def merge( self, other ):
+        self.lines += other.lines
+
+class ErrorTemplate:
+    """A template of transfer error lines, as a list of tokens in which '<*>' stands for any
+    token; with counts by data_node, and a sample line if we have one."""
+    def __init__( self, tokens, sample=None ):
+        self.tokens = tokens
+        self.count = 0
+        self.dn_counts = {}
+        self.sample = sample
+        self.evicted = False
+    def similarity( self, tokens ):
+        """The fraction of tokens equal to ours, position by position; '<*>' doesn't count.
+        Two empty messages (e.g. only whitespace) are the same."""
+        if len(tokens)==0:
+            return 1.0
+        same = 0
+        for t1, t2 in zip( self.tokens, tokens ):
+            if t1==t2 and t1!='<*>':
+                same += 1
+        return same/len(tokens)
+    def absorb( self, tokens ):
+        """Generalizes the template to cover tokens too."""
+        self.tokens = [ t1 if t1==t2 else '<*>' for t1, t2 in zip( self.tokens, tokens ) ]
+
+# Variable parts of transfer error messages, which would keep similar lines from matching.
+# Order matters, e.g. a url contains a path which contains numbers.
+template_masks = [ (re.compile(pattern), mask) for pattern, mask in [
+    ( r'[a-z]+://[^\s,)]+', '<URL>' ),
+    ( r'\bpid[ =:]*\d+', 'pid <PID>' ),
+    ( r'(?<![\w<])/[^\s,)]+', '<PATH>' ),
+    ( r'\b0x[0-9a-fA-F]+\b|\b(?=[0-9a-fA-F]*\d)(?=[0-9a-fA-F]*[a-fA-F])[0-9a-fA-F]{8,}\b',
+      '<HEX>' ),
+    ( r'(?<![\w-])\d+(\.\d+)*\b', '<NUM>' ) ] ]   # not in e.g. SDDMDEFA-502
+
+class UnknownErrorTemplates:
+    """Groups file transfer errors (SDDMDEFA-102) which aren't known errors into templates,
+    counted by data_node, so that new causes of errors can be found and added to known_errors.
+    This is a streaming log template miner in the style of Drain: urls, pids, paths, hex and
+    decimal numbers in the error message are masked (see template_masks), and the masked message
+    is split into tokens.  A line joins the most similar template with the same number of tokens if
+    at least similarity of its tokens match, and the template's differing tokens become '<*>'.
+    Otherwise the line starts a new template.  Memory is bounded: there are at most
+    max_templates templates; beyond that, the least frequent one is dropped and its count added
+    to self.evicted.  A cache of max_cache masked messages saves matching repeats."""
+    def __init__( self, max_templates=500, similarity=0.5, max_cache=10000 ):
+        self.max_templates = max_templates
+        self.min_similarity = similarity
+        self.max_cache = max_cache
+        self.groups = {}    # number of tokens -> list of ErrorTemplate
+        self.ntemplates = 0
+        self.cache = {}     # masked message -> ErrorTemplate
+        self.count = 0
+        self.evicted = 0
+    def add( self, line ):
+        if line.find('SDDMDEFA-102 Transfer failed')<=0 or known_errors_re.search(line):
+            return
+        # The error message follows "Transfer failed with error (file_id=...,url=...) ".
+        i = line.find( ') ', line.find('Transfer failed') )
+        message = line[i+2:].rstrip() if i>0 else line[30:].rstrip()
+        for pattern, mask in template_masks:
+            message = pattern.sub( mask, message )
+        template = self.cache.get( message )
+        if template is None or template.evicted:
+            template = self.match( message.split(), line )
+            if len(self.cache)>=self.max_cache:
+                self.cache = {}
+            self.cache[message] = template
+        datanode = logline_datanode(line) if line.find('://')>0 else ''
+        self.count_template( template, datanode, 1 )
+    def match( self, tokens, sample=None ):
+        """Returns the template which tokens join, possibly a new one."""
+        group = self.groups.setdefault( len(tokens), [] )
+        best, bestsim = None, -1
+        for template in group:
+            sim = template.similarity( tokens )
+            if sim>bestsim:
+                best, bestsim = template, sim
+        if best is not None and bestsim>=self.min_similarity:
+            best.absorb( tokens )
+            return best
+        template = ErrorTemplate( tokens, sample )
+        group.append( template )
+        self.ntemplates += 1
+        if self.ntemplates>self.max_templates:
+            self.evict( template )
+        return template
+    def evict( self, keep ):
+        """Drops the least frequent template other than keep."""
+        least = min( [ t for group in self.groups.values() for t in group if t is not keep ],
+                     key=(lambda t: t.count) )
+        self.groups[len(least.tokens)].remove( least )
+        least.evicted = True
+        self.ntemplates -= 1
+        self.evicted += least.count
+    def count_template( self, template, datanode, count ):
+        template.dn_counts[datanode] = template.dn_counts.get(datanode,0) + count
+        template.count += count
+        self.count += count
+    def templates( self ):
+        """Returns the templates, most frequent first."""
+        return sorted( [ t for group in self.groups.values() for t in group ],
+                       key=(lambda t: t.count), reverse=True )
+    def rows( self ):
+        """Returns the counts as rollup rows (kind, data_node, detail, count).  The detail is
+        the template, with tokens separated by spaces.  Evicted counts have the detail
+        '<evicted>'."""
+        counts = {}
+        for template in self.templates():
+            text = ' '.join( template.tokens )
+            for dn, n in template.dn_counts.items():
+                counts[(dn,text)] = counts.get((dn,text),0) + n
+        rows = [ ('template', dn, text, n) for (dn,text), n in counts.items() ]
+        if self.evicted>0:
+            rows.append( ('template', '', '<evicted>', self.evicted) )
+        return rows
+    def add_row( self, kind, datanode, detail, count ):
+        """Adds the counts in a rollup row, as from rows().  The template is matched against
+        ours like a line, so similar templates from different hours are merged."""
+        if kind!='template':
+            return
+        if detail=='<evicted>':
+            self.evicted += count
+            self.count += count
+            return
+        self.count_template( self.match( detail.split() ), datanode, count )
+    def merge( self, other ):
+        """Adds in the templates of another UnknownErrorTemplates, keeping their samples."""
+        for template in other.templates():
+            mine = self.match( template.tokens, template.sample )
+            if mine.sample is None:
+                mine.sample = template.sample
+            for dn, n in template.dn_counts.items():
+                self.count_template( mine, dn, n )
+        self.evicted += other.evicted
+        self.count += other.evicted
+
+class EventRecorder:
+    """Records each done, error, and fallback file as an event in a compact column store, a
+    transfer_events.TransferEvents, rather than counting them.  Use this rather than the
+    DoneCounter, ErrorCounter, and FallbackCounter for weeks or months of transfer.log; see
+    counters() for their results.  Lines with unknown errors are kept, up to max_unknown.
+    This needs NumPy, which is imported only when an EventRecorder is made."""
+    def __init__( self, max_unknown=4 ):
+        import transfer_events
+        self.time_ms = transfer_events.log_time_ms
+        self.kinds = ( transfer_events.DONE, transfer_events.ERROR, transfer_events.FALLBACK )
+        self.events = transfer_events.TransferEvents( known_errors+['unknown'] )
+        self.unknown_errlines = []
+        self.max_unknown = max_unknown
+    def add( self, line ):
+        DONE, ERROR, FALLBACK = self.kinds
+        if line.find('Transfer done')>0:
+            self.events.append( self.time_ms(line), DONE, logline_datanode(line) )
+        if line.find('SDDMDEFA-102 Transfer failed')>0:
+            errs = classify_transfer_error( line )
+            if len(errs)==0:
+                if self.max_unknown is None or len(self.unknown_errlines)<self.max_unknown:
+                    self.unknown_errlines.append( line )
+                datanode = logline_datanode(line) if line.find('://')>0 else ''
+                self.events.append( self.time_ms(line), ERROR, datanode, 'unknown' )
+            else:
+                datanode = logline_datanode(line)
+                for err in errs:
+                    self.events.append( self.time_ms(line), ERROR, datanode, err )
+        if line.find('Url successfully switched')>0:
+            datanode1 = logline_datanode(line[line.find("old_url"):])
+            datanode2 = logline_datanode(line[line.find("new_url"):])
+            fb_to = scheme[datanode2] if inst[datanode1]==inst[datanode2] else datanode2
+            self.events.append( self.time_ms(line), FALLBACK, datanode1, fb_to )
+    def merge( self, other ):
+        self.events.merge( other.events )
+        for line in other.unknown_errlines:
+            if self.max_unknown is None or len(self.unknown_errlines)<self.max_unknown:
+                self.unknown_errlines.append( line )
+    def counters( self, since=None, until=None ):
+        """Returns a DoneCounter, ErrorCounter, and FallbackCounter with the counts of the
+        events, computed with NumPy.  since and until limit the times of the events counted; they
+        are in milliseconds since the epoch, see transfer_events.log_time_ms."""
+        donec, errc, fbc = DoneCounter(), ErrorCounter(self.max_unknown), FallbackCounter()
+        counts = self.events.counts( since, until )
+        for kind, name, acc in zip( self.kinds, [ 'done', 'error', 'fallback' ],
+                                    [ donec, errc, fbc ] ):
+            for datanode, detail, count in self.events.rows( kind, counts=counts ):
+                if datanode!='':
+                    register_datanode( datanode )
+                acc.add_row( name, datanode, detail, count )
+        errc.unknown_errlines = list( self.unknown_errlines )
+        return donec, errc, fbc
+
+class DiscoveryErrorLines:
+    """Keeps the error-level lines of discovery.log."""
+    def __init__( self ):
+        self.lines = []
+    def add( self, line ):
+        if line[24:29]=='ERROR':
+            self.lines.append( line )
+
+def report_accumulators( events=False ):
+    """Returns the accumulators for the transfer.log report: a LineCounter, DoneCounter,
+    ErrorCounter(max_unknown=4), FallbackCounter, TransferErrorLines, and
+    UnknownErrorTemplates.  If events is True, an EventRecorder replaces the three counters.
+    Either way, report_results() gets the results from them."""
+    if events:
+        return [ LineCounter(), EventRecorder(max_unknown=4), TransferErrorLines(),
+                 UnknownErrorTemplates() ]
+    return [ LineCounter(), DoneCounter(), ErrorCounter(max_unknown=4), FallbackCounter(),
+             TransferErrorLines(), UnknownErrorTemplates() ]
+
+def report_results( accs ):
+    """Returns the LineCounter, DoneCounter, ErrorCounter, FallbackCounter,
+    TransferErrorLines, and UnknownErrorTemplates from the report_accumulators(), after a scan.
+    If there is an EventRecorder, the three counters are computed from its events."""
+    if isinstance( accs[1], EventRecorder ):
+        linec, recorder, terrs, tmplc = accs
+        donec, errc, fbc = recorder.counters()
+        return [ linec, donec, errc, fbc, terrs, tmplc ]
+    return accs
+
+def scan( lines, accumulators ):
+    """Reads lines (any iterable, normally the generator iter_logsince) once, and passes each
+    line to each of the accumulators.  Returns the accumulators."""
+    adds = [ acc.add for acc in accumulators ]
+    for line in lines:
+        for add in adds:
+            add( line )
+    return accumulators
+
+class HourlyRollup:
+    """Rolls up transfer.log into hourly counts of done, error, and fallback files, which are
+    written to a SQLite database, conn, as each hour ends; see rollup_report().
+    The lines kept by TransferErrorLines, and a few lines with unknown errors, are written too.
+    The last hour read is kept in memory (as self.counters) rather than written, because it may
+    not be finished yet.  Call finish() if it is finished."""
+    def __init__( self, conn ):
+        self.conn = conn
+        self.hour = None
+        self.counters = None
+        self.hours = []   # hours written
+    def new_counters( self ):
+        return report_accumulators()[1:]
+    def add( self, line ):
+        if line[0:2]=='20' and line[:13]!=self.hour:
+            if self.hour is not None:
+                self.write()
+            self.hour = line[:13]
+            self.counters = self.new_counters()
+        if self.counters is not None:
+            for counter in self.counters:
+                counter.add( line )
+    def write( self ):
+        """Writes the counts for the current hour to the database."""
+        donec, errc, fbc, terrs, tmplc = self.counters
+        curs = self.conn.cursor()
+        try:
+            curs.execute( "DELETE FROM rollup WHERE hour=?", (self.hour,) )
+            curs.execute( "DELETE FROM rollup_lines WHERE hour=?", (self.hour,) )
+            curs.executemany( "INSERT INTO rollup VALUES (?,?,?,?,?)",
+                              [ (self.hour,)+row for row in
+                                donec.rows()+errc.rows()+fbc.rows()+tmplc.rows() ] )
+            curs.executemany( "INSERT INTO rollup_lines VALUES (?,?,?)",
+                              [ (self.hour,'unknown',l) for l in errc.unknown_errlines ] +
+                              [ (self.hour,'transfer',l) for l in terrs.lines ] )
+        finally:
+            curs.close()
+        self.hours.append( self.hour )
+    def finish( self ):
+        """Writes the last hour read; call this only if that hour is known to be finished."""
+        if self.hour is not None:
+            self.write()
+            self.hour = None
+            self.counters = None
+
+def open_rollup( rollupdb ):
+    """Opens the rollup database, creating its tables if necessary, and returns the connection.
+    Table rollup has a count for each hour (e.g. "2020-10-22 11"), kind ('done', 'error', or
+    'fallback'), data_node, and detail (error type or fallback destination).  Table rollup_lines
+    keeps lines of interest, and table rolled lists the hours which have been rolled up."""
+    conn = sqlite3.connect( rollupdb, 600 )
+    conn.execute( "CREATE TABLE IF NOT EXISTS rollup ( hour TEXT, kind TEXT, data_node TEXT, "+
+                  "detail TEXT, count INTEGER, PRIMARY KEY (hour,kind,data_node,detail) )" )
+    conn.execute( "CREATE TABLE IF NOT EXISTS rollup_lines ( hour TEXT, kind TEXT, line TEXT )" )
+    conn.execute( "CREATE INDEX IF NOT EXISTS rollup_lines_hour ON rollup_lines (hour)" )
+    conn.execute( "CREATE TABLE IF NOT EXISTS rolled ( hour TEXT PRIMARY KEY )" )
+    conn.commit()
+    return conn
+
+def next_hour( hour ):
+    """Returns the hour after hour, e.g. "2020-10-22 12" after "2020-10-22 11"."""
+    return (datetime.strptime(hour,'%Y-%m-%d %H')+timedelta(hours=1)).strftime('%Y-%m-%d %H')
+
+def roll_hours( conn, logfile, begin, end, accumulators, checkpoint=None, fast=False ):
+    """Reads logfile from hour begin (e.g. "2020-10-22 11") up to, but not including, hour end,
+    and writes hourly rollups of it to the database conn.  The lines read are also passed to the
+    accumulators.  If end is None, we read to the end of the file.  Then the last hour read
+    may not be finished, so it isn't written; the HourlyRollup is returned so that its counts can
+    be used anyway.  fast is passed on to iter_logsince."""
+    rollup = HourlyRollup( conn )
+    scan( iter_logsince( logfile, begin+':00:00', checkpoint,
+                         None if end is None else end+':00:00', fast ),
+          accumulators+[rollup] )
+    if end is None:
+        end = rollup.hour   # the last hour, still in memory
+    else:
+        rollup.finish()
+    # Every hour in [begin,end) has now been rolled up, even if there were no lines in it.
+    if end is not None:
+        hour = begin
+        rolled = []
+        while hour<end:
+            rolled.append( (hour,) )
+            hour = next_hour( hour )
+        conn.executemany( "INSERT OR REPLACE INTO rolled VALUES (?)", rolled )
+    conn.commit()
+    return rollup
+
+def rollup_report( logfile, starttime, rollupdb=RollupDB, checkpoint=None, fast=False,
+                   stoptime=None ):
+    """Like scanning transfer.log since starttime with the report_accumulators(), which are
+    returned.  But most of the counts are taken from hourly rollups in the SQLite database rollupdb.
+    Only the first partial hour, the hours which haven't yet been rolled up, and the last hour
+    are read from the log file.  Hours read in full are rolled up for the next time.
+    If stoptime is supplied, lines from that time onwards aren't counted: the rollups are used
+    only for the hours before stoptime's hour, and the rest, up to stoptime, is read from the
+    log file instead of the last hour.  If stoptime's hour has already begun, nothing after
+    stoptime is read at all.
+    The LineCounter counts only the lines actually read; the number of hours taken from
+    rollups is returned as well.  fast is passed on to iter_logsince."""
+    starttime = starttime.replace('T',' ')[:19]
+    if stoptime is None:
+        stophour = '9999'   # after any hour
+    else:
+        stoptime = stoptime.replace('T',' ')[:19]
+        stophour = stoptime[:13]
+    accs = report_accumulators()
+    linec, donec, errc, fbc, terrs, tmplc = accs
+    conn = open_rollup( rollupdb )
+    try:
+        # The partial hour at the beginning:
+        hour0 = (starttime+' 00')[:13]
+        if starttime[13:].strip(':0')!='':
+            hour0 = next_hour( hour0 )
+            scan( iter_logsince( logfile, starttime, None,
+                                 min( hour0+':00:00', stoptime or '9999' ), fast ), accs )
+        if stophour<hour0:
+            # starttime and stoptime are in the same hour.
+            return accs, 0
+        # Read whatever hasn't been rolled up, and roll it up.
+        curs = conn.cursor()
+        curs.execute( "SELECT hour FROM rolled WHERE hour>=? ORDER BY hour", (hour0,) )
+        rolled = [ r[0] for r in curs.fetchall() ]
+        curs.close()
+        # If stoptime's hour has begun, nothing after it need be read: the hours before it are
+        # over, so they can be rolled up.
+        bounded = stophour<=datetime.now().strftime('%Y-%m-%d %H')
+        hour = hour0
+        for rhour in rolled:
+            if bounded and rhour>=stophour:
+                break
+            if rhour>hour:
+                roll_hours( conn, logfile, hour, rhour, [linec], None, fast )
+            hour = next_hour( rhour )
+        if bounded:
+            lastrollup = None
+            if hour<stophour:
+                roll_hours( conn, logfile, hour, stophour, [linec], checkpoint, fast )
+        else:
+            lastrollup = roll_hours( conn, logfile, hour, None, [linec], checkpoint, fast )
+        # Now everything since hour0, except the last hour, is in the rollup tables; or if
+        # bounded, everything from hour0 up to stophour.
+        curs = conn.cursor()
+        curs.execute( "SELECT kind, data_node, detail, SUM(count) FROM rollup WHERE hour>=? "+
+                      "AND hour<? GROUP BY kind, data_node, detail", (hour0,stophour) )
+        for kind, datanode, detail, count in curs.fetchall():
+            if datanode!='':
+                register_datanode( datanode )
+            for acc in [ donec, errc, fbc, tmplc ]:
+                acc.add_row( kind, datanode, detail, count )
+        curs.execute( "SELECT kind, line FROM rollup_lines WHERE hour>=? AND hour<? "+
+                      "ORDER BY hour, rowid", (hour0,stophour) )
+        for kind, line in curs.fetchall():
+            if kind=='unknown':
+                errc.add_unknown_line( line )
+            else:
+                terrs.lines.append( line )
+        curs.execute( "SELECT COUNT(*) FROM rolled WHERE hour>=? AND hour<?", (hour0,stophour) )
+        nhours = curs.fetchone()[0]
+        curs.close()
+        if lastrollup is not None and lastrollup.counters is not None and\
+           lastrollup.hour<stophour:
+            ldonec, lerrc, lfbc, lterrs, ltmplc = lastrollup.counters
+            for row in ldonec.rows()+lerrc.rows()+lfbc.rows():
+                for acc in [ donec, errc, fbc ]:
+                    acc.add_row( *row )
+            tmplc.merge( ltmplc )
+            for line in lerrc.unknown_errlines:
+                errc.add_unknown_line( line )
+            terrs.lines += lterrs.lines
+        if stoptime is not None:
+            # The partial hour at the end:
+            scan( iter_logsince( logfile, stophour+':00:00', None, stoptime, fast ), accs )
+    finally:
+        conn.close()
+    return accs, nhours
+
+def rotated_logs( logfile ):
+    """Returns a list of logfile and its rotated predecessors, e.g. transfer.log.1 or
+    transfer.log.2.gz, oldest first."""
+    rotated = [ f for f in glob.glob( logfile+'.*' )
+                if re.fullmatch( r'\.\d+(\.gz)?', f[len(logfile):] ) ]
+    rotated.sort( key=(lambda f: int(f[len(logfile)+1:].split('.')[0])), reverse=True )
+    return rotated + [ logfile ]
+
+def log_shards( logfiles, starttime ):
+    """Divides the log files into shards for scan_shard(), i.e. 3-tuples (path, begin, end).
+    A plain file is divided into byte ranges of about shard_size; scan_shard aligns them to
+    lines.  A gzipped file can't be read from the middle, so it is one shard (end=None).
+    Files last modified before starttime can't have any lines we want, and are skipped."""
+    shards = []
+    for path in logfiles:
+        st = os.stat( path )
+        if datetime.fromtimestamp(st.st_mtime).strftime('%Y-%m-%d %H:%M:%S')<starttime[:19]:
+            continue
+        if path.endswith('.gz'):
+            shards.append( (path, 0, None) )
+        else:
+            for begin in range( 0, st.st_size, shard_size ):
+                shards.append( (path, begin, min( begin+shard_size, st.st_size )) )
+    return shards
+
+def shard_lines( path, begin, end ):
+    """Generator, yields the lines of a log file which begin in the byte range [begin,end).
+    If end is None, yields all lines of the file, which may be gzipped."""
+    if end is None:
+        with ( gzip.open( path, 'rb' ) if path.endswith('.gz') else open( path, 'rb' ) ) as f:
+            for bline in f:
+                yield bline.decode("utf-8")
+        return
+    with open( path, 'rb' ) as f:
+        if begin>0:
+            f.seek( begin-1 )
+            offset = begin-1 + len( f.readline() )  # the first line beginning at or after begin
+        else:
+            offset = 0
+        while offset<end:
+            bline = f.readline()
+            if len(bline)==0:
+                break
+            offset += len(bline)
+            yield bline.decode("utf-8")
+
+def scan_shard( shard ):
+    """Scans one shard (path, begin, end, starttime, events) of transfer.log with the
+    report_accumulators(events), counting only lines since starttime.  Returns the accumulators.
+    This runs in a worker process."""
+    path, begin, end, starttime, events = shard
+    accs = report_accumulators( events )
+    lines = ( l for l in shard_lines( path, begin, end ) if l[0:2]=='20' and
+              l[:19]>=starttime[:19] )
+    return scan( lines, accs )
+
+def parallel_scan( logfile, starttime, processes=None, events=False ):
+    """Like scanning transfer.log since starttime with the report_accumulators(), which are
+    returned.  But this covers the rotated logs too (see rotated_logs), and is meant for months
+    of them.
+    The logs are divided into shards (see log_shards), which are scanned in a pool of processes
+    (by default, one per core).  Then the accumulators from each shard are merged.
+    events is passed on to report_accumulators()."""
+    starttime = starttime.replace('T',' ')
+    shards = [ shard+(starttime,events)
+               for shard in log_shards( rotated_logs(logfile), starttime ) ]
+    accs = report_accumulators( events )
+    with multiprocessing.Pool( processes ) as pool:
+        # imap keeps the shards in order, so lines kept will be in order.
+        for shard_accs in pool.imap( scan_shard, shards ):
+            for acc, shard_acc in zip( accs, shard_accs ):
+                acc.merge( shard_acc )
+    # The data_nodes' institutes were found in the worker processes; we need them here too.
+    if events:
+        datanodes = set( accs[1].events.nodes )
+    else:
+        datanodes = set(accs[1].dn_done) | set(accs[2].dn_errs) | set(accs[3].dn_fallback)
+    for template in accs[-1].templates():
+        datanodes |= set(template.dn_counts)
+    for datanode in datanodes - set(['']):
+        register_datanode( datanode )
+    return accs
+
+class NodeRates:
+    """Keeps exponentially weighted moving averages (EWMAs) of the rates, in files per minute,
+    at which each data_node's files are done, in error, or fall back.  There is a fast EWMA,
+    following the last few minutes, and a slow one, following the last hour or so.  The state
+    is just two numbers per data_node and outcome, so it is cheap to update."""
+    def __init__( self, fast_halflife=300, slow_halflife=3600 ):
+        self.fast_halflife = fast_halflife    # seconds
+        self.slow_halflife = slow_halflife
+        self.totals = {}   # (outcome,data_node) -> count, at the last update
+        self.fast = {}     # (outcome,data_node) -> files per minute
+        self.slow = {}
+        self.elapsed = 0   # seconds of history behind the EWMAs
+    def update( self, totals, dt ):
+        """totals is a dict (outcome,data_node) -> count of files since we started, where the
+        outcome is 'done', 'error', or 'fallback'.  dt is the time in seconds since the last
+        update."""
+        if dt<=0:
+            return
+        afast = 1 - 0.5**(dt/self.fast_halflife)
+        aslow = 1 - 0.5**(dt/self.slow_halflife)
+        for key in set(totals) | set(self.fast):
+            rate = 60.*( totals.get(key,0) - self.totals.get(key,0) )/dt
+            self.fast[key] = self.fast.get(key,rate) + afast*( rate - self.fast.get(key,rate) )
+            self.slow[key] = self.slow.get(key,rate) + aslow*( rate - self.slow.get(key,rate) )
+        self.totals = dict(totals)
+        self.elapsed += dt
+    def alerts( self, datanode, drop_ratio=0.3, spike_ratio=3., min_rate=1. ):
+        """Returns a list of alerts for the data_node: 'throughput_drop' if its recent rate of
+        done files has fallen below drop_ratio times its longer-term rate, 'error_spike' if its
+        recent error rate exceeds spike_ratio times its longer-term rate.  Rates below min_rate
+        files per minute are too small to judge, as is a history shorter than the slow halflife."""
+        alerts = []
+        if self.elapsed<self.slow_halflife:
+            return alerts
+        key = ('done',datanode)
+        if self.slow.get(key,0)>=min_rate and self.fast[key]<drop_ratio*self.slow[key]:
+            alerts.append( 'throughput_drop' )
+        key = ('error',datanode)
+        if self.fast.get(key,0)>=min_rate and self.fast[key]>spike_ratio*self.slow[key]:
+            alerts.append( 'error_spike' )
+        return alerts
+
+def outcome_totals( donec, errc, fbc ):
+    """Returns a dict (outcome,data_node) -> count, from the counters.  The errors include
+    unknown errors, so that a new kind of failure shows up in the error rates too."""
+    totals = {}
+    for dn, n in donec.dn_done.items():
+        totals[('done',dn)] = n
+    for dn in errc.dn_errs:
+        totals[('error',dn)] = sum(errc.dn_errs[dn].values())
+    for dn, n in errc.dn_unknown.items():
+        totals[('error',dn)] = totals.get(('error',dn),0) + n
+    for dn, n in fbc.dn_fallback.items():
+        totals[('fallback',dn)] = n
+    return totals
+
+def write_status( statusfile, since, totals, rates ):
+    """Writes the per-data_node counts, rates, and alerts to statusfile, atomically (i.e. by
+    writing a temporary file and renaming it).  If statusfile ends in .prom, it is written in
+    the Prometheus textfile format; otherwise it is JSON."""
+    datanodes = sorted( set([ dn for (outcome,dn) in totals ]) )
+    tmpfile = statusfile+'.tmp'
+    with open( tmpfile, 'w' ) as f:
+        if statusfile.endswith('.prom'):
+            f.write( "# HELP synda_transfer_files_total Files by data_node and outcome, "+
+                     "since the follower started.\n" )
+            f.write( "# TYPE synda_transfer_files_total counter\n" )
+            for (outcome,dn), n in sorted(totals.items()):
+                f.write( 'synda_transfer_files_total{data_node="%s",outcome="%s"} %s\n' %
+                         (dn,outcome,n) )
+            f.write( "# HELP synda_transfer_files_per_minute EWMA rate of files by data_node "+
+                     "and outcome.\n" )
+            f.write( "# TYPE synda_transfer_files_per_minute gauge\n" )
+            for window, ewma in [ ('fast',rates.fast), ('slow',rates.slow) ]:
+                for (outcome,dn), rate in sorted(ewma.items()):
+                    f.write( 'synda_transfer_files_per_minute{data_node="%s",outcome="%s",'
+                             'window="%s"} %.4f\n' % (dn,outcome,window,rate) )
+            f.write( "# HELP synda_transfer_alert 1 if the data_node has this alert.\n" )
+            f.write( "# TYPE synda_transfer_alert gauge\n" )
+            for dn in datanodes:
+                for alert in [ 'throughput_drop', 'error_spike' ]:
+                    f.write( 'synda_transfer_alert{data_node="%s",alert="%s"} %d\n' %
+                             (dn, alert, alert in rates.alerts(dn)) )
+        else:
+            status = { 'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'since': since,
+                       'data_nodes': {} }
+            for dn in datanodes:
+                status['data_nodes'][dn] = { 'inst': inst.get(dn,'') }
+                for outcome in [ 'done', 'error', 'fallback' ]:
+                    key = (outcome,dn)
+                    status['data_nodes'][dn][outcome] = totals.get(key,0)
+                    status['data_nodes'][dn][outcome+'_per_minute'] = \
+                        round( rates.fast.get(key,0), 4 )
+                    status['data_nodes'][dn][outcome+'_per_minute_slow'] = \
+                        round( rates.slow.get(key,0), 4 )
+                status['data_nodes'][dn]['alerts'] = rates.alerts(dn)
+            json.dump( status, f, indent=1, sort_keys=True )
+    os.replace( tmpfile, statusfile )
+
+def follow_transfers( logfile, statusfile=StatusFile, interval=60 ):
+    """Runs forever, as a daemon.  Reads the lines added to logfile (transfer.log), from now
+    on, and keeps counts of done, error, and fallback files by data_node, and EWMAs of their
+    rates (see NodeRates).  Every interval seconds, these are written to statusfile (see
+    write_status), and new alerts are logged.
+    Rotation of logfile is detected by a change of inode, and truncation by a size smaller than
+    what we have read; in either case we finish the old file and start the new one at the
+    beginning.  Each read begins where the last ended, so the cost is proportional to the
+    logging rate."""
+    counters = [ DoneCounter(), ErrorCounter(max_unknown=0), FallbackCounter() ]
+    donec, errc, fbc = counters
+    rates = NodeRates()
+    since = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    f = open( logfile, 'rb' )
+    f.seek( 0, os.SEEK_END )
+    inode = os.fstat( f.fileno() ).st_ino
+    lasttime = time.time()
+    lastalerts = {}
+    try:
+        while True:
+            time.sleep( interval )
+            while True:
+                offset = f.tell()
+                bline = f.readline()
+                if bline[-1:]!=b'\n':
+                    f.seek( offset )   # nothing more, or a line still being written
+                    break
+                if bline.find(b'Transfer ')>0 or bline.find(b'Url successfully')>0:
+                    line = bline.decode("utf-8")
+                    for counter in counters:
+                        counter.add( line )
+            try:
+                st = os.stat( logfile )
+                if st.st_ino!=inode or st.st_size<f.tell():
+                    logging.info( "%s was rotated or truncated" % logfile )
+                    f.close()
+                    f = open( logfile, 'rb' )
+                    inode = os.fstat( f.fileno() ).st_ino
+            except OSError:
+                pass   # rotated, but the new file doesn't exist yet
+            now = time.time()
+            totals = outcome_totals( donec, errc, fbc )
+            rates.update( totals, now-lasttime )
+            lasttime = now
+            write_status( statusfile, since, totals, rates )
+            for dn in set([ dn for (outcome,dn) in totals ]):
+                alerts = rates.alerts(dn)
+                if alerts and alerts!=lastalerts.get(dn):
+                    logging.warning( "data_node %s: %s" % (dn, ', '.join(alerts)) )
+                lastalerts[dn] = alerts
+    finally:
+        f.close()
+
+def transfer_error_counts( sincelines ):
+    """returns file transfer error counts in sincelines, a subset of transfer.log
+    Each SDDMDEFA-102 line is classified once, by classify_transfer_error.  As before, a line is
+    counted once for each distinct known error in it.
+    """
+    errc = ErrorCounter()
+    scan( sincelines, [errc] )
+    return errc.nknown, errc.nunknown, errc.errdict, errc.dn_errs, errc.unknown_errlines
+
+def transfer_done_counts( sincelines ):
+    """returns file transfer success ('done') counts in sincelines, a subset of transfer.log"
+    """
+    donec = DoneCounter()
+    scan( sincelines, [donec] )
+    return donec.count, donec.dn_done
+
+def transfer_fallback_counts( sincelines ):
+    """returns file transfer fallback (i.e. try another url) counts in sincelines, a subset of
+    transfer.log
+    """
+    fbc = FallbackCounter()
+    scan( sincelines, [fbc] )
+    return fbc.count, fbc.dn_fallback, fbc.fb_dict
+
 def interesting_transfer_errors( lines ):
     """Searches the supplied transfer.log lines for errors which call for human attention,
     and returns those lines."""
-    terrors = []
-    for line in lines:
-        if interesting_transfer_error( line ):
-            terrors.append( line )
-    return terrors
+    return scan( lines, [TransferErrorLines()] )[0].lines
 
 def interesting_discovery_errors( lines ):
     """Searches the supplied discovery.log lines for error-level logs,
     and returns those lines."""
-    terrors = []
-    for line in lines:
-        if line[24:29]=='ERROR':
-            terrors.append( line )
-    return terrors
-
+    return scan( lines, [DiscoveryErrorLines()] )[0].lines
 
-if __name__ == '__main__':
-    if len(sys.argv)>1:
-        start_time = sys.argv[1]
-    else:
-        start_time = (datetime.now()-timedelta(days=start_timeN)).strftime('%Y-%m-%d %H:%m')
-    print("From",start_time,':')
-    sincelines = logsince( TransferLOG, start_time, taillen=15123456 )
-    print("searching", len(sincelines), "lines of transfer.log")
-    donecount, dn_done = transfer_done_counts(sincelines)
-    knownerr, unknownerr, errdict, dn_errs, unknowns = transfer_error_counts(sincelines)
-    fallbackcount, dn_fallback, fb_dict = transfer_fallback_counts(sincelines)
-    
-    print("no. done files = ", donecount)
-    print("no. error files =", knownerr+unknownerr)
-    print("no. fallback files = ", fallbackcount)
+def print_transfer_report( donec, errc, fbc, tmplc=None ):
+    """Prints the done, error, and fallback counts from the accumulators, and the templates
+    of unknown errors if an UnknownErrorTemplates is supplied."""
+    print("no. done files = ", donec.count)
+    print("no. error files =", errc.nknown+errc.nunknown)
+    print("no. fallback files = ", fbc.count)
     print("...done, error, and fallback file counts, broken down by data_node:")
+    dn_done, dn_errs, dn_fallback, fb_dict = donec.dn_done, errc.dn_errs, fbc.dn_fallback, fbc.fb_dict
     datanodes = list(set(dn_done.keys()) | set(dn_errs.keys()) | set(dn_fallback.keys()))
     datanodes.sort( key=(lambda dn: inst[dn] ) )
     for dn in datanodes:
@@ -253,14 +1217,12 @@ if __name__ == '__main__':
             errcount = 0
         print('{:6.6} {:25.25} {:6d} {:6d} {:6d}'.format(
             inst[dn], dn, dn_done.get(dn,0), errcount, dn_fallback.get(dn,0) ))
-#    pprint(dn_done)
 
     print("error counts by error type:")
-    for err in list(errdict.keys()):
-        if errdict[err]>0:
-            print('  ','{:30.28} {:6d}'.format(err,errdict[err]))
-    print('  ','{:30.30} {:6d}'.format('unknown',unknownerr))
-#    pprint( errdict )
+    for err in list(errc.errdict.keys()):
+        if errc.errdict[err]>0:
+            print('  ','{:30.28} {:6d}'.format(err,errc.errdict[err]))
+    print('  ','{:30.30} {:6d}'.format('unknown',errc.nunknown))
 
     print("...same errors, but broken down by data_node:")
     # formerly this was "for dn in dn_errs.keys()", but I want the output sorted by datanodes...
@@ -269,13 +1231,12 @@ if __name__ == '__main__':
             continue
         errsum = sum(dn_errs[dn].values())
         print("{:6.6} {:.<40.40}{:.>6d}".format( inst[dn], dn, errsum ))
-#        print "{}{:6d}".format(dn,errsum)
-#        print dn, ' ', sum(dn_errs[dn].values())
         for err in dn_errs[dn]:
             print('  ','{:30.30} {:5d}'.format(err,dn_errs[dn][err]))
-#            print '   ',err,dn_errs[dn][err]
     print("sample lines with unknown errors:")
-    pprint( unknowns[0:4] )
+    pprint( errc.unknown_errlines[0:4] )
+    if tmplc is not None:
+        print_error_templates( tmplc )
 
     print("\nfallback counts by original url and destination:")
     for dn in datanodes:
@@ -285,7 +1246,85 @@ if __name__ == '__main__':
         print("{:6.6} {:.<40.40}{:.>6d}".format( inst[dn], dn, fbsum ))
         for fb in fb_dict[dn]:
             print('  ','{:30.30} {:5d}'.format(fb,fb_dict[dn][fb]))
-#    pprint( fb_dict )
+
+def print_error_templates( tmplc, ntemplates=20 ):
+    """Prints the most frequent templates of unknown errors, with counts by data_node and a
+    sample line.  A template which recurs is a candidate for known_errors."""
+    templates = tmplc.templates()
+    print("unknown errors grouped into", len(templates), "templates; the most frequent:")
+    for template in templates[0:ntemplates]:
+        print('{:6d} {}'.format( template.count, ' '.join(template.tokens) ))
+        for dn in sorted( template.dn_counts, key=(lambda dn: -template.dn_counts[dn]) ):
+            print('  ','{:6.6} {:30.30} {:5d}'.format( inst.get(dn,''), dn,
+                                                     template.dn_counts[dn] ))
+        if template.sample is not None:
+            print('   e.g.', template.sample.rstrip())
+    if tmplc.evicted>0:
+        print('{:6d} {}'.format( tmplc.evicted, "in rare templates which weren't kept" ))
+
+def print_lines( lines ):
+    """Prints the lines, or None if there aren't any."""
+    if len(lines)==0:
+        print("None")
+    else:
+        for line in lines:
+            print(line)
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser( description="Report on replication since a start time." )
+    p.add_argument( "start_time", nargs='?', default=None,
+                    help="e.g. '2020-10-22 11:32' or 2020-10-22T11:32; default is %s days ago"
+                    % start_timeN )
+    p.add_argument( "--rollup", dest="rollup", default=RollupDB,
+                    help="SQLite file of hourly transfer.log rollups, default %s" % RollupDB )
+    p.add_argument( "--no-rollup", dest="rollup", action="store_const", const=None,
+                    help="read all of transfer.log since the start time; don't use rollups" )
+    p.add_argument( "--mmap", dest="fast", action="store_true",
+                    help="memory-map transfer.log and decode only the lines to be counted" )
+    p.add_argument( "--processes", dest="processes", type=int, default=None,
+                    help="read transfer.log and its rotated logs, including gzipped ones, in "+
+                    "this many parallel processes; for long histories.  Rollups aren't used." )
+    p.add_argument( "--events", action="store_true",
+                    help="keep done, error, and fallback files as events in compact NumPy "+
+                    "columns, and count them from there; for long histories.  Implies "+
+                    "--no-rollup, unless --processes is used." )
+    p.add_argument( "--follow", action="store_true",
+                    help="run as a daemon, following transfer.log and writing counts, rates, "+
+                    "and alerts per data_node to the --status file" )
+    p.add_argument( "--status", default=StatusFile,
+                    help="status file for --follow, JSON or (if it ends in .prom) Prometheus "+
+                    "textfile; default %s" % StatusFile )
+    p.add_argument( "--interval", type=float, default=60,
+                    help="seconds between status file updates for --follow, default 60" )
+    args = p.parse_args( sys.argv[1:] )
+    if args.follow:
+        logging.basicConfig( filename='/var/log/synda/reports-follow.log', level=logging.INFO,
+                             format='%(asctime)s %(message)s' )
+        follow_transfers( TransferLOG, args.status, args.interval )
+        sys.exit()
+    if args.start_time is not None:
+        start_time = args.start_time
+    else:
+        start_time = (datetime.now()-timedelta(days=start_timeN)).strftime('%Y-%m-%d %H:%m')
+    print("From",start_time,':')
+    lines_read = "matching lines" if args.fast else "lines"
+    if args.processes is not None:
+        linec, donec, errc, fbc, terrs, tmplc = report_results(
+            parallel_scan( TransferLOG, start_time, args.processes, args.events ) )
+        print("searching", linec.count, "lines of transfer.log and its rotated logs")
+    elif args.rollup is None or args.events:
+        # One pass through transfer.log feeds all the accumulators.
+        linec, donec, errc, fbc, terrs, tmplc = report_results( scan(
+            iter_logsince( TransferLOG, start_time, TransferCKPT, None, args.fast ),
+            report_accumulators( args.events ) ) )
+        print("searching", linec.count, lines_read, "of transfer.log")
+    else:
+        ( linec, donec, errc, fbc, terrs, tmplc ), nhours = rollup_report(
+            TransferLOG, start_time, args.rollup, TransferCKPT, args.fast )
+        print("searching", linec.count, lines_read, "of transfer.log, and rollups of", nhours,
+              "hours")
+    print_transfer_report( donec, errc, fbc, tmplc )
 
     print("\nretraction summary since %s:"%start_time)
     ret_counts, exceptions = retraction_counts(start_time)
@@ -296,21 +1335,10 @@ if __name__ == '__main__':
     print(" %s exceptions" % len(exceptions))
 
     print("\ntransfer errors:")
-    terrors = interesting_transfer_errors( sincelines )
-    if len(terrors)==0:
-        print("None")
-    else:
-        for line in terrors:
-            print(line)
+    print_lines( terrs.lines )
 
     print("\ndiscovery errors:")
-    disclines = logsince( DiscoveryLOG, start_time, taillen=1234000 )
-    #...The last 123000 lines of discovery.log might cover a week if we're not too busy.
-    # The last 1234000 lines is safe.
-    print("searching", len(disclines), "lines")
-    terrors = interesting_discovery_errors( disclines )
-    if len(terrors)==0:
-        print("None")
-    else:
-        for line in terrors:
-            print(line)
+    linec, derrs = scan( iter_logsince( DiscoveryLOG, start_time, DiscoveryCKPT ),
+                         [ LineCounter(), DiscoveryErrorLines() ] )
+    print("searching", linec.count, "lines")
+    print_lines( derrs.lines )
@@ -35,6 +35,9 @@ echo >> $LOGFILE
 echo waiting file counts by data_node: >> $LOGFILE 2>&1
 sqlite3 -separator ' | ' /var/lib/synda/sdt/sdt.db "SELECT data_node,COUNT(*) FROM file WHERE status='waiting' GROUP BY data_node" >> $LOGFILE 2>&1
 echo >> $LOGFILE
+echo time to download the waiting files, at the rates since $PERF_START_DATE: >> $LOGFILE 2>&1
+/home/syndausr/scripts/drain_forecast.py $PERF_START_DATE $PERF_END_DATE >> $LOGFILE 2>&1
+echo >> $LOGFILE
 echo error file counts by data_node: >> $LOGFILE 2>&1
 sqlite3 -separator ' | ' /var/lib/synda/sdt/sdt.db "SELECT data_node,COUNT(*) FROM file WHERE status='error' GROUP BY data_node" >> $LOGFILE 2>&1
 
@@ -1,18 +1,39 @@
 #!/usr/bin/env python
 
-"""Finds retracted datasets, writes a list.
+"""Finds retracted datasets, and marks them as retracted in the Synda database.
 Simplest usage:
   retracted.py
 This will get the names of up to 20,000 retracted datasets from the index node.
 It will start at an offset read from a file, and write a new offset to the file:
-the old offset plus the number of datasets discovered in this run. """
+the old offset plus the number of datasets discovered in this run.
+The index node's responses are read as they arrive, in Solr JSON format; see fetch_retracted.
+With --audit, each response and the list of datasets found in it are also saved to files.
+With --chunking=std3 (the default), several queries are in flight at once, up to --workers;
+see get_retracted_multi_facets_concurrent. """
 
-import sys, re, datetime
-import subprocess as sp
+import sys, re, datetime, json
+import urllib.request, urllib.parse
+import threading, concurrent.futures
 import argparse, logging, time
 import debug, pdb
 import status_retracted
 
+# Each query for retracted datasets is this, followed by its constraints:
+search_url = "https://esgf-node.llnl.gov/esg-search/search?project=CMIP6&retracted=true&"+\
+             "fields=instance_id&replica=false&limit=10000&format=application%2Fsolr%2Bjson"
+# The most queries which may be in flight to any one host at once; see polite_query.
+host_limit = 4
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+# If True, save the index node's responses and the lists of datasets; see fetch_retracted.
+audit = False
+# The queue of datasets deferred because they had running files, kept in memory during a run
+# (see start_deferred); or None, to let each call of status_retracted.retract_datasets read and
+# write the queue file itself.
+deferred_queue = None
+# A field of a Solr JSON response which we want: numFound or an instance_id.
+solr_field = re.compile( rb'"(numFound)"\s*:\s*(\d+)|"(instance_id)"\s*:\s*("(?:[^"\\]|\\.)*")' )
+
 class numFoundException(Exception):
     """numFound was too big"""
     pass
@@ -40,15 +61,26 @@ def save_starting_offset( starting_offset ):
         f.write( str(starting_offset) )
 
 def retract_path(path, test):
-    """Retract datasets listed in the path text file retrieved by one_query.
+    """Retract datasets listed in the path text file, e.g. one saved by fetch_retracted.
+    If this is a test of the query system, and the database is not to be referenced.
+    Returns the number of datasets which were newly marked as retracted.
+    """
+    with open( path+'.txt' ) as f:
+        dataset_fids = [ status_retracted.parse_dataset_fid(line) for line in f ]
+    return retract_fids( dataset_fids, test )
+
+def retract_fids( dataset_fids, test ):
+    """Retract the datasets in a list of dataset_functional_ids, e.g. from one_query.
     If this is a test of the query system, and the database is not to be referenced.
     Returns the number of datasets which were newly marked as retracted.
     """
-    # Record the retracted datasets in the database:
+    # Record the retracted datasets in the database.  Datasets with running files don't stop
+    # this; they are deferred to the next run (see status_retracted.read_deferred).
     Nchanges = 0
     if not test:
         try:
-            Nchanges = status_retracted.status_retracted( path+'.txt' )
+            Nchanges = status_retracted.retract_datasets( dataset_fids, bulk=True,
+                                                          deferred_queue=deferred_queue )
             # ... this defaults to suffix='retracted'
         except Exception as e:
             # database access errors are what I want to be prepared for, but I'm
@@ -65,53 +97,136 @@ def retract_path(path, test):
             return 0
     return Nchanges
 
-def one_query( cmd, path ):
-    """Does one query specified by cmd.
+def start_deferred( test ):
+    """Starts a run: reads the queue of deferred datasets (see status_retracted.read_deferred)
+    once, and retries its retracted datasets.  Until finish_deferred, the queue is kept in
+    deferred_queue, and retract_fids adds newly deferred datasets to it rather than rereading
+    and rewriting the queue file for every query.
+    If this is a test of the query system, the database and queue are not referenced."""
+    global deferred_queue
+    if test:
+        return
+    retry, rest = status_retracted.take_deferred( 'dataset', 'retracted' )
+    deferred_queue = rest
+    if len(retry)==0:
+        return
+    try:
+        Nchanges = status_retracted.retract_datasets( retry, bulk=True,
+                                                      deferred_queue=deferred_queue )
+        logging.info( "%s deferred datasets were newly marked as retracted" % Nchanges )
+    except Exception as e:
+        # Keep them in the queue for the next run.
+        logging.error( "Failed to retry deferred datasets, with exception %s" % e.__repr__() )
+        deferred_queue.extend( [ ('dataset','retracted',fid) for fid in retry ] )
+
+def finish_deferred():
+    """Ends a run begun by start_deferred, by saving the queue of deferred datasets."""
+    global deferred_queue
+    if deferred_queue is not None:
+        status_retracted.save_deferred( deferred_queue )
+        deferred_queue = None
+
+def solr_fields( stream, copy=None, chunk=65536 ):
+    """Generator, reads a Solr JSON response from stream (a binary file object) a chunk at a
+    time, and yields (name, value) for each numFound and instance_id in it, in order.  It doesn't
+    wait for the whole response, or keep it.  If copy (a binary file object) is supplied, the
+    response is also written to it.
+    A match which reaches the end of what has arrived may be incomplete (e.g. a number cut off),
+    so it and whatever follows wait for the next chunk.  Only the last 64 KB without a match are
+    kept, which is much more than any field we want."""
+    buf = b''
+    while True:
+        data = stream.read( chunk )
+        if copy is not None:
+            copy.write( data )
+        buf += data
+        pos = 0
+        for match in solr_field.finditer( buf ):
+            if match.end()==len(buf) and len(data)>0:
+                break
+            if match.group(1) is not None:
+                yield 'numFound', int( match.group(2) )
+            else:
+                yield 'instance_id', json.loads( match.group(4) )
+            pos = match.end()
+        if len(data)==0:
+            return
+        buf = buf[ max( pos, len(buf)-65536 ): ]
+
+def fetch_retracted( url, path=None ):
+    """Queries the index node with url, which should ask for instance_id in Solr JSON format.
+    Returns numFound, and a list of the dataset_functional_ids (i.e. instance_ids) in the
+    response.  If path is supplied, the response is saved to path+'.json', and the list to
+    path+'.txt', for auditing."""
+    numFound = None
+    dataset_fids = []
+    copy = None if path is None else open( path+'.json', 'wb' )
+    try:
+        with urllib.request.urlopen( url, timeout=600 ) as response:
+            for name, value in solr_fields( response, copy ):
+                if name=='instance_id':
+                    dataset_fids.append( value )
+                elif numFound is None:
+                    numFound = value
+    finally:
+        if copy is not None:
+            copy.close()
+    if path is not None:
+        with open( path+'.txt', 'w' ) as f:
+            for dataset_fid in dataset_fids:
+                f.write( dataset_fid+'\n' )
+    if numFound is None:
+        raise Exception( "no numFound in the response to %s" % url )
+    return numFound, dataset_fids
+
+def one_query( url, path ):
+    """Does one query specified by url.
     Returns the number of datasets received in the response, which can be used
-    to compute the next offset.  Also returns numFound, extracted from the response.
-    The other arguments are a file path for the json input file and txt output file (without
-    the '.json' and '.txt' suffixes)."""
+    to compute the next offset.  Also returns numFound, extracted from the response, and the
+    list of datasets.
+    The other argument is a file path for the json and txt audit files (without the '.json' and
+    '.txt' suffixes), which are written only if audit is True."""
 
-    logging.info( "cmd=%s" % cmd )
-    wget_out = "undefined wget_out"
+    logging.info( "url=%s" % url )
     try:
-        wget_out = str(sp.check_output(cmd, shell=True, stderr=sp.STDOUT))
-        logging.info( "wget_out=%s" % wget_out )
+        numFound, dataset_fids = fetch_retracted( url, path if audit else None )
     except Exception as e:
-        logging.error( "one_query, wget exception, wget_out=%s" % wget_out )
+        logging.error( "one_query, exception fetching %s" % url )
         logging.error( " exception is %s" % e )
         try:
-            logging.error( "return code=%s" % e.returncode )
-        except:
-            pass
-        try:
-            logging.error( "error output=%s" % e.output )
+            logging.error( "return code=%s" % e.code )
         except:
             pass
         raise e
-
-    # logging and convert json output to a text list of datasets:
-    cmd = "grep numFound "+path+".json"
-    # Apply the grep command.
-    # BTW this is simpler but prints the whole numFound line: sp.call(cmd, shell=True)
-    # example of nFstr:
-    #  '<result name="response" numFound="132311" start="0" maxScore="1.0">\n'
-    nFstr = str(sp.Popen(cmd, shell=True, stdout=sp.PIPE).stdout.read())
-    # example of nF:  'numFound="132311" start="0" '
-    nF = nFstr[nFstr.find('numFound'):nFstr.find('maxScore')]
-    # example of numFound (an int):  132311
-    numFound = list(map(int, re.findall(r'\d+',nF) ))[0]
-    logging.info( nF )
-    cmd = 'grep \\"instance_id\\" '+path+'.json > '+path+'.txt'
-    sp.call(cmd, shell=True)
-    with open(path+'.txt') as fids: num_lines = len(fids.readlines())
-    # ... a terse way to count lines, memory hog ok because file is <10K lines.
+    logging.info( "numFound=%s" % numFound )
+    num_lines = len(dataset_fids)
     if num_lines<numFound:
         logging.warning( "one_query numFound=%s>num_lines=%s from %s !" % (numFound,num_lines,path) )
 
     logging.info( "num_lines=%s" % num_lines )
 
-    return num_lines, numFound
+    return num_lines, numFound, dataset_fids
+
+def host_semaphore( url ):
+    """Returns the semaphore which limits the queries in flight to the host of url (including
+    its port) to host_limit."""
+    host = urllib.parse.urlparse( url ).netloc
+    with host_semaphores_lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore( host_limit )
+        return host_semaphores[host]
+
+def polite_query( url, path ):
+    """Same as one_query, but first waits until fewer than host_limit queries to the same host
+    are in flight.  This is safe to call from several threads at once."""
+    with host_semaphore( url ):
+        return one_query( url, path )
+
+def constraints_name( constraints ):
+    """Returns a name for a string of constraints, for making file names, e.g.
+    'esgf1.dkrz.de_day' for 'data_node=esgf1.dkrz.de&frequency=day'."""
+    constr2 = constraints.replace('!=','=NOT')
+    return '_'.join([con.split('=')[1] for con in constr2.split('&') if con.find('=')>=0])
 
 def get_retracted( prefix,
                    starting_offset=0, npages=20, test=False ):
@@ -124,18 +239,17 @@ def get_retracted( prefix,
     Also returns Nchanges, the number of datasets which were newly marked as retracted.
     """
     numFoundmax = 0
-    cmd = "wget -O "+prefix+"%s.json 'https://esgf-node.llnl.gov/esg-search/search?project=CMIP6&retracted=true&fields=instance_id&replica=false&limit=10000&offset=%s'"\
-          % (starting_offset,starting_offset)
     Nchangesall = 0
     for N in range(npages):
         path = prefix+str(starting_offset)
-        num_lines, numFound = one_query( cmd, path )
+        url = search_url + "&offset=%s" % starting_offset
+        num_lines, numFound, dataset_fids = one_query( url, path )
         numFoundmax = max( numFoundmax, numFound )
         if num_lines==0:
             # No more datasets to be found
             break
         try:
-            Nchanges = retract_path(path, test)
+            Nchanges = retract_fids(dataset_fids, test)
         except Exception as e:
             # Flag to retry
             continue
@@ -153,39 +267,30 @@ def get_some_retracted( prefix, constraints='', test=True ):
     Two numbers are returned:  numFound and Nchanges, the number of datasets which were newly
     marked as retracted.
     """
-    constr2 = constraints.replace('!=','=NOT')
-    constr3 = '_'.join([con.split('=')[1] for con in constr2.split('&') if con.find('=')>=0])
-    path = prefix + constr3
-    cmd = "wget -O "+path+'.json'+\
-          " 'https://esgf-node.llnl.gov/esg-search/search?project=CMIP6&retracted=true&" +\
-          constraints +\
-          "&fields=instance_id&replica=false&limit=10000'"
-    num_lines, numFound = one_query( cmd, path )
+    path = prefix + constraints_name( constraints )
+    url = search_url + '&' + constraints
+    num_lines, numFound, dataset_fids = one_query( url, path )
     logging.info( "get_some_retracted; constraints=%s, num_lines=%s, numFound=%s"%
                   (constraints, num_lines, numFound ) )
     if num_lines<numFound:
         logging.warning( "get_some_retracted numFound=%s>num_lines=%s !" % (numFound,num_lines) )
         raise numFoundException
     else:
-        Nchanges = retract_path(path, test)
+        Nchanges = retract_fids(dataset_fids, test)
         return numFound, Nchanges
 
 def get_some_retracted_paginated( prefix, constraints='', test=True ):
     """Like get_some_retracted, but the query _is_ paginated.
     """
-    constr2 = constraints.replace('!=','=NOT')
-    constr3 = '_'.join([con.split('=')[1] for con in constr2.split('&') if con.find('=')>=0])
+    constr3 = constraints_name( constraints )
     numFoundMax = 0
     Nchangesall = 0
     starting_offset = 0
     page = 0
     while True:
         path = prefix + constr3 + '.' + str(page)
-        cmd = "wget -O "+path+'.json'+\
-            " 'https://esgf-node.llnl.gov/esg-search/search?project=CMIP6&retracted=true&" +\
-            constraints +\
-            "&fields=instance_id&replica=false&limit=10000&offset=%s'"%(starting_offset)
-        num_lines, numFound = one_query( cmd, path )
+        url = search_url + '&' + constraints + "&offset=%s" % starting_offset
+        num_lines, numFound, dataset_fids = one_query( url, path )
         logging.info( "get_some_retracted_paginated; constraints=%s, num_lines=%s, numFound=%s"%
                     (constraints, num_lines, numFound ) )
         numFoundMax = max( numFoundMax, numFound )
@@ -193,7 +298,7 @@ def get_some_retracted_paginated( prefix, constraints='', test=True ):
             # No more datasets to be found
             break
         try:
-            Nchanges = retract_path(path, test)
+            Nchanges = retract_fids(dataset_fids, test)
         except Exception as e:
             # Flag to retry
             continue
@@ -293,6 +398,84 @@ def get_retracted_multi_facets( prefix, fcts, constraints='', complement_query=T
             Nchangesall += Nchangesnow
     return numFoundall, Nchangesall
 
+def get_retracted_multi_facets_concurrent( prefix, fcts, constraints='', complement_query=True,
+                                           test=True, workers=4 ):
+    """Like get_retracted_multi_facets, and with the same arguments and return values, but up to
+    'workers' queries are in flight at once, each in a thread of a pool, and no more than
+    host_limit to one host (see polite_query).  The responses are handled one at a time, in this
+    thread, in the order they arrive: their datasets are marked as retracted in the database,
+    and a query with too many results is replaced by queries with another facet constrained,
+    which go into the pool.  So only this thread writes to the database, as with
+    get_retracted_multi_facets; but the queries are issued, and the datasets retracted, in a
+    different order.  The pages of a paginated query follow one another, because the offset of
+    each depends on the previous one.
+    If a query fails, the queries not yet started are cancelled and the exception is raised.
+    """
+    if len(fcts)==0 and len(constraints)==0:
+        return
+    numFoundall = 0
+    Nchangesall = 0
+    numFoundpaginated = {}  # constraints of a paginated query -> max numFound of its pages
+    pending = {}            # future -> (constraints, depth, offset, page)
+    # depth is the number of facets of fcts already constrained.  With more left, the query is
+    # not paginated, and offset is None; with none left, it's paginated.
+    with concurrent.futures.ThreadPoolExecutor( max_workers=workers ) as pool:
+        def submit( constraints, depth, offset=None, page=0 ):
+            if depth<len(fcts):
+                path = prefix + constraints_name( constraints )
+                url = search_url + '&' + constraints
+            else:
+                offset = offset or 0
+                path = prefix + constraints_name( constraints ) + '.' + str(page)
+                url = search_url + '&' + constraints + "&offset=%s" % offset
+            pending[ pool.submit( polite_query, url, path ) ] = ( constraints, depth, offset, page )
+        def split( constraints, depth ):
+            facet = fcts[depth][0]
+            facets = fcts[depth][1]
+            for fct in facets:
+                submit( '&'.join( [facet+'='+fct, constraints] ), depth+1 )
+            if complement_query:
+                fct_constraint = '&'.join([ facet+'!=%s'%fct for fct in facets ])
+                if fct_constraint != '':
+                    submit( '&'.join( [fct_constraint, constraints] ), depth+1 )
+
+        if len(constraints)>0:
+            submit( constraints, 0 )
+        else:
+            split( constraints, 0 )
+        while len(pending)>0:
+            done, not_done = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED )
+            for future in done:
+                constraints, depth, offset, page = pending.pop( future )
+                try:
+                    num_lines, numFound, dataset_fids = future.result()
+                except Exception as e:
+                    for other in pending:
+                        other.cancel()
+                    raise e
+                logging.info( "get_retracted_multi_facets_concurrent; constraints=%s, "
+                              "num_lines=%s, numFound=%s" % (constraints, num_lines, numFound) )
+                if offset is None:
+                    if num_lines<numFound:
+                        # There are too many query results; we have to constrain another facet.
+                        split( constraints, depth )
+                    else:
+                        Nchangesall += retract_fids( dataset_fids, test )
+                        numFoundall += numFound
+                else:
+                    numFoundpaginated[constraints] = max( numFoundpaginated.get(constraints,0),
+                                                          numFound )
+                    if num_lines==0:
+                        # No more datasets to be found
+                        continue
+                    Nchangesall += retract_fids( dataset_fids, test )
+                    offset += num_lines
+                    if offset < numFoundpaginated[constraints]:
+                        submit( constraints, depth, offset, page+1 )
+    numFoundall += sum( numFoundpaginated.values() )
+    return numFoundall, Nchangesall
+
 def my_data_nodes():
     """returns a list of data nodes."""
     # For now this is hardwired, because access to my test database in ~/db/ is slow.
@@ -311,10 +494,12 @@ def my_data_nodes():
         "vesgint-data.ipsl.upmc.fr", "esgf-node.gfdl.noaa.gov", "esgf-data1.llnl.gov",
         "esg-dn1.tropmet.res.in", "esgf-data.csc.fi", "esgf-data2.llnl.gov", "esgf1.dkrz.de" ]
 
-def get_retracted_std3( prefix, complement_query=True, test=True ):
+def get_retracted_std3( prefix, complement_query=True, test=True, workers=1 ):
     """Runs get_retracted_multi_facets on my three standard facets: data_node,
     time frequency, and realm.  Complements (i.e. anything not matching)
     are searched for iff complement_query be True.
+    If workers>1, runs get_retracted_multi_facets_concurrent instead, with up to that many
+    queries in flight.
     Returns numFound.
     Also returns Nchanges, the number of datasets which were newly marked as retracted."""
     # At present the frequency list is complete and the data_node list highly incomplete.
@@ -328,6 +513,9 @@ def get_retracted_std3( prefix, complement_query=True, test=True ):
                    'PAMIP', 'RFMIP', 'ScenarioMIP', 'VolMIP' ]
     fcts = [ ('data_node',data_nodes), ('frequency',frequencies), ('realm',realms),
              ('activity_id',activities) ]
+    if workers>1:
+        return get_retracted_multi_facets_concurrent( prefix, fcts, '', complement_query, test,
+                                                      workers )
     return get_retracted_multi_facets( prefix, fcts, '', complement_query, test)
 
 def get_retracted_frequency( prefix, test=True ):
@@ -372,9 +560,25 @@ if __name__ == '__main__':
     p.add_argument('--test', dest='test', action='store_true')
     p.add_argument('--no-test', dest='test', action='store_false')
     p.add_argument('--chunking', dest='chunking', default='std3' )
+    p.add_argument('--audit', dest='audit', action='store_true',
+                   help="save each response from the index node, and the datasets found in it, "+
+                   "to files beginning with the prefix" )
+    p.add_argument('--workers', dest='workers', type=int, default=4,
+                   help="with --chunking=std3, the most queries in flight at once; 1 means "+
+                   "one after another.  Default 4." )
+    p.add_argument('--host-limit', dest='host_limit', type=int, default=host_limit,
+                   help="the most queries in flight to any one host at once, default %s" %
+                   host_limit )
+    p.add_argument('--search-url', dest='search_url', default=search_url,
+                   help="the start of each query, to which its constraints are appended; "+
+                   "e.g. to use another index node or a local stand-in for testing.  "+
+                   "Default "+search_url.replace('%','%%') )
     p.set_defaults( test=False )
 
     args = p.parse_args( sys.argv[1:] )
+    audit = args.audit
+    host_limit = args.host_limit
+    search_url = args.search_url
 
     starting_offset = args.starting_offset
     if starting_offset is None:
@@ -385,14 +589,19 @@ if __name__ == '__main__':
     chunking = args.chunking
     prefix = prefix + str(datetime.datetime.now().day) + '-' # append day of the month
 
-    if chunking=='paginated':  #doesn't work, function is deleted
-        numFound, Nchanges = get_retracted_paginated( prefix, starting_offset, npages, test )
-    elif chunking=='data_node':
-        numFound, Nchanges = get_retracted_data_node( prefix, test )
-    elif chunking=='std3':
-        numFound, Nchanges = get_retracted_std3( prefix, False, test )
-    else:
-        print("bad argument --chunking=",chunking,"should be 'paginated' or 'data_node' or 'std3'")
-        logging.error(
-            "bad argument --chunking=",chunking,"should be 'paginated' or 'data_node' or 'std3'")
+    start_deferred( test )
+    try:
+        if chunking=='paginated':  #doesn't work, function is deleted
+            numFound, Nchanges = get_retracted_paginated( prefix, starting_offset, npages, test )
+        elif chunking=='data_node':
+            numFound, Nchanges = get_retracted_data_node( prefix, test )
+        elif chunking=='std3':
+            numFound, Nchanges = get_retracted_std3( prefix, False, test, args.workers )
+        else:
+            print("bad argument --chunking=",chunking,
+                  "should be 'paginated' or 'data_node' or 'std3'")
+            logging.error(
+                "bad argument --chunking=",chunking,"should be 'paginated' or 'data_node' or 'std3'")
+    finally:
+        finish_deferred()
     logging.info( "End of retracted.py.  numFound=%s, Nchanges=%s" % (numFound, Nchanges) )
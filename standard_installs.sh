@@ -55,11 +55,21 @@ echo `date --iso-8601=minutes` 'incr mon http othermon' >> $LOGFILE 2>&1
 echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_files/CMIP6-othermon-http-2023.08.02.txt >> $LOGFILE 2>&1
 # end of monthly data
 
+# The "best" nodes for day and 6hr data are chosen from last week's throughput and error rates.
+# best_nodes.py makes the selection files from the hand-maintained ones, and copies those for a
+# protocol with no qualifying nodes.  If that fails, use the hand-maintained selection files.
+echo `date --iso-8601=minutes` 'choosing best data nodes' >> $LOGFILE 2>&1
+if /home/syndausr/scripts/best_nodes.py --date measured >> $LOGFILE 2>&1; then
+    export BESTNODES=measured
+else
+    export BESTNODES=2023.08.02
+fi
+
 # daily data.  First "best" nodes, gridftp and http, then all nodes believed to support gridftp,
 # then all nodes, one table at a time
 echo `date --iso-8601=minutes` 'incr day, best data nodes' >> $LOGFILE 2>&1
-echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_files/CMIP6-day-bestnodes-gridftp-2023.08.02.txt>> $LOGFILE 2>&1
-echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_files/CMIP6-day-bestnodes-http-2023.08.02.txt>> $LOGFILE 2>&1
+echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_files/CMIP6-day-bestnodes-gridftp-$BESTNODES.txt>> $LOGFILE 2>&1
+echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_files/CMIP6-day-bestnodes-http-$BESTNODES.txt>> $LOGFILE 2>&1
 echo `date --iso-8601=minutes` 'incr day, all data nodes' >> $LOGFILE 2>&1
 echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_files/CMIP6-day-gridftp-2023.08.02.txt>> $LOGFILE 2>&1
 
@@ -81,8 +91,8 @@ echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_file
 
 # 6hr data from better-performing data nodes
 echo `date --iso-8601=minutes` 'incr 6hr, best data nodes' >> $LOGFILE 2>&1
-echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_files/CMIP6-6hr-bestnodes-gridftp-2023.08.02.txt>> $LOGFILE 2>&1
-echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_files/CMIP6-6hr-bestnodes-http-2023.08.02.txt>> $LOGFILE 2>&1
+echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_files/CMIP6-6hr-bestnodes-gridftp-$BESTNODES.txt>> $LOGFILE 2>&1
+echo y | synda install -i --timestamp_right_boundary $TODATE -s ~/selection_files/CMIP6-6hr-bestnodes-http-$BESTNODES.txt>> $LOGFILE 2>&1
 
 # CREATE-IP
 echo `date --iso-8601=minutes` 'CREATE-IP (reanalysis)' >> $LOGFILE 2>&1
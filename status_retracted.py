@@ -12,14 +12,29 @@ This can also change the status with other suffixes; just provide your preferred
 second argument, after the filename.
 And a list of files can be provided rather than a list of datasets. If so, the parameters should
 be 'files', filename, [suffix]
+With --bulk, the datasets are all changed at once, in one short transaction; see
+bulk_retracted_status.
+A dataset or file whose status can't be changed yet, because it has a running file, is deferred:
+it's recorded in a queue file, DeferredFile, and retried first in the next run; see
+read_deferred.
 """
 
-import sys, pdb
+import sys, os, pdb
 import logging
 import sqlite3
 import debug
+import synda_db
+from version_index import VersionIndex
 global conn, Nupdates, Nchanges
 conn = None
+# Versions of all the datasets, for newer-version checks; refreshed by status_retracted().
+versions = VersionIndex()
+# The queue of deferred datasets and files; see read_deferred().
+DeferredFile = '/p/css03/scratch/publishing/CMIP6_retracted_deferred'
+
+class RunningFileException(Exception):
+    """A file is running, i.e. being downloaded, so its status can't be changed now."""
+    pass
 
 def setup():
     """Initializes logging and the connection to the database, etc."""
@@ -44,13 +59,14 @@ def finish():
     conn.close()
     conn = None
 
-def list_data_nodes():
-    """returns a list of data_nodes in the database"""
-    global conn
-    setup()
+def list_data_nodes( snapshot=False ):
+    """returns a list of data_nodes in the database.  This scans the whole file table, so it
+    uses its own read-only connection, or if snapshot is True a snapshot of the database (see
+    synda_db.connect), rather than the connection used for updates."""
+    roconn = synda_db.connect( synda_db.SyndaDB, snapshot, timeout=12000 )
     try:
         cmd = "SELECT data_node FROM file GROUP BY data_node ORDER BY COUNT(*)"
-        curs = conn.cursor()
+        curs = roconn.cursor()
         curs.execute( cmd )
         datanodes = curs.fetchall()
     except Exception as e:
@@ -58,6 +74,7 @@ def list_data_nodes():
         raise e
     finally:
         curs.close()
+        roconn.close()
     return datanodes
 
 def file_retracted_status( file_id, suffix='retracted' ):
@@ -84,7 +101,7 @@ def file_retracted_status( file_id, suffix='retracted' ):
         return
     elif status=='running':
         # This is the most likely of the cases where another process wants to change the status too.
-        raise Exception("running file, try again later")
+        raise RunningFileException("running file, try again later")
     else:
         newstatus = suffix
     if status==newstatus:
@@ -108,9 +125,11 @@ def dataset_retracted_status( dataset_fid, suffix='retracted' ):
     updates the status of files in a single dataset which has been retracted.  Also updates the
     status of the dataset.  The input  argument is its dataset_functional_id in the Synda database.
     If the dataset isn't in the database, the database is not changed.
+    If any of its files is running, RunningFileException is raised before anything is changed,
+    as in bulk_retracted_status.
     """
     global conn, Nupdates, Nchanges
-    cmd = "SELECT file_id FROM file WHERE dataset_id IN "+\
+    cmd = "SELECT file_id, status FROM file WHERE dataset_id IN "+\
           "(SELECT dataset_id FROM dataset WHERE dataset_functional_id='%s')" % dataset_fid
     try:
         curs = conn.cursor()
@@ -124,55 +143,25 @@ def dataset_retracted_status( dataset_fid, suffix='retracted' ):
     if len(fresults)==0:
         # We usually get datasets into the database before they are retracted and disappear.
         # Do we have this dataset at all?  Is it superceded by a later version?
-        vers = dataset_fid[-9:]
-        same_version_exists = False
-        newer_version_exists = False
-        #cmd = "SELECT dataset_functional_id FROM dataset WHERE dataset_functional_id LIKE '%s%%'"\
-        #      % ( dataset_fid[:-9], )
-        cmd = "SELECT path_without_version FROM dataset WHERE dataset_functional_id='%s'" %\
-              dataset_fid
-        try:
-            curs = conn.cursor()
-            curs.execute(cmd)
-            presults = curs.fetchall()
-        except Exception as e:
-            logging.debug("status_retracted.dataset_retracted_status() 2 saw an exception %s" %e)
-            raise e
-        finally:
-            curs.close()
-        if len(presults)==0:
+        # The version index, refreshed for each list of datasets, answers without a query.
+        if dataset_fid not in versions:
             # The dataset is not in the database.
             return
-        else:
-            # The dataset is in the database.
-            assert( len(presults)==1 ) 
-            path_without_version = presults[0]
-            cmd = "SELECT dataset_functional_id FROM dataset WHERE path_without_version='%s'" %\
-                  path_without_version
-            try:
-                curs = conn.cursor()
-                curs.execute(cmd)
-                dresults = curs.fetchall()
-            except Exception as e:
-                logging.debug("status_retracted.dataset_retracted_status() 3 saw an exception %s"
-                              %e)
-                raise e
-            finally:
-                curs.close()
-            for dfid in dresults:
-                if dfid[0]==dataset_fid:
-                    same_version_exists = True
-                if dfid[0][-9:]>vers:
-                    newer_version_exists = True
-            if same_version_exists and not newer_version_exists:
-                logging.warning( "Dataset %s is retracted but there is no newer version!"
-                                 % dataset_fid )
+        if versions.has_path( dataset_fid ) and not versions.newer_version_exists( dataset_fid ):
+            logging.warning( "Dataset %s is retracted but there is no newer version!"
+                             % dataset_fid )
     #print "From dataset_fid",dataset_fid, "results=",fresults
+    if 'running' in [ status for (file_id,status) in fresults ]:
+        # The caller will defer this dataset.
+        raise RunningFileException("dataset %s has running files, try again later" % dataset_fid)
 
     # Change the statuses of component files
     try:
-        for file_id in fresults:
+        for file_id, status in fresults:
             file_retracted_status( file_id, suffix )
+    except RunningFileException as e:
+        # The caller will defer this dataset.
+        raise e
     except Exception as e:
         # Whatever went wrong, it may not happen again, e.g. trying to to change the status of
         # a 'running' file.  Leave the dataset unchanged for now, and re-raise the exception so that
@@ -213,58 +202,208 @@ def dataset_retracted_status( dataset_fid, suffix='retracted' ):
         conn.commit()
         Nupdates = 0
 
-def status_retracted( datasets, suffix='retracted' ):
+def read_deferred( deferred_file=DeferredFile ):
+    """Returns the queue of deferred datasets and files, i.e. those whose status couldn't be
+    changed because they had running files: a list of (kind, suffix, name) where kind is
+    'dataset' or 'file', and name is a dataset_functional_id or filename.  In deferred_file,
+    each is a line with kind, suffix, and name separated by spaces.  If there is no
+    deferred_file, the queue is empty."""
+    try:
+        with open( deferred_file ) as f:
+            return [ tuple(line.split()) for line in f if len(line.split())==3 ]
+    except FileNotFoundError:
+        return []
+
+def save_deferred( deferred, deferred_file=DeferredFile ):
+    """Writes the queue of deferred datasets and files (see read_deferred), without repeats."""
+    with open( deferred_file+'.tmp', 'w' ) as f:
+        for item in dict.fromkeys( deferred ):
+            f.write( ' '.join(item)+'\n' )
+    os.replace( deferred_file+'.tmp', deferred_file )
+
+def take_deferred( kind, suffix, deferred_file=DeferredFile ):
+    """Returns the names of the deferred datasets or files (kind is 'dataset' or 'file') to be
+    given the suffix, and the rest of the queue; see read_deferred."""
+    queue = read_deferred( deferred_file )
+    names = [ name for (k,sfx,name) in queue if k==kind and sfx==suffix ]
+    rest = [ item for item in queue if item[0]!=kind or item[1]!=suffix ]
+    if len(names)>0:
+        logging.info( "Retrying %s deferred %ss" % (len(names),kind) )
+    return names, rest
+
+def parse_dataset_fid( line ):
+    """Returns the dataset_functional_id in a line of a list of retracted datasets, which may
+    be just the dataset_functional_id, or a line from a JSON or XML response of the index node."""
+    # If this line comes from a JSON file, these operations will be likely to get just
+    # the dataset:
+    dataset_fid = line.strip()
+    if dataset_fid[0:24] == '<str name="instance_id">':
+        dataset_fid = dataset_fid[24:]        
+    elif dataset_fid[0:15] == '<str name="id">':
+        dataset_fid = dataset_fid[15:]        
+    elif dataset_fid[0:5] == '"id":':
+        dataset_fid = dataset_fid[5:]
+    elif dataset_fid[0] == '"':
+        dataset_fid = dataset_fid[1:]
+    elif dataset_fid[-2:] == '",':
+        dataset_fid = dataset_fid[:-2]
+    if dataset_fid.find('|')>0:
+        # if the line has 'id' and came from a JSON file, it ends with | followed
+        # by the data node
+        dataset_fid = dataset_fid.split('|')[0] # deletes '|' and everything after.
+    dataset_fid = dataset_fid.replace('</str>','')
+    return dataset_fid
+
+def bulk_retracted_status( dataset_fids, suffix='retracted' ):
+    """Does what dataset_retracted_status does, for all the datasets in a list of
+    dataset_functional_ids at once.  The ids are loaded into a temporary table, and all the
+    changes are made by a few UPDATEs joined with it, in one transaction; rather than several
+    statements for each dataset and two for each file.
+    The semantics are the same, except for running files: a dataset with any 'running' file
+    is deferred, i.e. left unchanged, rather than raising an exception which stops everything.
+    Returns the number of datasets which were newly marked, and a list of the deferred datasets'
+    dataset_functional_ids."""
+    global conn, Nupdates, Nchanges
+    conn.commit()
+    curs = conn.cursor()
+    try:
+        # Take the write lock now, rather than at the first UPDATE after our reads, so that
+        # nobody can change the statuses between our reads and writes.
+        curs.execute( "BEGIN IMMEDIATE" )
+        curs.execute( "CREATE TEMP TABLE IF NOT EXISTS retracted_fids "+
+                      "(dataset_functional_id TEXT PRIMARY KEY)" )
+        curs.execute( "DELETE FROM retracted_fids" )
+        curs.executemany( "INSERT OR IGNORE INTO retracted_fids VALUES (?)",
+                          [ (fid,) for fid in dataset_fids ] )
+        curs.execute( "DROP TABLE IF EXISTS temp.retracted_datasets" )
+        curs.execute( "CREATE TEMP TABLE retracted_datasets AS SELECT d.dataset_id, "+
+                      "d.dataset_functional_id, d.status, d.path_without_version "+
+                      "FROM retracted_fids r JOIN dataset d "+
+                      "ON d.dataset_functional_id=r.dataset_functional_id" )
+
+        # Defer datasets with running files.  Another process is likely to change their status.
+        curs.execute( "SELECT DISTINCT r.dataset_functional_id FROM retracted_datasets r "+
+                      "JOIN file f ON f.dataset_id=r.dataset_id WHERE f.status='running'" )
+        deferred = [ row[0] for row in curs.fetchall() ]
+        for dataset_fid in deferred:
+            logging.warning( "dataset %s has running files; deferred" % dataset_fid )
+        curs.execute( "DELETE FROM retracted_datasets WHERE EXISTS (SELECT 1 FROM file f "+
+                      "WHERE f.dataset_id=retracted_datasets.dataset_id AND f.status='running')" )
+
+        # A dataset with no files may be retracted because it has been superseded.  If it
+        # hasn't been, warn.
+        curs.execute( "SELECT r.dataset_functional_id FROM retracted_datasets r "+
+                      "WHERE r.path_without_version IS NOT NULL AND "+
+                      "NOT EXISTS (SELECT 1 FROM file f WHERE f.dataset_id=r.dataset_id) AND "+
+                      "NOT EXISTS (SELECT 1 FROM dataset d WHERE "+
+                      "d.path_without_version=r.path_without_version AND "+
+                      "substr(d.dataset_functional_id,-9)>substr(r.dataset_functional_id,-9))" )
+        for row in curs.fetchall():
+            logging.warning( "Dataset %s is retracted but there is no newer version!" % row[0] )
+
+        # Change the statuses of component files, except those which already have the suffix.
+        curs.execute( "UPDATE file SET status=? WHERE dataset_id IN "+
+                      "(SELECT dataset_id FROM retracted_datasets) AND substr(status,?)!=?",
+                      ( suffix, -len(suffix), suffix ) )
+        Nupdates += curs.rowcount
+
+        # Finally change the statuses of the datasets themselves.
+        curs.execute( "SELECT dataset_functional_id, status FROM retracted_datasets "+
+                      "WHERE instr(status,?)=0", (suffix,) )
+        changes = curs.fetchall()
+        curs.execute( "UPDATE dataset SET status=? WHERE dataset_id IN "+
+                      "(SELECT dataset_id FROM retracted_datasets WHERE instr(status,?)=0)",
+                      ( suffix, suffix ) )
+        for dataset_fid, status in changes:
+            logging.info( "dataset %s changed from %s to %s " % (dataset_fid,status,suffix) )
+        Nchanges += len(changes)
+        conn.commit()
+    except Exception as e:
+        logging.debug("status_retracted.bulk_retracted_status() saw an exception %s" %e )
+        conn.rollback()
+        raise e
+    finally:
+        curs.close()
+    Nupdates = 0
+    return len(changes), deferred
+
+def status_retracted( datasets, suffix='retracted', bulk=False, deferred_file=DeferredFile ):
     """Input is the path of a text file which contains a list of retracted datasets, as
     dataset_functional_ids or other forms which we can parse.  For each file, belonging to one of
     these datasets, and for which its status in the Synda database is appropriate, its
     status will be changed to 'retracted' (if we don't have it) or 'published-retracted' or
     'done-retracted' if we have it.  The dataset status will be changed similarly.
     (If supplied, another suffix will be used in place of 'retracted').
+    If bulk is True, all the datasets are changed at once by bulk_retracted_status.
+    A dataset with a running file is deferred: it's recorded in the queue in deferred_file, and
+    the rest go on.  The datasets deferred by earlier runs are retried first.
     """
-    global Nchanges
-    Nchanges = 0
     setup()
     logging.info( "Reading list of retracted datasets " + datasets )
     with open( datasets, 'r' ) as f:
-        for line in f:
-            # If this line comes from a JSON file, these operations will be likely to get just
-            # the dataset:
-            dataset_fid = line.strip()
-            if dataset_fid[0:24] == '<str name="instance_id">':
-                dataset_fid = dataset_fid[24:]        
-            elif dataset_fid[0:15] == '<str name="id">':
-                dataset_fid = dataset_fid[15:]        
-            elif dataset_fid[0:5] == '"id":':
-                dataset_fid = dataset_fid[5:]
-            elif dataset_fid[0] == '"':
-                dataset_fid = dataset_fid[1:]
-            elif dataset_fid[-2:] == '",':
-                dataset_fid = dataset_fid[:-2]
-            if dataset_fid.find('|')>0:
-                # if the line has 'id' and came from a JSON file, it ends with | followed
-                # by the data node
-                dataset_fid = dataset_fid.split('|')[0] # deletes '|' and everything after.
-            dataset_fid = dataset_fid.replace('</str>','')
+        dataset_fids = [ parse_dataset_fid(line) for line in f ]
+    Nchanges = retract_datasets( dataset_fids, suffix, bulk, deferred_file )
+    logging.info( "Finished processing retracted datasets " + datasets )
+    return Nchanges
+
+def retract_datasets( dataset_fids, suffix='retracted', bulk=False, deferred_file=DeferredFile,
+                      deferred_queue=None ):
+    """Like status_retracted, but the input is any iterable of dataset_functional_ids, e.g. as
+    read from the index node by retracted.fetch_retracted, rather than a file to be parsed.
+    If deferred_queue (a list, as from read_deferred) is supplied, the queue in deferred_file
+    is neither retried nor written; datasets with running files are appended to deferred_queue
+    instead, for the caller to save once with save_deferred.
+    Returns the number of datasets newly marked."""
+    global Nchanges
+    Nchanges = 0
+    setup()
+    if not bulk:
+        versions.refresh( conn )
+    if deferred_queue is None:
+        retry, queue = take_deferred( 'dataset', suffix, deferred_file )
+    else:
+        retry, queue = [], None
+    dataset_fids = list( dict.fromkeys( retry + list(dataset_fids) ) )
+    if bulk:
+        try:
+            nchanges, deferred = bulk_retracted_status( dataset_fids, suffix )
+        except Exception as e:
+            logging.error( "status_retracted() saw an exception %s" %e )
+            raise e
+    else:
+        deferred = []
+        for dataset_fid in dataset_fids:
             try:
                 dataset_retracted_status( dataset_fid, suffix )
+            except RunningFileException as e:
+                logging.warning( "dataset %s has running files; deferred" % dataset_fid )
+                deferred.append( dataset_fid )
             except Exception as e:
                 logging.error( "status_retracted() saw an exception %s" %e )
                 raise e
     finish()
-    logging.info( "Finished processing retracted datasets " + datasets )
+    if queue is None:
+        deferred_queue.extend( [ ('dataset',suffix,fid) for fid in deferred ] )
+    else:
+        save_deferred( queue + [ ('dataset',suffix,fid) for fid in deferred ], deferred_file )
+    if len(deferred)>0:
+        logging.info( "%s datasets with running files were deferred" % len(deferred) )
     logging.info( "%s datasets were newly marked as %s" % (Nchanges,suffix) )
     return Nchanges
 
-def files_retracted( files, suffix='retracted' ):
+def files_retracted( files, suffix='retracted', deferred_file=DeferredFile ):
     """Like status_retracted, but changes the status of only files.  Input is a list of
     filenames; we do no parsing or cleaning of anything else.
     ESGF retraction is supposed to be done by dataset, not file; but sometimes
     this can be useful.
+    Running files are deferred, as in status_retracted.
     """
     setup()
+    retry, queue = take_deferred( 'file', suffix, deferred_file )
+    deferred = []
     with open( files, 'r' ) as f:
-        for line in f:
-            filename = line.strip()
+        filenames = list( dict.fromkeys( retry + [ line.strip() for line in f ] ) )
+        for filename in filenames:
             cmd = "SELECT file_id FROM file WHERE filename='%s'" % filename
             try:
                 curs = conn.cursor()
@@ -277,11 +416,20 @@ def files_retracted( files, suffix='retracted' ):
                 curs.close()
             assert( len(results)==1 )
             file_id = results[0][0]
-            file_retracted_status( file_id, suffix )
+            try:
+                file_retracted_status( file_id, suffix )
+            except RunningFileException:
+                logging.warning( "file %s is running; deferred" % filename )
+                deferred.append( filename )
     finish()
+    save_deferred( queue + [ ('file',suffix,filename) for filename in deferred ], deferred_file )
 
 if __name__ == '__main__':
     suffix = 'retracted'
+    # --bulk anywhere on the command line means to use bulk_retracted_status.
+    bulk = '--bulk' in sys.argv
+    if bulk:
+        sys.argv.remove( '--bulk' )
     if len( sys.argv ) > 1:
         if sys.argv[1]=='file':
             if len( sys.argv ) > 3:
@@ -292,7 +440,7 @@ if __name__ == '__main__':
             if len( sys.argv ) > 2:
                 suffix = sys.argv[2]
             # sys.argv[1] should be or the name of a file listing retracted datasets
-            status_retracted( sys.argv[1], suffix )
+            status_retracted( sys.argv[1], suffix, bulk )
     else:
         print("please provide an input file, containing a list of retracted datasets")
         print("Or start with the keyword 'file', and continue with the name of a file"+\
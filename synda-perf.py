@@ -4,22 +4,35 @@
 times should be provided in a modified ISO 8601 format without letter separators, e.g.
 '2019-01-25 13:04'.  The third argument is a partial url, which is normally used to specify the
 protocol and data node, e.g. gsiftp://vesg.ipsl.upmc.fr.  But the % wildcard is permitted, and a
-longer url may be used to narrow the coverage further."""
+longer url may be used to narrow the coverage further.
+With --timeline, this writes a throughput timeline instead, as CSV or JSON for plotting; see
+timeline().  With --batch or --windows, this computes the rates for many windows and servers with
+a single query; see batch_perf().  With --concurrency, this reports how each data node's
+throughput depends on the number of simultaneous transfers; see concurrency_profile().
+With --distribution, this reports quantiles and histograms of per-file rates and durations,
+from sketches which can be saved and merged; see LogHistogram.
+The database is opened read-only.  With --snapshot, a snapshot copy of it is read instead, so that
+long queries don't hold locks which delay the Synda daemon; see synda_db.py."""
 
-import os, sys, glob
+import os, sys, glob, argparse, csv, json, re, bisect, math
 from pprint import pprint
 import sqlite3
 #import debug, pdb
 import datetime
+import numpy as np
+from synda_time import str2time, str2datetime64
+import synda_db
 global conn, curs
 
-def setup():
-    """Initializes the connection to the database, etc."""
+def setup( snapshot=False, max_age=None ):
+    """Initializes the connection to the database, etc.  The database is opened read-only; or if
+    snapshot is True, a snapshot of it is, so that long queries don't delay the Synda daemon.
+    See synda_db.connect, which also uses max_age."""
     global conn, curs
     # normal:
-    conn = sqlite3.connect('/var/lib/synda/sdt/sdt.db')
+    conn = synda_db.connect( synda_db.SyndaDB, snapshot, max_age )
     # test on a temporary copy of the database:
-    #conn = sqlite3.connect('~/db/sdt.db')
+    #conn = synda_db.connect( os.path.expanduser('~/db/sdt.db') )
     curs = conn.cursor()
 
 def finish():
@@ -28,20 +41,6 @@ def finish():
     conn.commit()
     conn.close()
 
-def str2time( date ):
-    """Given a date string such as '2019-01-25 13:04' or '2019-01-25 13:04:13.922788',
-    this function returns a datetime object representing the date."""
-    FMT_min = '%Y-%m-%d %H:%M'
-    FMT_sec = '%Y-%m-%d %H:%M:%S'
-    FMT_frac = '%Y-%m-%d %H:%M:%S.%f'
-    try:
-        return datetime.datetime.strptime( date, FMT_frac )
-    except ValueError:
-        try:
-            return datetime.datetime.strptime( date, FMT_sec )
-        except ValueError:
-            return datetime.datetime.strptime( date, FMT_min )
-
 def downloading_intervals( startin, stopin, file_intervals ):
     """Returns active_time: the amount of time, in seconds, within (start,stop) in which at least
     one of the files described by 'file_intervals' was being downloaded.
@@ -80,6 +79,40 @@ def downloading_intervals( startin, stopin, file_intervals ):
 
     return active_time
 
+def downloading_intervals_np( startin, stopin, file_intervals ):
+    """Same as downloading_intervals, with the same arguments and the same result, but faster
+    with many files.  The dates are parsed in bulk, into datetime64 arrays.  Then, once the files
+    are sorted by start_date, a running maximum of their end_dates is the top of the interval
+    being built; and a file which starts after that top starts a new interval.
+    (That depends on end_date>=start_date.  If a file doesn't satisfy that, we just call
+    downloading_intervals.)  Unlike downloading_intervals, this returns 0 if there are no files.
+    """
+    if len(file_intervals)==0:
+        return 0
+    stop = np.datetime64( str2time(stopin), 'us' )
+    starts = str2datetime64( [ file_int[0] for file_int in file_intervals ] )
+    ends = str2datetime64( [ file_int[1] for file_int in file_intervals ] )
+    if np.any( ends<starts ):
+        return downloading_intervals( startin, stopin, file_intervals )
+    order = np.argsort( starts, kind='stable' )   # like list.sort
+    starts = starts[order]
+    ends = ends[order]
+    tops = np.maximum.accumulate( ends )
+    # A new interval begins with the first file, and each file which starts after all
+    # previous files have ended.  Each interval ends at the top before the next one begins.
+    newint = np.concatenate( ( [True], starts[1:]>tops[:-1] ) )
+    bots = starts[newint]
+    firsts = np.flatnonzero( newint )
+    tops = tops[ np.append( firsts[1:]-1, len(starts)-1 ) ]
+    if not tops[-1]<stop:
+        bots, tops = bots[:-1], tops[:-1]
+    if len(bots)==0:
+        return 0
+    # Add up the seconds in the same order and the same way as timedelta.total_seconds(), so
+    # that the floating-point result is exactly the same.
+    seconds = ( tops-bots ).astype(np.int64)/10**6
+    return float( np.cumsum( seconds )[-1] )
+
 def url_hdr( url ):
     """url header, i.e. the protocol and data node but no more of the url."""
     upto_third_slash = url[: url.find('/', 2+url.find('//'))]
@@ -97,6 +130,31 @@ def url_hdrs( start, stop, server, method='aggregate' ):
     results = curs.fetchall()
     return list(set( [ url_hdr(r[0]) for r in results] ))
 
+def perf_files( start, stop, server ):
+    """Returns a list of (url, start_date, end_date, size) for the transfers used by perf_data,
+    i.e. with times between 'start' and 'stop', and a specified server (see perf_data).  This is
+    one query; see files_by_url_hdr to break the result down by data node."""
+    cmd = ("SELECT url, start_date, end_date, size FROM file WHERE start_date>='{0}' AND " +\
+           "end_date<='{1}' AND url LIKE '{2}%' AND " +\
+           "(status='done' OR status='published') AND size IS NOT NULL").format(start, stop, server)
+    # ...For more accuracy, I could include files overlapping the (start,stop) boundary, i.e.
+    # end_date>{0} and start_date<{1}.  Then I would have to reduce the file size in proportion
+    # to the amount of the file's download time which is within (start,stop).
+    curs.execute( cmd )
+    return curs.fetchall()
+
+def files_by_url_hdr( files ):
+    """Given a list of (url, start_date, end_date, size) from perf_files, returns a dict
+    whose keys are url headers (see url_hdr), and values the lists of (start_date, end_date, size)
+    with that url header."""
+    byhdr = {}
+    for (url,start_date,end_date,size) in files:
+        uh = url_hdr(url)
+        if uh not in byhdr:
+            byhdr[uh] = []
+        byhdr[uh].append( (start_date,end_date,size) )
+    return byhdr
+
 def perf_data( start, stop, server, method='aggregate' ):
     """Returns performance data for transfers with times between 'start' and 'stop', and a
     specified server.
@@ -104,14 +162,15 @@ def perf_data( start, stop, server, method='aggregate' ):
     '2019-01-25 13:04'.  The server - both the data node and the protocol - is specified as the
     first characters of the url, e.g. 'gsiftp://esgf1.dkrz.de' or 'http://esgf1.dkrz.de'.
     Optionally you may provide a method argument to specify how the rate is to be computed."""
-    cmd = ("SELECT start_date, end_date, size FROM file WHERE start_date>='{0}' AND " +\
-           "end_date<='{1}' AND url LIKE '{2}%' AND " +\
-           "(status='done' OR status='published') AND size IS NOT NULL").format(start, stop, server)
-    # ...For more accuracy, I could include files overlapping the (start,stop) boundary, i.e.
-    # end_date>{0} and start_date<{1}.  Then I would have to reduce the file size in proportion
-    # to the amount of the file's download time which is within (start,stop).
-    curs.execute( cmd )
-    results = curs.fetchall()
+    results = [ (start_date,end_date,size) for (url,start_date,end_date,size) in
+                perf_files( start, stop, server ) ]
+    return perf_compute( start, stop, server, results, method )
+
+def perf_compute( start, stop, server, results, method='aggregate' ):
+    """Computes the performance data returned by perf_data, from results, a list of
+    (start_date, end_date, size) for the transfers with times between 'start' and 'stop' and the
+    specified server.  The server is used only by the 'synda' method, which queries the
+    database."""
     sizes =  [ size for (start_date,end_date,size) in results ]
     Nfiles = len(sizes)
     totsize = sum(sizes)
@@ -122,7 +181,7 @@ def perf_data( start, stop, server, method='aggregate' ):
 
     if method=='aggregate':  # (bytes downloaded)/(downloading time).  Takes parallelism
         #    into account, and doesn't count inactive time in (start,stop ).
-        active_time = downloading_intervals( start, stop, results )
+        active_time = downloading_intervals_np( start, stop, results )
         if active_time>0:
             retrate = totsize/active_time/1024/1024. 
             retsize = totsize/1024/1024/1024.
@@ -162,49 +221,553 @@ def perf_data( start, stop, server, method='aggregate' ):
     return round(retrate,4), round(spf,4), round(retsize,4), round(avgsize,4), Nfiles
 
             
-if __name__ == '__main__':
-    setup()
-    print("args=", sys.argv)
-    if len( sys.argv ) < 3:
-        print("provide start time, stop time, and server in the form of")
-        print(" '2019-01-25 13:04' '2019-01-25 14:04' 'gsiftp://esgf1.umr-cnrm.fr'")
-        print(" You can use a % wildcard character when specifying the server.")
-        print(" You can use a T instead of a space between the date and time.")
+def timeline_files( start, stop, server ):
+    """Like perf_files, but returns the transfers which overlap the time between 'start' and
+    'stop' at all, including those which began before start or ended after stop."""
+    cmd = ("SELECT url, start_date, end_date, size FROM file WHERE end_date>'{0}' AND " +\
+           "start_date<'{1}' AND url LIKE '{2}%' AND " +\
+           "(status='done' OR status='published') AND size IS NOT NULL").format(start, stop, server)
+    curs.execute( cmd )
+    return curs.fetchall()
+
+def sweep_integrals( starts, ends, weights, edges ):
+    """Given files active from starts to ends (arrays of seconds), each with a weight, returns
+    an array with one number for each bucket between successive edges: the integral, over the
+    bucket, of the total weight of the files active at each time.  With weights of 1, that's
+    the number of seconds of transfer; with weights of bytes per second, it's bytes.
+    This is a sweep over the sorted starts and ends: the total weight is a step function which
+    changes only at them, so its integral is piecewise linear, and exact at the edges by
+    interpolation."""
+    if len(starts)==0:
+        return np.zeros( len(edges)-1 )
+    times = np.concatenate( (starts, ends) )
+    deltas = np.concatenate( (weights, -weights) )
+    order = np.argsort( times, kind='stable' )
+    times = times[order]
+    level = np.cumsum( deltas[order] )   # total weight after each start or end
+    integral = np.concatenate( ( [0.], np.cumsum( level[:-1]*np.diff(times) ) ) )
+    return np.diff( np.interp( edges, times, integral ) )
+
+def file_timeline( files, t0, edges ):
+    """Computes a timeline for files, a list of (start_date, end_date, size), in buckets
+    between successive edges, which are in seconds after t0, a datetime64.  Returns a dict with
+    arrays, one number per bucket: 'active_transfers' is the number of files being transferred
+    at any time in the bucket, 'concurrency' the average number being transferred, and
+    'bytes_per_s' the transfer rate.  A file's bytes are prorated over its transfer time, so a
+    file which overlaps a bucket edge contributes to each bucket in proportion to its time
+    there.  A file with no transfer time contributes all its bytes at its start."""
+    starts = ( str2datetime64([ f[0] for f in files ]) - t0 ).astype(np.int64)/1.e6
+    ends = ( str2datetime64([ f[1] for f in files ]) - t0 ).astype(np.int64)/1.e6
+    sizes = np.array( [ f[2] for f in files ], dtype=np.float64 )
+    ends = np.maximum( starts, ends )
+    durations = ends - starts
+    timed = durations>0
+    widths = np.diff( edges )
+    seconds = sweep_integrals( starts[timed], ends[timed], np.ones(np.sum(timed)), edges )
+    nbytes = sweep_integrals( starts[timed], ends[timed], sizes[timed]/durations[timed], edges )
+    nbytes += np.histogram( starts[~timed], edges, weights=sizes[~timed] )[0]
+    # Active in [b0,b1) if started before b1, and neither ended before b0 nor instantaneous
+    # before b0:
+    started = np.searchsorted( np.sort(starts), edges[1:], 'left' )
+    ended = np.searchsorted( np.sort(ends[timed]), edges[:-1], 'right' ) +\
+            np.searchsorted( np.sort(starts[~timed]), edges[:-1], 'left' )
+    return { 'active_transfers': started-ended, 'concurrency': seconds/widths,
+             'bytes_per_s': nbytes/widths }
+
+def timeline( start, stop, server, bucket=3600 ):
+    """Returns a throughput timeline of transfers between 'start' and 'stop', for the specified
+    server (see perf_data) and also broken down by url header, in buckets of bucket seconds.
+    The transfers are read with one query, and each timeline is computed in one sweep; see
+    file_timeline.  Returns a list of bucket start times, and a dict from 'all' or a url header
+    to a dict of arrays as from file_timeline."""
+    t0 = np.datetime64( str2time(start), 'us' )
+    t1 = np.datetime64( str2time(stop), 'us' )
+    span = (t1-t0).astype(np.int64)/1.e6
+    edges = np.append( np.arange( 0, span, bucket, dtype=np.float64 ), span )
+    times = [ str( t0+np.timedelta64(int(edge*1e6),'us') ).replace('T',' ')[:19]
+              for edge in edges[:-1] ]
+    files = timeline_files( start, stop, server )
+    groups = { 'all': [ (start_date,end_date,size) for (url,start_date,end_date,size) in files ] }
+    groups.update( files_by_url_hdr( files ) )
+    return times, { name: file_timeline( groups[name], t0, edges ) for name in groups }
+
+def write_timeline( output, fmt, start, stop, bucket, times, timelines ):
+    """Writes the timelines, from timeline(), to the open file output.  The format fmt is 'csv',
+    with a row for each bucket and data node; or 'json'."""
+    names = [ 'all' ] + sorted([ name for name in timelines if name!='all' ])
+    if fmt=='json':
+        json.dump( { 'start': start, 'stop': stop, 'bucket_seconds': bucket, 'time': times,
+                     'data_nodes': { name: {
+                         'active_transfers': [ int(x) for x in
+                                               timelines[name]['active_transfers'] ],
+                         'concurrency': [ round(float(x),4) for x in
+                                          timelines[name]['concurrency'] ],
+                         'bytes_per_s': [ round(float(x),1) for x in
+                                          timelines[name]['bytes_per_s'] ] }
+                                     for name in names } },
+                   output, indent=1 )
+        output.write( '\n' )
     else:
-        if False:  # for tests:
-            for method in ['aggregate','aggregate-crude','seqsize','arith','synda']:
-                rate,size= perf_data( sys.argv[1], sys.argv[2], sys.argv[3], method )
-                if rate is None:
-                    print("No data downloaded")
-                else:
-                    print(method, '	',rate, "MiB/s", size, "GiB")
-        else:
-            # Times with a T work better in scripts, e.g. '2019-01-25T13:04'.
-            # The Synda database uses a space between the date and time, e.g.
-            # '2019-01-25 13:04'
-            start = sys.argv[1].replace('T',' ')
-            stop  = sys.argv[2].replace('T',' ')
-            if len(sys.argv)>=4:
-                server = sys.argv[3]
-            else:
-                server = '%'
-            rate,spf,size,avgsize,Nfiles = perf_data( start, stop, server )
-            if rate is None:
-                print("No data downloaded")
-            else:
-                uhs = url_hdrs( start, stop, server )
-                uhs.sort()
-                print('rate',rate, "MiB/s  Nfiles",Nfiles,"  size", size, "GiB", "avg size", avgsize, "MiB", uhs)
-                if len(uhs)>1:
-                    for uh in uhs:
-                        rate,spf,size,avgsize,Nfiles = perf_data( start, stop, uh )
-                        print("rate {:6.2f}".format(rate),\
-                            "MiB/s  Nfiles {:5d}".format(Nfiles),\
-                            "  size {:8.2f}".format(size),\
-                            "GiB", "  avg size {:8.2f}".format(avgsize), "MiB", uh)
+        writer = csv.writer( output )
+        writer.writerow( [ 'time', 'data_node', 'active_transfers', 'concurrency',
+                           'bytes_per_s' ] )
+        for name in names:
+            tl = timelines[name]
+            for i, time in enumerate(times):
+                writer.writerow( [ time, name, int(tl['active_transfers'][i]),
+                                   round(float(tl['concurrency'][i]),4),
+                                   round(float(tl['bytes_per_s'][i]),1) ] )
 
-    finish()
+def bucket_seconds( bucket ):
+    """Converts a bucket size such as 'minute', 'hour', 'day', or a number of seconds, to
+    seconds."""
+    named = { 'minute': 60, 'hour': 3600, 'day': 86400 }
+    if bucket in named:
+        return named[bucket]
+    return float( bucket )
 
+def batch_windows( start, stop, length ):
+    """Returns a list of consecutive windows (start, stop), each length seconds long, from
+    'start' to 'stop'; the last may be shorter.  The times are strings like those perf_data
+    takes.  If 'start' isn't before 'stop', there are no windows."""
+    t = str2time( start )
+    tstop = str2time( stop )
+    delta = datetime.timedelta( seconds=length )
+    fmt = '%Y-%m-%d %H:%M' if length%60==0 and t.second==0 else '%Y-%m-%d %H:%M:%S'
+    windows = []
+    while t<tstop:
+        windows.append( ( t.strftime(fmt), min(t+delta,tstop).strftime(fmt) ) )
+        t += delta
+    if len(windows)>0:
+        windows[-1] = ( windows[-1][0], stop )
+    return windows
 
-    
+def like_prefix( server ):
+    """Returns a compiled regular expression which matches a url just as the SQL condition
+    url LIKE 'server%' does: % is a wildcard, _ matches any character, and the case of ASCII
+    letters doesn't matter."""
+    pattern = ''.join([ '.*' if c=='%' else '.' if c=='_' else re.escape(c) for c in server ])
+    return re.compile( pattern, re.IGNORECASE|re.DOTALL )
 
+def batch_files( windows, servers ):
+    """Returns a list of (url, start_date, end_date, size), sorted by start_date, with every
+    transfer which perf_files would return for any of the windows and servers.  This is one
+    query."""
+    first = min([ w[0] for w in windows ])
+    last = max([ w[1] for w in windows ])
+    cmd = ("SELECT url, start_date, end_date, size FROM file WHERE start_date>='{0}' AND " +\
+           "end_date<='{1}' AND ({2}) AND " +\
+           "(status='done' OR status='published') AND size IS NOT NULL ORDER BY start_date").\
+           format( first, last, ' OR '.join([ "url LIKE '%s%%'" % server for server in servers ]) )
+    curs.execute( cmd )
+    return curs.fetchall()
+
+def batch_perf( windows, servers, method='aggregate' ):
+    """Computes perf_data for every window (start,stop) and every server, with a single query.
+    Returns a list of tuples (start, stop, server, rate, spf, size, avgsize, Nfiles), with the
+    same numbers as perf_data would return.
+    The transfers, sorted by start_date, are split among the servers.  Then for each server,
+    two pointers sweep through them as the windows advance: the first transfer which starts in
+    the window, and the first which starts after it.  Between them are the window's transfers,
+    except for those ending after it; so each window costs only its own transfers."""
+    files = batch_files( windows, servers )
+    results = []
+    for server in servers:
+        match = like_prefix( server ).match
+        rows = [ (start_date,end_date,size) for (url,start_date,end_date,size) in files
+                 if match(url) ]
+        starts = [ row[0] for row in rows ]
+        lo = 0
+        for wstart, wstop in sorted(windows):
+            lo = bisect.bisect_left( starts, wstart, lo )
+            hi = bisect.bisect_right( starts, wstop, lo )
+            wrows = [ row for row in rows[lo:hi] if row[1]<=wstop ]
+            rate,spf,size,avgsize,Nfiles = perf_compute( wstart, wstop, server, wrows, method )
+            results.append( (wstart, wstop, server, rate, spf, size, avgsize, Nfiles or 0) )
+    return results
+
+def write_batch( output, fmt, results ):
+    """Writes the results of batch_perf to the open file output, as 'csv' or 'json' (fmt).
+    Rates are in MiB/s, sizes in GiB, and average sizes in MiB."""
+    keys = [ 'start', 'stop', 'server', 'rate', 'spf', 'size', 'avgsize', 'Nfiles' ]
+    if fmt=='json':
+        json.dump( [ dict(zip(keys,result)) for result in results ], output, indent=1 )
+        output.write( '\n' )
+    else:
+        writer = csv.writer( output )
+        writer.writerow( keys )
+        for result in results:
+            writer.writerow( result )
+
+def concurrency_profile( files ):
+    """Given files, a list of (start_date, end_date, size), returns three arrays: concurrency
+    levels (numbers of simultaneous transfers) 1, 2, 3,...; the seconds during which there were
+    that many transfers; and the aggregate throughput, in MiB/s, during those seconds.
+    This is a sweep over the sorted starts and ends.  Between successive ones, the concurrency
+    and the throughput are constant; each file's bytes are spread evenly over its transfer time.
+    Files with no transfer time are ignored."""
+    starts = str2datetime64([ f[0] for f in files ]).astype(np.int64)/1.e6
+    ends = str2datetime64([ f[1] for f in files ]).astype(np.int64)/1.e6
+    sizes = np.array( [ f[2] for f in files ], dtype=np.float64 )
+    timed = ends>starts
+    starts, ends, sizes = starts[timed], ends[timed], sizes[timed]
+    if len(starts)==0:
+        return np.zeros(0,np.int64), np.zeros(0), np.zeros(0)
+    rates = sizes/(ends-starts)
+    times = np.concatenate( (starts, ends) )
+    order = np.argsort( times, kind='stable' )
+    times = times[order]
+    level = np.cumsum( np.concatenate( (np.ones(len(starts),np.int64),
+                                        -np.ones(len(ends),np.int64)) )[order] )
+    rate = np.cumsum( np.concatenate( (rates, -rates) )[order] )
+    dt = np.diff( times )
+    seconds = np.bincount( level[:-1], weights=dt )
+    nbytes = np.bincount( level[:-1], weights=rate[:-1]*dt )
+    levels = np.arange( 1, len(seconds) )
+    seconds, nbytes = seconds[1:], nbytes[1:]   # level 0 is idle time
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        mibps = np.where( seconds>0, nbytes/seconds/1024/1024, 0. )
+    return levels, seconds, mibps
+
+def concurrency_knee( levels, seconds, mibps, min_seconds=60, fraction=0.9 ):
+    """Returns the knee of a concurrency profile from concurrency_profile: the lowest
+    concurrency level at which the throughput reached fraction of the maximum throughput.  More
+    simultaneous transfers than that add little.  Only levels observed for at least min_seconds
+    are considered.  Returns None if there are none."""
+    observed = seconds>=min_seconds
+    if not np.any(observed):
+        return None
+    best = np.max( mibps[observed] )
+    return int( levels[ observed & (mibps>=fraction*best) ][0] )
+
+def concurrency_analysis( start, stop, server, min_seconds=60, fraction=0.9 ):
+    """Returns a dict from url header (see url_hdr) to the data node's concurrency profile:
+    a dict with arrays 'concurrency', 'seconds', and 'MiB_per_s' (see concurrency_profile), and
+    the 'knee' (see concurrency_knee).  The transfers are those of perf_data."""
+    analysis = {}
+    byhdr = files_by_url_hdr( perf_files( start, stop, server ) )
+    for uh in sorted(byhdr):
+        levels, seconds, mibps = concurrency_profile( byhdr[uh] )
+        analysis[uh] = { 'concurrency': levels, 'seconds': seconds, 'MiB_per_s': mibps,
+                         'knee': concurrency_knee( levels, seconds, mibps, min_seconds,
+                                                   fraction ) }
+    return analysis
+
+def write_concurrency( output, fmt, analysis ):
+    """Writes the results of concurrency_analysis to the open file output, as 'csv' (a row
+    for each data node and concurrency level) or 'json' (fmt)."""
+    if fmt=='json':
+        json.dump( { uh: { 'knee': prof['knee'],
+                           'concurrency': [ int(x) for x in prof['concurrency'] ],
+                           'seconds': [ round(float(x),3) for x in prof['seconds'] ],
+                           'MiB_per_s': [ round(float(x),4) for x in prof['MiB_per_s'] ] }
+                     for uh, prof in analysis.items() }, output, indent=1 )
+        output.write( '\n' )
+    else:
+        writer = csv.writer( output )
+        writer.writerow( [ 'data_node', 'concurrency', 'seconds', 'MiB_per_s',
+                           'MiB_per_s_per_transfer', 'knee' ] )
+        for uh, prof in analysis.items():
+            for level, seconds, mibps in zip( prof['concurrency'], prof['seconds'],
+                                              prof['MiB_per_s'] ):
+                if seconds==0:
+                    continue
+                writer.writerow( [ uh, int(level), round(float(seconds),3),
+                                   round(float(mibps),4), round(float(mibps)/level,4),
+                                   1 if level==prof['knee'] else 0 ] )
+
+class LogHistogram:
+    """A mergeable streaming sketch of a distribution of positive numbers, for quantiles and
+    histograms.  A value x is counted in bin ceil(log(x)/log(gamma)), where
+    gamma = (1+relative_accuracy)/(1-relative_accuracy); so any quantile is known within
+    relative_accuracy.  The bins are a dict, and there are only a few hundred of them over the
+    range of file transfer rates or durations, however many values are added.  Values <=0 are
+    counted separately.  Two sketches with the same relative_accuracy merge exactly, and a
+    sketch can be stored as a dict (see to_dict), so daily sketches can be merged into weekly
+    ones."""
+    def __init__( self, relative_accuracy=0.01 ):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1+relative_accuracy)/(1-relative_accuracy)
+        self.lngamma = math.log( self.gamma )
+        self.bins = {}   # bin index -> count
+        self.zero = 0    # count of values <=0
+        self.count = 0
+        self.sum = 0.
+        self.min = math.inf
+        self.max = -math.inf
+    def add_many( self, values ):
+        """Adds an array or list of values."""
+        values = np.asarray( values, dtype=np.float64 )
+        if len(values)==0:
+            return
+        self.count += len(values)
+        self.sum += float( np.sum(values) )
+        self.min = min( self.min, float(np.min(values)) )
+        self.max = max( self.max, float(np.max(values)) )
+        positive = values>0
+        self.zero += int( np.sum(~positive) )
+        indices = np.ceil( np.log(values[positive])/self.lngamma ).astype(np.int64)
+        keys, counts = np.unique( indices, return_counts=True )
+        for key, count in zip( keys.tolist(), counts.tolist() ):
+            self.bins[key] = self.bins.get(key,0) + count
+    def merge( self, other ):
+        """Adds in the counts of another LogHistogram with the same relative_accuracy."""
+        if other.relative_accuracy!=self.relative_accuracy:
+            raise ValueError( "can't merge LogHistograms with relative accuracies %s and %s" %
+                              (self.relative_accuracy, other.relative_accuracy) )
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key,0) + count
+        self.zero += other.zero
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min( self.min, other.min )
+        self.max = max( self.max, other.max )
+    def value( self, key ):
+        """The representative value of a bin, within relative_accuracy of all values in it."""
+        return 2*self.gamma**key/(self.gamma+1)
+    def quantile( self, q ):
+        """Returns the q-quantile (0<=q<=1), e.g. q=0.5 for the median; None if empty."""
+        if self.count==0:
+            return None
+        rank = q*(self.count-1)
+        seen = self.zero
+        if rank<seen:
+            return max( self.min, 0. )
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank<seen:
+                return min( max( self.value(key), self.min ), self.max )
+        return self.max
+    def histogram( self, base=2 ):
+        """Returns a coarser histogram as a list of (low, high, count), with bins from one
+        power of base to the next.  Values <=0 are left out."""
+        coarse = {}
+        for key, count in self.bins.items():
+            power = math.floor( math.log( self.value(key), base ) )
+            coarse[power] = coarse.get(power,0) + count
+        return [ ( base**power, base**(power+1), coarse[power] ) for power in sorted(coarse) ]
+    def to_dict( self ):
+        """Returns the sketch as a dict, suitable for JSON; see from_dict."""
+        return { 'relative_accuracy': self.relative_accuracy, 'zero': self.zero,
+                 'count': self.count, 'sum': self.sum,
+                 'min': self.min if self.count>0 else None,
+                 'max': self.max if self.count>0 else None,
+                 'bins': { str(key): count for key, count in self.bins.items() } }
+    @classmethod
+    def from_dict( cls, d ):
+        """Returns a LogHistogram made from a dict from to_dict."""
+        sketch = cls( d['relative_accuracy'] )
+        sketch.bins = { int(key): count for key, count in d['bins'].items() }
+        sketch.zero, sketch.count, sketch.sum = d['zero'], d['count'], d['sum']
+        if sketch.count>0:
+            sketch.min, sketch.max = d['min'], d['max']
+        return sketch
+
+def distribution_sketches( start, stop, server, relative_accuracy=0.01, chunk=100000 ):
+    """Returns sketches (see LogHistogram) of the per-file transfer rates, in MiB/s, and
+    durations, in seconds, of the transfers of perf_data.  The result is a dict from 'all' or a
+    url header (i.e. protocol and data node, see url_hdr) to a dict with LogHistograms 'rate'
+    and 'duration'.  The rows are read chunk at a time, so this runs over months of them in
+    constant memory.  A file with no transfer time has duration 0 and no rate."""
+    cmd = ("SELECT url, start_date, end_date, size FROM file WHERE start_date>='{0}' AND " +\
+           "end_date<='{1}' AND url LIKE '{2}%' AND " +\
+           "(status='done' OR status='published') AND size IS NOT NULL").format(start, stop, server)
+    sketches = {}
+    def sketches_for( name ):
+        if name not in sketches:
+            sketches[name] = { 'rate': LogHistogram(relative_accuracy),
+                               'duration': LogHistogram(relative_accuracy) }
+        return sketches[name]
+    sketches_for( 'all' )
+    curs.execute( cmd )
+    while True:
+        rows = curs.fetchmany( chunk )
+        if len(rows)==0:
+            break
+        durations = ( str2datetime64([ row[2] for row in rows ]) -
+                      str2datetime64([ row[1] for row in rows ]) ).astype(np.int64)/1.e6
+        sizes = np.array( [ row[3] for row in rows ], dtype=np.float64 )
+        hdrs = np.array( [ url_hdr(row[0]) for row in rows ] )
+        timed = durations>0
+        rates = np.zeros( len(rows) )
+        rates[timed] = sizes[timed]/durations[timed]/1024/1024
+        for name in [ 'all' ] + list(np.unique(hdrs)):
+            selected = slice(None) if name=='all' else hdrs==name
+            sketches_for(str(name))['duration'].add_many( durations[selected] )
+            sketches_for(str(name))['rate'].add_many( rates[selected][ timed[selected] ] )
+    return sketches
+
+def save_sketches( path, start, stop, server, sketches ):
+    """Writes sketches, as from distribution_sketches, to a JSON file."""
+    with open( path, 'w' ) as f:
+        json.dump( { 'start': start, 'stop': stop, 'server': server,
+                     'sketches': { name: { metric: sketch.to_dict()
+                                           for metric, sketch in metrics.items() }
+                                   for name, metrics in sketches.items() } }, f )
+
+def load_sketches( paths ):
+    """Reads and merges sketches written by save_sketches, e.g. daily ones to get weekly ones.
+    Returns the earliest start, the latest stop, and the merged sketches."""
+    start, stop, sketches = None, None, {}
+    for path in paths:
+        with open( path ) as f:
+            saved = json.load( f )
+        start = saved['start'] if start is None else min( start, saved['start'] )
+        stop = saved['stop'] if stop is None else max( stop, saved['stop'] )
+        for name, metrics in saved['sketches'].items():
+            for metric, d in metrics.items():
+                sketch = LogHistogram.from_dict( d )
+                if name not in sketches:
+                    sketches[name] = {}
+                if metric in sketches[name]:
+                    sketches[name][metric].merge( sketch )
+                else:
+                    sketches[name][metric] = sketch
+    return start, stop, sketches
+
+def write_distribution( output, fmt, sketches ):
+    """Writes the count, mean, p50, p90, p99, and maximum of each sketch, as from
+    distribution_sketches, to the open file output; as 'csv' or, with histograms too, 'json'.
+    Rates are in MiB/s, durations in seconds."""
+    names = [ 'all' ] + sorted([ name for name in sketches if name!='all' ])
+    def stats( sketch ):
+        def rnd( x ):
+            return None if x is None else round( x, 4 )
+        return { 'count': sketch.count,
+                 'mean': rnd( sketch.sum/sketch.count if sketch.count>0 else None ),
+                 'p50': rnd( sketch.quantile(0.5) ), 'p90': rnd( sketch.quantile(0.9) ),
+                 'p99': rnd( sketch.quantile(0.99) ),
+                 'max': rnd( sketch.max if sketch.count>0 else None ) }
+    if fmt=='json':
+        json.dump( { name: { metric: dict( stats(sketch), histogram=sketch.histogram() )
+                             for metric, sketch in sketches[name].items() }
+                     for name in names if name in sketches }, output, indent=1 )
+        output.write( '\n' )
+    else:
+        keys = [ 'count', 'mean', 'p50', 'p90', 'p99', 'max' ]
+        writer = csv.writer( output )
+        writer.writerow( [ 'data_node', 'metric' ] + keys )
+        for name in names:
+            if name not in sketches:
+                continue
+            for metric in [ 'rate', 'duration' ]:
+                st = stats( sketches[name][metric] )
+                writer.writerow( [ name, metric ] + [ st[key] for key in keys ] )
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description="Computes performance data from the Synda database." )
+    p.add_argument( "start", nargs='?', default=None,
+                    help="start time, e.g. '2019-01-25 13:04'.  You can use a T "+
+                    "instead of a space between the date and time." )
+    p.add_argument( "stop", nargs='?', default=None,
+                    help="stop time, e.g. '2019-01-25 14:04'" )
+    p.add_argument( "server", nargs='?', default='%',
+                    help="beginning of the url, e.g. 'gsiftp://esgf1.umr-cnrm.fr'.  You can use "+
+                    "a %% wildcard character.  Default is all servers." )
+    p.add_argument( "--timeline", action="store_true",
+                    help="write a throughput timeline: for each bucket, the active transfers, "+
+                    "concurrency, and bytes/s, overall and per data node" )
+    p.add_argument( "--bucket", default='hour',
+                    help="timeline bucket: minute, hour, day, or a number of seconds; "+
+                    "default hour" )
+    p.add_argument( "--concurrency", action="store_true",
+                    help="for each data node, write the throughput at each number of "+
+                    "simultaneous transfers, and the knee beyond which more add little" )
+    p.add_argument( "--knee-fraction", dest="knee_fraction", type=float, default=0.9,
+                    help="the knee is the lowest concurrency reaching this fraction of the "+
+                    "maximum throughput; default 0.9" )
+    p.add_argument( "--min-seconds", dest="min_seconds", type=float, default=60,
+                    help="concurrency levels seen for less time than this are ignored in "+
+                    "finding the knee; default 60" )
+    p.add_argument( "--distribution", action="store_true",
+                    help="write quantiles of per-file rates and durations, overall and per "+
+                    "data node; with histograms if the format is json" )
+    p.add_argument( "--sketch-out", dest="sketch_out", default=None,
+                    help="for --distribution, also save the sketches to this JSON file" )
+    p.add_argument( "--sketch-in", dest="sketch_in", nargs='+', default=None,
+                    help="for --distribution, merge sketches saved by --sketch-out (e.g. "+
+                    "daily ones), rather than reading the database" )
+    p.add_argument( "--batch", default=None,
+                    help="compute the rate for each window of this length from start to stop: "+
+                    "minute, hour, day, or a number of seconds" )
+    p.add_argument( "--windows", default=None,
+                    help="compute the rate for each window listed in this file, one per line "+
+                    "as a start time and a stop time, e.g. 2019-01-25T13:04 2019-01-25T14:04" )
+    p.add_argument( "--servers", nargs='+', default=None,
+                    help="servers for --batch or --windows, default the server argument" )
+    p.add_argument( "--format", dest="fmt", choices=['csv','json'], default='csv',
+                    help="output format for --timeline, --concurrency, --distribution, "+
+                    "--batch, or --windows; default csv" )
+    p.add_argument( "--output", default=None,
+                    help="output file for --timeline, --concurrency, --distribution, --batch, "+
+                    "or --windows; default standard output" )
+    p.add_argument( "--snapshot", action="store_true",
+                    help="read a snapshot copy of the database, made with the online backup API, "+
+                    "so that long queries don't delay Synda; see synda_db.py" )
+    p.add_argument( "--snapshot-age", dest="snapshot_age", type=float, default=None,
+                    help="with --snapshot, reuse a snapshot made less than this many seconds ago" )
+    args = p.parse_args( sys.argv[1:] )
+    if args.stop is None and args.windows is None and args.sketch_in is None:
+        p.error( "provide the start time and stop time" )
+    setup( args.snapshot, args.snapshot_age )
+    # Times with a T work better in scripts, e.g. '2019-01-25T13:04'.
+    # The Synda database uses a space between the date and time, e.g.
+    # '2019-01-25 13:04'
+    start = (args.start or '').replace('T',' ')
+    stop  = (args.stop or '').replace('T',' ')
+    server = args.server
+    if args.output is None:
+        output = sys.stdout
+    else:
+        output = open( args.output, 'w', newline='' )
+    if args.timeline:
+        bucket = bucket_seconds( args.bucket )
+        times, timelines = timeline( start, stop, server, bucket )
+        write_timeline( output, args.fmt, start, stop, bucket, times, timelines )
+    elif args.concurrency:
+        write_concurrency( output, args.fmt, concurrency_analysis(
+            start, stop, server, args.min_seconds, args.knee_fraction ) )
+    elif args.distribution or args.sketch_in is not None:
+        if args.sketch_in is not None:
+            start, stop, sketches = load_sketches( args.sketch_in )
+        else:
+            sketches = distribution_sketches( start, stop, server )
+        if args.sketch_out is not None:
+            save_sketches( args.sketch_out, start, stop, server, sketches )
+        write_distribution( output, args.fmt, sketches )
+    elif args.batch is not None or args.windows is not None:
+        if args.windows is not None:
+            with open( args.windows ) as f:
+                windows = [ tuple([ t.replace('T',' ') for t in line.split() ])
+                            for line in f if line.strip()!='' ]
+        else:
+            windows = batch_windows( start, stop, bucket_seconds(args.batch) )
+        if len(windows)==0:
+            p.error( "no windows; the start time must be before the stop time" )
+        write_batch( output, args.fmt, batch_perf( windows, args.servers or [server] ) )
+    else:
+        print("args=", sys.argv)
+        # One query gets the files for all data nodes, which are then broken down by url
+        # header; rather than a query for each data node.
+        files = perf_files( start, stop, server )
+        byhdr = files_by_url_hdr( files )
+        rate,spf,size,avgsize,Nfiles = perf_compute( start, stop, server,
+            [ (start_date,end_date,size) for (url,start_date,end_date,size) in files ] )
+        if rate is None:
+            print("No data downloaded")
+        else:
+            uhs = list(byhdr.keys())
+            uhs.sort()
+            print('rate',rate, "MiB/s  Nfiles",Nfiles,"  size", size, "GiB", "avg size", avgsize, "MiB", uhs)
+            if len(uhs)>1:
+                for uh in uhs:
+                    rate,spf,size,avgsize,Nfiles = perf_compute( start, stop, uh, byhdr[uh] )
+                    print("rate {:6.2f}".format(rate),\
+                        "MiB/s  Nfiles {:5d}".format(Nfiles),\
+                        "  size {:8.2f}".format(size),\
+                        "GiB", "  avg size {:8.2f}".format(avgsize), "MiB", uh)
+
+    if output is not sys.stdout:
+        output.close()
+    finish()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""Connections to the Synda database for scripts which only read it, such as synda-perf.py.
+connect() opens the database read-only, as the URI file:...?mode=ro, so such a script can never
+take a write lock or change anything.  But while one of its queries is running it still holds
+a shared lock, which keeps the Synda daemon (or mark_published.py) from committing.  For long
+queries, connect() can instead open a snapshot: a copy of the database made with SQLite's online
+backup API, which locks the database only while it's being copied (see make_snapshot()).
+For example:
+  conn = synda_db.connect( snapshot=True, max_age=3600 )
+"""
+
+import os, time, logging
+from urllib.parse import quote
+import sqlite3
+
+SyndaDB = '/var/lib/synda/sdt/sdt.db'
+SnapshotDB = os.path.expanduser('~/db/sdt-snapshot.db')
+
+def connect_ro( db=SyndaDB, timeout=5 ):
+    """Returns a read-only connection to the SQLite database db.  timeout is the number of seconds
+    to wait for a lock, as with sqlite3.connect."""
+    uri = 'file:' + quote( os.path.abspath(db) ) + '?mode=ro'
+    return sqlite3.connect( uri, timeout, uri=True )
+
+def make_snapshot( db=SyndaDB, path=SnapshotDB, max_age=None, timeout=600 ):
+    """Copies the database db to path with the online backup API, and returns path.
+    But if max_age is supplied and path was made less than max_age seconds ago, it's just reused.
+    The copy is made all at once, in a single read transaction, because a copy made in steps is
+    restarted whenever the daemon writes to db; so db is locked for as long as copying takes
+    (normally much less than a long query).  The copy goes to a temporary file which is then
+    renamed, so that anyone already reading path isn't disturbed."""
+    if max_age is not None and os.path.exists(path) and\
+       time.time()-os.path.getmtime(path)<max_age:
+        return path
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    t0 = time.time()
+    src = connect_ro( db, timeout )
+    dst = sqlite3.connect( tmp )
+    try:
+        src.backup( dst )
+    finally:
+        dst.close()
+        src.close()
+    os.replace( tmp, path )
+    logging.info( "synda_db.make_snapshot copied %s to %s in %.1f seconds" %
+                  (db, path, time.time()-t0) )
+    return path
+
+def connect( db=SyndaDB, snapshot=False, max_age=None, path=SnapshotDB, timeout=5 ):
+    """Returns a read-only connection to the database db, or if snapshot is True, to a snapshot
+    of it at path (see make_snapshot(), which also uses max_age)."""
+    if snapshot:
+        db = make_snapshot( db, path, max_age )
+    return connect_ro( db, timeout )
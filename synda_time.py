@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""Parsing of the times found in the Synda database, e.g. '2019-01-25 13:04',
+'2019-01-25 13:04:13', or '2019-01-25 13:04:13.922788', for all the scripts.
+str2time parses one such time quickly, checking its form at fixed offsets and then using
+datetime.fromisoformat; it falls back to strptime only for other forms.  cached_str2time
+remembers the times it has parsed, for data in which the same strings recur.  str2datetime64
+parses a whole list of times into a NumPy array.  bench_synda_time.py compares them."""
+
+import datetime, functools
+
+FMT_min = '%Y-%m-%d %H:%M'
+FMT_sec = '%Y-%m-%d %H:%M:%S'
+FMT_frac = '%Y-%m-%d %H:%M:%S.%f'
+
+def strptime_time( date ):
+    """Given a date string such as '2019-01-25 13:04' or '2019-01-25 13:04:13.922788',
+    returns a datetime object representing the date.  This is the slow way, trying each of
+    three formats with strptime."""
+    try:
+        return datetime.datetime.strptime( date, FMT_frac )
+    except ValueError:
+        try:
+            return datetime.datetime.strptime( date, FMT_sec )
+        except ValueError:
+            return datetime.datetime.strptime( date, FMT_min )
+
+def str2time( date ):
+    """Given a date string such as '2019-01-25 13:04' or '2019-01-25 13:04:13.922788',
+    this function returns a datetime object representing the date.
+    The forms which Synda writes, with minutes, seconds, or microseconds, are recognized by
+    their length and separators at fixed offsets, and parsed by datetime.fromisoformat.
+    Anything else goes to strptime_time, which accepts a little more (e.g. a one-digit month or
+    fewer digits of microseconds) and raises ValueError for what it can't parse."""
+    n = len(date)
+    if date[10:11]==' ' and date[13:14]==':' and\
+       ( n==26 and date[16]==':' and date[19]=='.' and date[20:].isdigit() or
+         n==19 and date[16]==':' or n==16 ):
+        try:
+            return datetime.datetime.fromisoformat( date )
+        except ValueError:
+            pass
+    return strptime_time( date )
+
+@functools.lru_cache( maxsize=65536 )
+def cached_str2time( date ):
+    """Same as str2time, but remembers the last 65536 distinct strings parsed.  Use this when
+    the same strings are parsed repeatedly, especially strings not in the usual forms, which
+    need strptime."""
+    return str2time( date )
+
+def str2datetime64( dates ):
+    """Given a list of date strings such as '2019-01-25 13:04' or '2019-01-25 13:04:13.922788',
+    this function returns a NumPy array of datetime64 with microsecond resolution, like str2time
+    but in bulk.  This needs NumPy, which is imported only when it's called."""
+    import numpy as np
+    return np.array( dates, dtype='datetime64[us]' )
@@ -0,0 +1,51 @@
+"""Tests of best_nodes.py which need no database or transfer.log.  Run with pytest."""
+
+import best_nodes
+
+rates = { ('gridftp','esgf1.dkrz.de'): (30., 500), ('gridftp','vesg.ipsl.upmc.fr'): (40., 500),
+          ('http','esgf1.dkrz.de'): (20., 500), ('http','few.example.org'): (90., 10),
+          ('http','bad.example.org'): (80., 500) }
+# From transfer.log, keyed by url header; the GridFTP host isn't the data node.
+errors = { 'gsiftp://gridftp.dkrz.de': (900, 100), 'gsiftp://vesg.ipsl.upmc.fr': (700, 300),
+           'http://bad.example.org': (50, 50) }
+hdrs = { 'gsiftp://gridftp.dkrz.de': ('gridftp','esgf1.dkrz.de'),
+         'gsiftp://vesg.ipsl.upmc.fr': ('gridftp','vesg.ipsl.upmc.fr'),
+         'http://bad.example.org': ('http','bad.example.org') }
+
+def test_node_key():
+    assert best_nodes.node_key( 'gsiftp://gridftp.dkrz.de:2811' )=='gsiftp://gridftp.dkrz.de'
+    assert best_nodes.node_key( 'http://esgf1.dkrz.de' )=='http://esgf1.dkrz.de'
+
+def test_data_node_errors():
+    counts = best_nodes.data_node_errors( errors, hdrs )
+    assert counts[('gridftp','esgf1.dkrz.de')]==(900,100)
+    assert ('gridftp','gridftp.dkrz.de') not in counts
+
+def test_rank_nodes():
+    ranked = best_nodes.rank_nodes( rates, best_nodes.data_node_errors( errors, hdrs ),
+                                    min_files=100, max_error_rate=0.2 )
+    # few.example.org has too few files, bad.example.org and vesg too many errors.
+    assert [ (r[0],r[1]) for r in ranked ]==[ ('gridftp','esgf1.dkrz.de'),
+                                              ('http','esgf1.dkrz.de') ]
+    assert abs( ranked[0][5]-27. )<1e-9     # 30 MiB/s with 10% errors
+    ranked = best_nodes.rank_nodes( rates, {}, min_files=0 )
+    assert [ r[1] for r in ranked ][:3]==[ 'few.example.org', 'bad.example.org',
+                                           'vesg.ipsl.upmc.fr' ]
+
+def test_best_nodes():
+    ranked = best_nodes.rank_nodes( rates, {}, min_files=100 )
+    assert [ r[1] for r in best_nodes.best_nodes( ranked, 'http', 1 ) ]==[ 'bad.example.org' ]
+    assert [ r[1] for r in best_nodes.best_nodes( ranked, 'gridftp', 5 ) ]==\
+        [ 'vesg.ipsl.upmc.fr', 'esgf1.dkrz.de' ]
+
+def test_selection_text():
+    base = "project=CMIP6\nfrequency=day\ndata_node=old.example.org\n  older.example.org\n"+\
+           "protocol=gridftp\n"
+    nodes = best_nodes.best_nodes( best_nodes.rank_nodes( rates, {}, min_files=100 ),
+                                   'gridftp', 5 )
+    text = best_nodes.selection_text( base, nodes, '2019-01-21 00:00', '2019-01-28 00:00' )
+    lines = [ l for l in text.splitlines() if not l.startswith('#') ]
+    assert lines==[ 'project=CMIP6', 'frequency=day',
+                    'data_node=vesg.ipsl.upmc.fr esgf1.dkrz.de', 'protocol=gridftp' ]
+    text = best_nodes.selection_text( "project=CMIP6", nodes[:1], 'a', 'b' )
+    assert text.splitlines()[-2:]==[ 'project=CMIP6', 'data_node=vesg.ipsl.upmc.fr' ]
@@ -0,0 +1,27 @@
+"""Tests of drain_forecast.py which need no database.  Run with pytest."""
+
+import drain_forecast
+
+GiB = 1024*1024*1024
+
+def test_drain_seconds():
+    assert drain_forecast.drain_seconds( 1024*1024*100, 10. )==10.
+    assert drain_forecast.drain_seconds( GiB, None ) is None
+    assert drain_forecast.drain_seconds( GiB, 0. ) is None
+
+def test_duration_for_people():
+    assert drain_forecast.duration_for_people( None )=='unknown'
+    assert drain_forecast.duration_for_people( 90*60 )=='1h 30m'
+    assert drain_forecast.duration_for_people( 3*86400+4*3600+100 )=='3d 04h'
+
+def test_forecast_rows():
+    waiting = { 'fast.example.org': (10, 10*GiB), 'slow.example.org': (1, GiB),
+                '(none)': (5, GiB), 'norate.example.org': (2, GiB),
+                'other.example.org': (3, 2*GiB) }
+    rates = { 'fast.example.org': 1024., 'slow.example.org': 1., '(none)': 2. }
+    rows, total = drain_forecast.forecast_rows( waiting, 100., rates )
+    # Longest first; nodes with no estimate last, by name, without comparing None to str.
+    assert [ row[0] for row in rows ]==[ 'slow.example.org', '(none)', 'fast.example.org',
+                                         'norate.example.org', 'other.example.org' ]
+    assert rows[0][4]==1024.
+    assert total==( 'all', 21, 15., 100., 15*1024/100. )
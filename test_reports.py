@@ -0,0 +1,110 @@
+"""Tests of reports.py which need no real transfer.log or database: where a log is needed, a
+synthetic one is written to a temporary directory.  Run with pytest."""
+
+import gzip
+import pytest
+import reports, bench_logscan
+
+# An unknown error whose message is empty after masking, i.e. only whitespace.
+empty_line = "2024-01-01 00:00:00,000 ERROR SDDMDEFA-102 Transfer failed "+\
+             "(file_id=1,url=http://esgf.ceda.ac.uk/x/1.nc)   \n"
+
+def test_similarity_empty():
+    assert reports.ErrorTemplate( [] ).similarity( [] )==1.0
+
+def test_empty_unknown_errors():
+    a = reports.UnknownErrorTemplates()
+    b = reports.UnknownErrorTemplates()
+    a.add( empty_line )
+    b.add( empty_line )
+    b.add( empty_line )
+    a.merge( b )
+    for kind, datanode, detail, count in b.rows():
+        a.add_row( kind, datanode, detail, count )
+    assert [ (t.tokens, t.count) for t in a.templates() ]==[ ([], 5) ]
+
+def unknown_line( datanode, n ):
+    return "2024-01-01 00:00:%02d,000 ERROR SDDMDEFA-102 Transfer failed "%(n%60)+\
+           "(file_id=%d,url=%s/x/%d.nc) something new went wrong\n" % (n, datanode, n)
+
+def test_unknown_errors_by_data_node():
+    errc = reports.ErrorCounter()
+    for n in range(3):
+        errc.add( unknown_line( 'http://esgf.ceda.ac.uk', n ) )
+    errc.add( "2024-01-01 00:00:09,000 ERROR SDDMDEFA-102 Transfer failed no url here\n" )
+    assert errc.nunknown==4
+    assert errc.dn_unknown=={ 'http://esgf.ceda.ac.uk': 3 }
+    # Rollup rows keep the data_nodes of unknown errors.
+    other = reports.ErrorCounter()
+    for row in errc.rows():
+        other.add_row( *row )
+    assert other.nunknown==4 and other.dn_unknown==errc.dn_unknown
+    totals = reports.outcome_totals( reports.DoneCounter(), errc, reports.FallbackCounter() )
+    assert totals[('error','http://esgf.ceda.ac.uk')]==3
+
+def test_unknown_error_spike():
+    """A burst of unknown errors at one data node is an error spike in follow mode."""
+    rates = reports.NodeRates( fast_halflife=300, slow_halflife=3600 )
+    donec, errc, fbc = reports.DoneCounter(), reports.ErrorCounter(), reports.FallbackCounter()
+    dn = 'http://esgf.ceda.ac.uk'
+    n = 0
+    for minute in range(120):
+        errs = 1 if minute<110 else 20
+        for i in range(errs):
+            errc.add( unknown_line( dn, n ) )
+            n += 1
+        rates.update( reports.outcome_totals( donec, errc, fbc ), 60 )
+    assert rates.alerts( dn )==[ 'error_spike' ]
+
+@pytest.fixture( scope='module' )
+def synthetic_log( tmp_path_factory ):
+    """A synthetic transfer.log from 2024-01-01 00:00 to about 02:13."""
+    path = str( tmp_path_factory.mktemp('log') / 'transfer.log' )
+    bench_logscan.write_synthetic_log( path, 400000 )
+    return path
+
+def results( accs ):
+    linec, donec, errc, fbc, terrs, tmplc = reports.report_results( accs )
+    return ( donec.dn_done, errc.errdict, errc.dn_errs, errc.dn_unknown, fbc.fb_dict,
+             sorted(terrs.lines), sorted([ (t.count, t.tokens) for t in tmplc.templates() ]) )
+
+def test_rollup_report_stoptime( synthetic_log, tmp_path ):
+    rollupdb = str( tmp_path / 'rollup.db' )
+    start, stop = '2024-01-01 00:00:00', '2024-01-01 01:30:00'
+    accs, nhours = reports.rollup_report( synthetic_log, start, rollupdb, stoptime=stop )
+    scanned = reports.scan( reports.iter_logsince( synthetic_log, start, None, stop ),
+                            reports.report_accumulators() )
+    assert nhours==1
+    assert results(accs)==results(scanned)
+    # Only the lines before stoptime were read, not the tail of the log.
+    assert accs[0].count==scanned[0].count
+    # The hour rolled up on the way is used by a later, unbounded, report.
+    accs, nhours = reports.rollup_report( synthetic_log, start, rollupdb )
+    scanned = reports.scan( reports.iter_logsince( synthetic_log, start ),
+                            reports.report_accumulators() )
+    assert nhours==2
+    assert results(accs)==results(scanned)
+
+def test_parallel_scan( synthetic_log, tmp_path, monkeypatch ):
+    # The log, rotated into a gzipped file, a plain one, and the current one.
+    with open( synthetic_log ) as f:
+        lines = f.readlines()
+    logfile = str( tmp_path / 'transfer.log' )
+    with gzip.open( logfile+'.2.gz', 'wt' ) as f:
+        f.writelines( lines[:100000] )
+    with open( logfile+'.1', 'w' ) as f:
+        f.writelines( lines[100000:250000] )
+    with open( logfile, 'w' ) as f:
+        f.writelines( lines[250000:] )
+    assert reports.rotated_logs( logfile )==[ logfile+'.2.gz', logfile+'.1', logfile ]
+    # Small shards, so that most begin and end in the middle of a line.
+    monkeypatch.setattr( reports, 'shard_size', 1000003 )
+    start = '2024-01-01 00:20:00'
+    scanned = reports.scan( ( l for l in lines if l[:19]>=start ),
+                            reports.report_accumulators() )
+    for events in [ False, True ]:
+        accs = reports.parallel_scan( logfile, start, processes=2, events=events )
+        assert accs[0].count==scanned[0].count
+        assert results(accs)==results(scanned)
+        # The lines kept are in the order of the log.
+        assert accs[-2].lines==scanned[-2].lines
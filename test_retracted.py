@@ -0,0 +1,128 @@
+"""Tests of retracted.py against a local stand-in for the index node's esg-search, serving
+Solr JSON.  They need no database: retract_fids is replaced by a recorder.  Run with pytest."""
+
+import json, time, threading, urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+import pytest
+import retracted
+
+facets = [ ('data_node', ['a.example.org','b.example.org']), ('frequency', ['day','mon']) ]
+# Retracted datasets, with their facets.  Many have data_node a.example.org and frequency day,
+# so that query needs pagination, and other values are outside the facet lists.
+docs = [ { 'instance_id': 'CMIP6.X.m%d.r1.v2019%04d' % (i,i),
+           'data_node': ['a.example.org','b.example.org','c.example.org'][i%3 if i<60 else 0],
+           'frequency': ['day','mon','yr'][i%3//2 if i<60 else 0] }
+         for i in range(100) ]
+
+class StandIn( BaseHTTPRequestHandler ):
+    """Serves a page of the docs matching the constraints, as esg-search does.  A constraint
+    like data_node!=x is parsed as the key 'data_node!'.  A query with the value 'broken'
+    gets an HTTP error."""
+    lock = threading.Lock()
+    inflight = 0
+    max_inflight = 0
+    queries = []
+    def log_message( self, *args ):
+        pass
+    def do_GET( self ):
+        cls = StandIn
+        with cls.lock:
+            cls.inflight += 1
+            cls.max_inflight = max( cls.max_inflight, cls.inflight )
+        try:
+            query = parse_qsl( urlparse(self.path).query )
+            cls.queries.append( query )
+            time.sleep( 0.02 )
+            if 'broken' in [ v for (k,v) in query ]:
+                self.send_error( 503 )
+                return
+            limit, offset, sel = 10000, 0, docs
+            for k, v in query:
+                if k=='limit':
+                    limit = int(v)
+                elif k=='offset':
+                    offset = int(v)
+                elif k.endswith('!'):
+                    sel = [ d for d in sel if d[k[:-1]]!=v ]
+                elif k in ('data_node','frequency'):
+                    sel = [ d for d in sel if d[k]==v ]
+            body = json.dumps( { 'responseHeader': {'status': 0},
+                                 'response': { 'numFound': len(sel), 'start': offset,
+                                               'docs': [ {'instance_id': d['instance_id']}
+                                                         for d in sel[offset:offset+limit] ] } } )
+            self.send_response( 200 )
+            self.send_header( 'Content-Type', 'application/json' )
+            self.end_headers()
+            self.wfile.write( body.encode() )
+        finally:
+            with cls.lock:
+                cls.inflight -= 1
+
+@pytest.fixture
+def stand_in( monkeypatch ):
+    """Starts the stand-in, points retracted.py at it, and records the datasets retracted, with
+    the thread which retracted them.  Yields the list of records."""
+    server = ThreadingHTTPServer( ('127.0.0.1', 0), StandIn )
+    thread = threading.Thread( target=server.serve_forever, daemon=True )
+    thread.start()
+    StandIn.max_inflight = 0
+    StandIn.queries = []
+    applied = []
+    def record( dataset_fids, test ):
+        applied.append( ( threading.current_thread(), list(dataset_fids) ) )
+        return len(dataset_fids)
+    monkeypatch.setattr( retracted, 'search_url',
+                         'http://127.0.0.1:%d/esg-search/search?project=CMIP6&limit=15&'
+                         'format=application%%2Fsolr%%2Bjson' % server.server_port )
+    monkeypatch.setattr( retracted, 'retract_fids', record )
+    monkeypatch.setattr( retracted, 'host_semaphores', {} )
+    yield applied
+    server.shutdown()
+    server.server_close()
+
+def test_concurrent_same_as_sequential( stand_in ):
+    applied = stand_in
+    sequential = retracted.get_retracted_multi_facets( '/tmp/x-', facets, '', True, False )
+    seq_applied = [ fids for (thread, fids) in applied ]
+    seq_queries = sorted( map( sorted, StandIn.queries ) )
+    del applied[:]
+    StandIn.queries = []
+    concurrent = retracted.get_retracted_multi_facets_concurrent( '/tmp/x-', facets, '', True,
+                                                                  False, workers=6 )
+    assert concurrent==sequential==( len(docs), len(docs) )
+    # Every partition and page was fetched, once, as by the sequential path.
+    assert sorted( map( sorted, StandIn.queries ) )==seq_queries
+    fids = [ fid for (thread, fids) in applied for fid in fids ]
+    assert sorted(fids)==sorted([ d['instance_id'] for d in docs ])
+    assert sorted( map( tuple, [ fids for (thread, fids) in applied ] ) )==\
+        sorted( map( tuple, seq_applied ) )
+
+def test_host_limit( stand_in, monkeypatch ):
+    monkeypatch.setattr( retracted, 'host_limit', 2 )
+    retracted.get_retracted_multi_facets_concurrent( '/tmp/x-', facets, '', True, False,
+                                                     workers=8 )
+    assert 1<StandIn.max_inflight<=2
+
+def test_applied_in_order( stand_in ):
+    applied = stand_in
+    retracted.get_retracted_multi_facets_concurrent( '/tmp/x-', facets, '', True, False,
+                                                     workers=6 )
+    # All results are applied by this thread, one at a time.
+    assert set([ thread for (thread, fids) in applied ])=={ threading.current_thread() }
+    # The pages of the paginated query (data_node=a.example.org&frequency=day) are applied in
+    # order of their offsets, so in the order esg-search lists the datasets.
+    expected = [ d['instance_id'] for d in docs
+                 if d['data_node']=='a.example.org' and d['frequency']=='day' ]
+    pages = [ fids for (thread, fids) in applied if fids[0] in expected ]
+    assert len(pages)>1
+    assert [ fid for fids in pages for fid in fids ]==expected
+
+def test_http_error( stand_in ):
+    broken = [ ('data_node', ['a.example.org','broken']) ]
+    with pytest.raises( urllib.error.HTTPError ) as seq_error:
+        retracted.get_retracted_multi_facets( '/tmp/x-', broken, '', False, False )
+    with pytest.raises( urllib.error.HTTPError ) as conc_error:
+        retracted.get_retracted_multi_facets_concurrent( '/tmp/x-', broken, '', False, False,
+                                                         workers=4 )
+    assert conc_error.value.code==seq_error.value.code==503
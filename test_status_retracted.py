@@ -0,0 +1,134 @@
+"""Tests of status_retracted.py against a small SQLite database, made in a temporary directory,
+with the dataset and file tables of the Synda database.  Run with pytest."""
+
+import sqlite3, shutil, logging
+import pytest
+import status_retracted
+from version_index import VersionIndex
+
+# dataset_functional_id, status, path_without_version, and the statuses of its files.
+datasets = [ ( 'CMIP6.A.v20190101', 'complete', 'CMIP6/A', ['done','error','waiting'] ),
+             ( 'CMIP6.B.v20190101', 'in-progress', 'CMIP6/B', ['done','running'] ),
+             ( 'CMIP6.C.v20190101', 'complete-retracted', 'CMIP6/C', ['retracted'] ),
+             ( 'CMIP6.D.v20190101', 'empty', 'CMIP6/D', [] ),
+             ( 'CMIP6.D.v20190201', 'complete', 'CMIP6/D', ['done'] ),
+             ( 'CMIP6.E.v20190101', 'empty', 'CMIP6/E', [] ),
+             ( 'CMIP6.G.v20190101', 'complete', 'CMIP6/G', ['done'] ) ]
+retracted = [ 'CMIP6.A.v20190101', 'CMIP6.B.v20190101', 'CMIP6.C.v20190101',
+              'CMIP6.D.v20190101', 'CMIP6.E.v20190101', 'CMIP6.F.v20190101' ]
+
+def make_db( path ):
+    conn = sqlite3.connect( path )
+    curs = conn.cursor()
+    curs.execute( "CREATE TABLE dataset (dataset_id INTEGER PRIMARY KEY, "+
+                  "dataset_functional_id TEXT, status TEXT, path_without_version TEXT, "+
+                  "version TEXT)" )
+    curs.execute( "CREATE TABLE file (file_id INTEGER PRIMARY KEY, dataset_id INT, "+
+                  "filename TEXT, status TEXT)" )
+    for dataset_fid, status, path, fstatuses in datasets:
+        curs.execute( "INSERT INTO dataset (dataset_functional_id, status, "+
+                      "path_without_version) VALUES (?,?,?)", (dataset_fid,status,path) )
+        dataset_id = curs.lastrowid
+        for i, fstatus in enumerate(fstatuses):
+            curs.execute( "INSERT INTO file (dataset_id, filename, status) VALUES (?,?,?)",
+                          (dataset_id, '%s_%d.nc' % (dataset_fid,i), fstatus) )
+    conn.commit()
+    conn.close()
+
+def statuses( path ):
+    """Returns the statuses of the datasets, and of the files by filename."""
+    conn = sqlite3.connect( path )
+    curs = conn.cursor()
+    curs.execute( "SELECT dataset_functional_id, status FROM dataset" )
+    dstatuses = dict( curs.fetchall() )
+    curs.execute( "SELECT filename, status FROM file" )
+    fstatuses = dict( curs.fetchall() )
+    conn.close()
+    return dstatuses, fstatuses
+
+@pytest.fixture
+def db( tmp_path, monkeypatch ):
+    """Makes the database, and points status_retracted.setup at it.  Returns its path."""
+    path = str( tmp_path / 'sdt.db' )
+    make_db( path )
+    def setup():
+        # As status_retracted.setup, but with no log file, and the database at SyndaDB.
+        status_retracted.Nupdates = 0
+        if status_retracted.conn is None:
+            status_retracted.conn = sqlite3.connect( status_retracted.synda_db.SyndaDB )
+    monkeypatch.setattr( status_retracted, 'setup', setup )
+    monkeypatch.setattr( status_retracted, 'conn', None )
+    monkeypatch.setattr( status_retracted.synda_db, 'SyndaDB', path )
+    monkeypatch.setattr( status_retracted, 'versions', VersionIndex() )
+    return path
+
+def test_retract_datasets( db, tmp_path, caplog ):
+    deferred_file = str( tmp_path / 'deferred' )
+    nchanges = status_retracted.retract_datasets( retracted, deferred_file=deferred_file )
+    assert nchanges==3
+    dstatuses, fstatuses = statuses( db )
+    assert dstatuses=={ 'CMIP6.A.v20190101': 'retracted', 'CMIP6.B.v20190101': 'in-progress',
+                        'CMIP6.C.v20190101': 'complete-retracted',
+                        'CMIP6.D.v20190101': 'retracted', 'CMIP6.D.v20190201': 'complete',
+                        'CMIP6.E.v20190101': 'retracted', 'CMIP6.G.v20190101': 'complete' }
+    assert [ fstatuses['CMIP6.A.v20190101_%d.nc' % i] for i in range(3) ]==['retracted']*3
+    # Nothing in a dataset with a running file is changed.
+    assert [ fstatuses['CMIP6.B.v20190101_%d.nc' % i] for i in range(2) ]==['done','running']
+    assert status_retracted.read_deferred( deferred_file )==\
+        [ ('dataset','retracted','CMIP6.B.v20190101') ]
+    # D has been superseded by a newer version, but E hasn't.
+    warned = [ r.getMessage() for r in caplog.records if 'no newer version' in r.getMessage() ]
+    assert warned==[ "Dataset CMIP6.E.v20190101 is retracted but there is no newer version!" ]
+
+def test_bulk_same_as_per_dataset( db, tmp_path, caplog, monkeypatch ):
+    bulk_db = str( tmp_path / 'bulk.db' )
+    shutil.copy( db, bulk_db )
+    nchanges = status_retracted.retract_datasets( retracted,
+                                                  deferred_file=str(tmp_path/'deferred') )
+    warned = [ r.getMessage() for r in caplog.records if r.levelno==logging.WARNING ]
+    caplog.clear()
+    monkeypatch.setattr( status_retracted.synda_db, 'SyndaDB', bulk_db )
+    bulk_nchanges = status_retracted.retract_datasets(
+        retracted, bulk=True, deferred_file=str(tmp_path/'bulk_deferred') )
+    assert bulk_nchanges==nchanges
+    assert statuses( bulk_db )==statuses( db )
+    assert status_retracted.read_deferred( str(tmp_path/'bulk_deferred') )==\
+        status_retracted.read_deferred( str(tmp_path/'deferred') )
+    assert sorted([ r.getMessage() for r in caplog.records if r.levelno==logging.WARNING ])==\
+        sorted( warned )
+
+@pytest.mark.parametrize( 'bulk', [ False, True ] )
+def test_deferred_retried( db, tmp_path, bulk ):
+    deferred_file = str( tmp_path / 'deferred' )
+    status_retracted.retract_datasets( retracted, bulk=bulk, deferred_file=deferred_file )
+    # With a deferred_queue, the queue file is neither retried nor written.
+    queue = []
+    status_retracted.retract_datasets( [], bulk=bulk, deferred_file=deferred_file,
+                                       deferred_queue=queue )
+    assert queue==[]
+    assert len( status_retracted.read_deferred( deferred_file ) )==1
+    # Still running: deferred again.
+    assert status_retracted.retract_datasets( [], bulk=bulk, deferred_file=deferred_file )==0
+    assert status_retracted.read_deferred( deferred_file )==\
+        [ ('dataset','retracted','CMIP6.B.v20190101') ]
+    # The download finishes; then the next run retracts the dataset, and the queue is empty.
+    conn = sqlite3.connect( db )
+    conn.execute( "UPDATE file SET status='done' WHERE status='running'" )
+    conn.commit()
+    conn.close()
+    assert status_retracted.retract_datasets( [], bulk=bulk, deferred_file=deferred_file )==1
+    dstatuses, fstatuses = statuses( db )
+    assert dstatuses['CMIP6.B.v20190101']=='retracted'
+    assert fstatuses['CMIP6.B.v20190101_1.nc']=='retracted'
+    assert status_retracted.read_deferred( deferred_file )==[]
+
+def test_deferred_queue( tmp_path ):
+    deferred_file = str( tmp_path / 'deferred' )
+    assert status_retracted.read_deferred( deferred_file )==[]
+    queue = [ ('dataset','retracted','CMIP6.B.v20190101'), ('file','retracted','x.nc'),
+              ('dataset','bad','CMIP6.B.v20190101'), ('dataset','retracted','CMIP6.B.v20190101') ]
+    status_retracted.save_deferred( queue, deferred_file )
+    assert status_retracted.read_deferred( deferred_file )==queue[:3]
+    names, rest = status_retracted.take_deferred( 'dataset', 'retracted', deferred_file )
+    assert names==[ 'CMIP6.B.v20190101' ]
+    assert rest==[ ('file','retracted','x.nc'), ('dataset','bad','CMIP6.B.v20190101') ]
@@ -0,0 +1,87 @@
+"""Tests of synda-perf.py.  The queries are made of an in-memory SQLite database with a small
+file table.  Run with pytest."""
+
+import importlib, random, sqlite3, datetime
+import numpy as np
+import pytest
+
+perf = importlib.import_module( 'synda-perf' )
+
+def random_files( n, seed=1 ):
+    """Returns a list of (url, start_date, end_date, size) for n transfers on 2019-01-25."""
+    random.seed( seed )
+    hdrs = [ 'gsiftp://esgf1.dkrz.de:2811', 'http://esgf1.dkrz.de', 'http://vesg.ipsl.upmc.fr' ]
+    t0 = datetime.datetime( 2019, 1, 25 )
+    files = []
+    for i in range(n):
+        start = t0 + datetime.timedelta( seconds=random.uniform(0,86400) )
+        end = start + datetime.timedelta( seconds=random.uniform(0,3600) )
+        files.append( ( '%s/thredds/fileServer/x/f%d.nc' % (random.choice(hdrs), i),
+                        start.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                        end.strftime('%Y-%m-%d %H:%M:%S.%f'), random.randint(1,10**9) ) )
+    return files
+
+@pytest.fixture
+def db( monkeypatch ):
+    """An in-memory database with the random_files, as the module's cursor.  Returns them."""
+    files = random_files( 500 )
+    conn = sqlite3.connect( ':memory:' )
+    curs = conn.cursor()
+    curs.execute( "CREATE TABLE file (url TEXT, start_date TEXT, end_date TEXT, size INT, "+
+                  "status TEXT, rate INT)" )
+    curs.executemany( "INSERT INTO file VALUES (?,?,?,?,'done',NULL)", files )
+    monkeypatch.setattr( perf, 'curs', curs, raising=False )
+    yield files
+    conn.close()
+
+def test_files_by_url_hdr():
+    assert perf.url_hdr( 'gsiftp://esgf1.dkrz.de:2811/x/y.nc' )=='gsiftp://esgf1.dkrz.de:2811'
+    files = random_files( 50 )
+    byhdr = perf.files_by_url_hdr( files )
+    assert set(byhdr)==set([ perf.url_hdr(f[0]) for f in files ])
+    for hdr in byhdr:
+        assert byhdr[hdr]==[ f[1:] for f in files if perf.url_hdr(f[0])==hdr ]
+
+def test_downloading_intervals_np():
+    for seed in range(5):
+        results = [ f[1:] for f in random_files( 200, seed ) ]
+        for stop in [ '2019-01-26 02:00', '2019-01-25 23:00' ]:
+            assert perf.downloading_intervals_np( '2019-01-25 00:00', stop, results )==\
+                perf.downloading_intervals( '2019-01-25 00:00', stop, results )
+    assert perf.downloading_intervals_np( '2019-01-25 00:00', '2019-01-26 00:00', [] )==0
+
+def test_batch_windows():
+    assert perf.batch_windows( '2019-01-25 00:00', '2019-01-25 02:30', 3600 )==\
+        [ ('2019-01-25 00:00','2019-01-25 01:00'), ('2019-01-25 01:00','2019-01-25 02:00'),
+          ('2019-01-25 02:00','2019-01-25 02:30') ]
+    assert perf.batch_windows( '2019-01-25 02:00', '2019-01-25 01:00', 3600 )==[]
+    assert perf.bucket_seconds( 'hour' )==3600 and perf.bucket_seconds( '90' )==90.
+
+def test_like_prefix():
+    match = perf.like_prefix( 'http://%.dkrz.de' ).match
+    assert match( 'http://esgf1.dkrz.de/x.nc' ) and match( 'HTTP://esgf1.DKRZ.de/x.nc' )
+    assert not match( 'gsiftp://esgf1.dkrz.de/x.nc' )
+    assert not match( 'http://esgf1.dkrzxde/x.nc' )
+
+def test_batch_perf( db ):
+    windows = perf.batch_windows( '2019-01-25 00:00', '2019-01-26 01:00', 4*3600 )
+    servers = [ 'http://', 'gsiftp://esgf1.dkrz.de', 'http://vesg%' ]
+    for result in perf.batch_perf( windows, servers ):
+        start, stop, server = result[:3]
+        expected = perf.perf_data( start, stop, server )
+        assert result[3:]==expected[:4]+( expected[4] or 0, )
+
+def test_timeline( db ):
+    times, timelines = perf.timeline( '2019-01-25 00:00', '2019-01-27 00:00', 'http://',
+                                      bucket=3600 )
+    assert len(times)==48 and times[1]=='2019-01-25 01:00:00'
+    http = [ f for f in db if f[0].startswith('http://') ]
+    assert set(timelines)==set([ 'all', 'http://esgf1.dkrz.de', 'http://vesg.ipsl.upmc.fr' ])
+    # Every byte is in some bucket, and the data nodes add up to the whole.
+    total = sum([ f[3] for f in http ])
+    assert abs( np.sum( timelines['all']['bytes_per_s'] )*3600 - total )<1e-6*total
+    nodes = timelines['http://esgf1.dkrz.de']['concurrency'] +\
+            timelines['http://vesg.ipsl.upmc.fr']['concurrency']
+    assert np.allclose( nodes, timelines['all']['concurrency'] )
+    assert np.all( timelines['all']['active_transfers']>=
+                   np.ceil( timelines['all']['concurrency']-1e-9 ) )
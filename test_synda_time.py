@@ -0,0 +1,34 @@
+"""Tests of synda_time.py.  Run with pytest."""
+
+import datetime
+import pytest
+import synda_time
+
+# Times in the forms Synda writes, and others which only strptime accepts.
+usual = [ '2019-01-25 13:04', '2019-01-25 13:04:13', '2019-01-25 13:04:13.922788' ]
+unusual = [ '2019-1-25 13:04', '2019-01-25 13:04:13.9', '2019-01-25 3:04:13' ]
+# Strings of the usual lengths which aren't times, or which fromisoformat would misread.
+bad = [ '2019-01-25 13:04+01', '2019-01-25 13:04:13+01:00', '2019-01-25T13:04:13',
+        '2019-01-25 13:04:13.92278x', '2019-13-25 13:04', 'not a time at all', '' ]
+
+def test_str2time():
+    assert synda_time.str2time( usual[0] )==datetime.datetime( 2019, 1, 25, 13, 4 )
+    assert synda_time.str2time( usual[2] )==\
+        datetime.datetime( 2019, 1, 25, 13, 4, 13, 922788 )
+    for date in usual+unusual:
+        assert synda_time.str2time( date )==synda_time.strptime_time( date )
+        assert synda_time.cached_str2time( date )==synda_time.strptime_time( date )
+
+def test_str2time_bad():
+    # Whatever strptime_time rejects, str2time rejects too; fromisoformat isn't more lenient.
+    for date in bad:
+        with pytest.raises( ValueError ):
+            synda_time.strptime_time( date )
+        with pytest.raises( ValueError ):
+            synda_time.str2time( date )
+
+def test_str2datetime64():
+    np = pytest.importorskip( 'numpy' )
+    times = synda_time.str2datetime64( usual )
+    assert times.dtype==np.dtype( 'datetime64[us]' )
+    assert list( times.astype(datetime.datetime) )==[ synda_time.str2time(d) for d in usual ]
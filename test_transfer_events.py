@@ -0,0 +1,32 @@
+"""Tests of transfer_events.py.  Run with pytest."""
+
+import calendar, datetime
+import pytest
+import transfer_events
+from transfer_events import TransferEvents, DONE, ERROR
+
+def test_log_time_ms():
+    line = "2020-10-22 11:32:12,345 INFO  SDDMDEFA-101 Transfer done (file_id=1,url=x)"
+    expected = calendar.timegm( datetime.datetime(2020,10,22,11,32,12).timetuple() )*1000+345
+    assert transfer_events.log_time_ms( line )==expected
+    assert transfer_events.log_time_ms( line )==expected   # from the cache of hours
+
+def test_merge():
+    a = TransferEvents( ['timeout'] )
+    b = TransferEvents( ['404', 'timeout'] )
+    a.append( 1, DONE, 'http://a' )
+    b.append( 2, ERROR, 'http://b', 'timeout' )
+    b.append( 3, ERROR, 'http://a', '404' )
+    a.merge( b )
+    assert len(a)==3
+    nodes = [ a.nodes[i] for i in a.column('node') ]
+    details = [ a.details[i] for i in a.column('detail') ]
+    assert nodes==[ 'http://a', 'http://b', 'http://a' ]
+    assert details==[ '', 'timeout', '404' ]
+
+def test_id_overflow():
+    events = TransferEvents()
+    for i in range( TransferEvents.max_id+1 ):
+        events.node_id( 'http://node%d' % i )
+    with pytest.raises( OverflowError ):
+        events.node_id( 'http://one.too.many' )
@@ -0,0 +1,54 @@
+"""Tests of version_index.py against an in-memory SQLite dataset table.  Run with pytest."""
+
+import sqlite3
+from version_index import VersionIndex
+
+def dataset_table( rows ):
+    """Returns a connection to an in-memory database whose dataset table has the rows, each
+    (dataset_functional_id, path_without_version, version)."""
+    conn = sqlite3.connect( ':memory:' )
+    conn.execute( "CREATE TABLE dataset (dataset_id INTEGER PRIMARY KEY, "+
+                  "dataset_functional_id TEXT, path_without_version TEXT, version TEXT)" )
+    add_datasets( conn, rows )
+    return conn
+
+def add_datasets( conn, rows ):
+    conn.executemany( "INSERT INTO dataset (dataset_functional_id, path_without_version, "+
+                      "version) VALUES (?,?,?)", rows )
+    conn.commit()
+
+def test_versions():
+    conn = dataset_table( [ ('CMIP6.A.v20190101', 'CMIP6/A', 'v20190101'),
+                            ('CMIP6.A.v20190301', 'CMIP6/A', 'v20190301'),
+                            ('CMIP6.A.v20190201', 'CMIP6/A', 'v20190201'),
+                            ('CMIP6.B.v20190101', 'CMIP6/B', None),
+                            ('CMIP6.B.v20180101', 'CMIP6/B', None),
+                            ('CMIP6.C.v20190101', None, 'v20190101') ] )
+    versions = VersionIndex( conn )
+    assert len(versions)==6
+    assert 'CMIP6.A.v20190201' in versions and 'CMIP6.X.v20190101' not in versions
+    assert versions.dataset_id( 'CMIP6.A.v20190301' )==2
+    assert versions.dataset_id( 'CMIP6.X.v20190101' ) is None
+    assert [ versions.is_latest( 'CMIP6.A.'+v ) for v in ['v20190101','v20190201','v20190301'] ]\
+        ==[ False, False, True ]
+    # A NULL version is taken from the end of the dataset_functional_id.
+    assert versions.newer_version_exists( 'CMIP6.B.v20180101' )
+    assert versions.is_latest( 'CMIP6.B.v20190101' )
+    # With no path_without_version, a dataset is its own latest version.
+    assert not versions.has_path( 'CMIP6.C.v20190101' )
+    assert versions.is_latest( 'CMIP6.C.v20190101' )
+    assert versions.is_latest( 'CMIP6.X.v20190101' ) is None
+    assert not versions.newer_version_exists( 'CMIP6.X.v20190101' )
+
+def test_refresh():
+    conn = dataset_table( [ ('CMIP6.A.v20190101', 'CMIP6/A', 'v20190101') ] )
+    versions = VersionIndex( conn )
+    assert versions.refresh( conn )==0
+    add_datasets( conn, [ ('CMIP6.A.v20190201', 'CMIP6/A', 'v20190201'),
+                          ('CMIP6.D.v20190101', 'CMIP6/D', 'v20190101') ] )
+    # Only the datasets added since the last refresh are read.
+    assert versions.refresh( conn )==2
+    assert len(versions)==3
+    assert versions.newer_version_exists( 'CMIP6.A.v20190101' )
+    assert versions.is_latest( 'CMIP6.D.v20190101' )
+    assert versions.max_id==3
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""A compact, column-oriented store of parsed transfer.log events, for analyses of weeks or months
+of logs.  Each event is one done, error, or fallback file, and costs 13 bytes: its time in
+milliseconds as an int64, its kind as an int8, and int16 ids of its data_node and detail (error
+type or fallback destination), which are interned strings.  So tens of millions of events fit in
+a few hundred MB, and the per-data_node and per-error tables are computed from the columns with
+NumPy.  The events are recorded from transfer.log by reports.EventRecorder; see reports.py."""
+
+import array, calendar, time, functools
+import numpy as np
+
+DONE, ERROR, FALLBACK = 0, 1, 2
+
+@functools.lru_cache( maxsize=4096 )
+def hour_ms( hour ):
+    """Returns the time of an hour, e.g. "2020-10-22 11", in milliseconds since the epoch
+    (taking the log's local time as UTC).  The last 4096 hours parsed are remembered."""
+    return 1000*calendar.timegm( time.strptime( hour, '%Y-%m-%d %H' ) )
+
+def log_time_ms( line ):
+    """Returns the time at the beginning of a log line, e.g. "2020-10-22 11:32:12,345", in
+    milliseconds since the epoch (taking the log's local time as UTC).  The hour is parsed only
+    once; see hour_ms."""
+    return hour_ms( line[:13] ) + 60000*int(line[14:16]) + 1000*int(line[17:19]) +\
+        int(line[20:23])
+
+class TransferEvents:
+    """The columns are NumPy arrays, grown by doubling.  Events are appended to small buffers,
+    array.array's, which are copied into the columns every chunk events; call flush() before
+    using the columns directly.  The data_node names are in self.nodes, and the details (the
+    error types, or fallback destinations) in self.details; the node and detail columns index
+    these lists.  The detail of a done file is ''.  The ids are int16's, so there can be at most
+    max_id+1 data_nodes, and as many details; beyond that, OverflowError is raised."""
+    dtypes = [ ('time',np.int64,'q'), ('kind',np.int8,'b'), ('node',np.int16,'h'),
+               ('detail',np.int16,'h') ]
+    max_id = np.iinfo( np.int16 ).max
+    def __init__( self, details=(), chunk=65536 ):
+        self.chunk = chunk
+        self.n = 0
+        self.columns = { name: np.zeros( chunk, dtype ) for name, dtype, code in self.dtypes }
+        self.buffers = { name: array.array(code) for name, dtype, code in self.dtypes }
+        self.nodes = []
+        self.node_ids = {}
+        self.details = []
+        self.detail_ids = {}
+        for detail in [''] + list(details):
+            self.detail_id( detail )
+    def node_id( self, datanode ):
+        """Returns the id of a data_node, interning it if it's new."""
+        nid = self.node_ids.get( datanode )
+        if nid is None:
+            nid = len(self.nodes)
+            if nid>self.max_id:
+                raise OverflowError( "more than %d data_nodes in TransferEvents" % nid )
+            self.nodes.append( datanode )
+            self.node_ids[datanode] = nid
+        return nid
+    def detail_id( self, detail ):
+        """Returns the id of a detail, interning it if it's new."""
+        did = self.detail_ids.get( detail )
+        if did is None:
+            did = len(self.details)
+            if did>self.max_id:
+                raise OverflowError( "more than %d details in TransferEvents" % did )
+            self.details.append( detail )
+            self.detail_ids[detail] = did
+        return did
+    def append( self, time_ms, kind, datanode, detail='' ):
+        """Appends an event; kind is DONE, ERROR, or FALLBACK."""
+        buffers = self.buffers
+        buffers['time'].append( time_ms )
+        buffers['kind'].append( kind )
+        buffers['node'].append( self.node_id(datanode) )
+        buffers['detail'].append( self.detail_id(detail) )
+        if len(buffers['time'])>=self.chunk:
+            self.flush()
+    def flush( self ):
+        """Copies the buffered events into the columns."""
+        nbuf = len( self.buffers['time'] )
+        if nbuf==0:
+            return
+        self.extend( { name: np.frombuffer( self.buffers[name], dtype )
+                       for name, dtype, code in self.dtypes } )
+        self.buffers = { name: array.array(code) for name, dtype, code in self.dtypes }
+    def extend( self, columns ):
+        """Appends arrays of events, one for each column, to the columns."""
+        nnew = len( columns['time'] )
+        size = len( self.columns['time'] )
+        if self.n+nnew>size:
+            while self.n+nnew>size:
+                size *= 2
+            for name in self.columns:
+                grown = np.zeros( size, self.columns[name].dtype )
+                grown[:self.n] = self.columns[name][:self.n]
+                self.columns[name] = grown
+        for name in self.columns:
+            self.columns[name][self.n:self.n+nnew] = columns[name]
+        self.n += nnew
+    def column( self, name ):
+        """Returns a column ('time', 'kind', 'node', or 'detail') of all the events."""
+        self.flush()
+        return self.columns[name][:self.n]
+    def __len__( self ):
+        return self.n + len( self.buffers['time'] )
+    def nbytes( self ):
+        """Returns the memory used by the columns, in bytes."""
+        return sum([ column.nbytes for column in self.columns.values() ])
+    def merge( self, other ):
+        """Appends the events of another TransferEvents, whose ids may differ from ours."""
+        node_map = np.array( [ self.node_id(dn) for dn in other.nodes ], np.int16 )
+        detail_map = np.array( [ self.detail_id(d) for d in other.details ], np.int16 )
+        self.flush()
+        columns = { name: other.column(name) for name in self.columns }
+        columns['node'] = node_map[ columns['node'] ]
+        columns['detail'] = detail_map[ columns['detail'] ]
+        self.extend( columns )
+    def counts( self, since=None, until=None ):
+        """Returns the counts of events as a 3-D array, indexed by kind, node id, and detail id.
+        Only events with times (in ms since the epoch) from since up to but not including until
+        are counted, if those are supplied.  All the tables come from one pass over the
+        columns."""
+        nnodes, ndetails = len(self.nodes), len(self.details)
+        cells = self.column('kind').astype(np.int64)
+        cells *= nnodes
+        cells += self.column('node')
+        cells *= ndetails
+        cells += self.column('detail')
+        if since is not None or until is not None:
+            times = self.column('time')
+            selected = np.ones( self.n, bool )
+            if since is not None:
+                selected &= times>=since
+            if until is not None:
+                selected &= times<until
+            cells = cells[selected]
+        return np.bincount( cells, minlength=3*nnodes*ndetails ).reshape( 3, nnodes, ndetails )
+    def rows( self, kind, since=None, until=None, counts=None ):
+        """Returns the nonzero counts of events of the kind as a list of (data_node, detail,
+        count).  counts, from counts(), may be supplied to save recomputing it."""
+        if counts is None:
+            counts = self.counts( since, until )
+        table = counts[kind]
+        return [ ( self.nodes[i], self.details[j], int(table[i,j]) )
+                 for i, j in zip( *np.nonzero(table) ) ]
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""An in-memory index of the versions of the datasets in the Synda database, for answering
+"is this the latest version?" and "does a newer version exist?" without a query for each dataset.
+It's read from the dataset table by one query, and refreshed by another which reads only the
+datasets added since, i.e. those with a larger dataset_id.  For example:
+  versions = VersionIndex( conn )
+  ...
+  versions.refresh( conn )
+  if versions.newer_version_exists( dataset_functional_id ): ...
+"""
+
+class VersionIndex:
+    """For each dataset_functional_id, keeps its dataset_id, path_without_version, and version; and
+    for each path_without_version, the latest version.  Each distinct path is kept once, as a
+    key of self.paths, and the datasets refer to it by a small int, its index in self.latest.
+    The dataset_functional_ids are kept in full.  A dataset whose version is NULL has the
+    version at the end of its dataset_functional_id, e.g. 'v20190308'.
+    A deleted dataset, or one whose version is changed, isn't noticed by refresh(); but Synda
+    adds new versions as new datasets, so that's rarely a problem."""
+    def __init__( self, conn=None ):
+        self.datasets = {}   # dataset_functional_id -> (dataset_id, path id, version)
+        self.paths = {}      # path_without_version -> path id
+        self.latest = []     # path id -> latest version
+        self.max_id = 0      # the largest dataset_id read
+        if conn is not None:
+            self.refresh( conn )
+    def refresh( self, conn ):
+        """Reads the datasets added to the database since the last refresh; the first time,
+        all of them.  Returns the number of datasets read."""
+        curs = conn.cursor()
+        try:
+            curs.execute( "SELECT dataset_id, dataset_functional_id, path_without_version, "+
+                          "version FROM dataset WHERE dataset_id>? ORDER BY dataset_id",
+                          (self.max_id,) )
+            n = 0
+            for dataset_id, dataset_fid, path_without_version, version in curs:
+                self.add( dataset_id, dataset_fid, path_without_version, version )
+                n += 1
+        finally:
+            curs.close()
+        return n
+    def add( self, dataset_id, dataset_fid, path_without_version, version ):
+        """Adds one dataset to the index."""
+        if version is None:
+            version = dataset_fid[-9:]
+        if path_without_version is None:
+            pid = None
+        else:
+            pid = self.paths.get( path_without_version )
+            if pid is None:
+                pid = len(self.latest)
+                self.paths[path_without_version] = pid
+                self.latest.append( version )
+            elif version>self.latest[pid]:
+                self.latest[pid] = version
+        self.datasets[dataset_fid] = ( dataset_id, pid, version )
+        self.max_id = max( self.max_id, dataset_id )
+    def __contains__( self, dataset_fid ):
+        return dataset_fid in self.datasets
+    def __len__( self ):
+        return len(self.datasets)
+    def dataset_id( self, dataset_fid ):
+        """Returns the dataset_id of a dataset, or None if it isn't in the index."""
+        entry = self.datasets.get( dataset_fid )
+        return None if entry is None else entry[0]
+    def has_path( self, dataset_fid ):
+        """Returns True if the dataset is in the index and has a path_without_version."""
+        entry = self.datasets.get( dataset_fid )
+        return entry is not None and entry[1] is not None
+    def is_latest( self, dataset_fid ):
+        """Returns True if the dataset is the latest version of its path_without_version (or if
+        it hasn't one), False if there is a newer version, or None if it isn't in the index."""
+        entry = self.datasets.get( dataset_fid )
+        if entry is None:
+            return None
+        dataset_id, pid, version = entry
+        return pid is None or version>=self.latest[pid]
+    def newer_version_exists( self, dataset_fid ):
+        """Returns True if there is a newer version of the dataset, i.e. one with the same
+        path_without_version and a larger version; False if not or it isn't in the index."""
+        return self.is_latest( dataset_fid ) is False